@@ -3,22 +3,20 @@ import time
 
 # How to use limmy, by Adrian Ornelas
 
-# First, create motor objects. This will automatically start the heartbeat thread that keeps the motor alive.
+# First, create a group of motor objects. This will automatically start one heartbeat thread that keeps both motors alive.
 
 serial_port_1 = 'COM15' # Change this to the serial port of your VESC, on Linux (Raspberry Pi) it will be something like '/dev/ttyUSB0'
 serial_port_2 = 'COM8'
 
-print('[INFO] Initializing motor 1 on port: ', serial_port_1)
-motor_1 = limmy.VESC(serial_port=serial_port_1)
-print('[INFO] Initializing motor 2 on port: ', serial_port_2)
-motor_2 = limmy.VESC(serial_port=serial_port_2)
+print('[INFO] Initializing motors on ports: ', serial_port_1, serial_port_2)
+motors = limmy.VESCGroup([serial_port_1, serial_port_2])
 
-print("Firmware 1: ", motor_1.get_firmware_version())
-print("Firmware 2: ", motor_2.get_firmware_version())
+print("Firmware 1: ", motors[0].get_firmware_version())
+print("Firmware 2: ", motors[1].get_firmware_version())
 time.sleep(1) # Wait for the motor controller to respond and set up Comms
 
-# Motor can be started via motor.engage command:
-    # The utilization for the command is: motor.engage(current, frequency)
+# Motors can be started via motors.engage_only command, which also halts the other motor in the same burst:
+    # The utilization for the command is: motors.engage_only(index, current, frequency)
     # Where current, I, is in Amps and is a float above 0.0
     # And frequency, f, is in Hz and is an float above 0.0
 
@@ -33,25 +31,20 @@ input('[INFO] Wait for input to start')
 
 while run:
     if direction:
-        motor_2.halt()
-        motor_1.engage(I, f)
+        motors.engage_only(0, I, f)
         direction = False
     else:
-        motor_1.halt()
-        motor_2.engage(I, f)
+        motors.engage_only(1, I, f)
         direction = True
     val = input("Enter: Change directions, Space: Change parameters, Any other key: Abort")
     if val == ' ':
-        motor_1.halt()
-        motor_2.halt()
+        motors.halt()
         I = float(input("Enter current: "))
         val = ''
     run = val == ''
 
-motor_1.halt()
-motor_2.halt()
+motors.halt()
 
 time.sleep(1)
 
-motor_1.stop_heartbeat()
-motor_2.stop_heartbeat()
\ No newline at end of file
+motors.close()
\ No newline at end of file
@@ -0,0 +1,527 @@
+from limmy.protocol.interface import encode, encode_cached
+from limmy.protocol.base import VESCMessage
+from limmy.protocol.packet.codec import Stateful
+from limmy.VESC.messages import *
+from limmy.transport import Transport, open_transport
+from limmy.VESC.profile import DeviceProfile, open_cache, profile_key
+import asyncio
+import collections
+import logging
+import os
+import struct
+import threading
+import time
+
+# because people may want to use this library for their own messaging, do not make this a required package
+try:
+    import serial
+except ImportError:
+    serial = None
+
+_logger = logging.getLogger(__name__)
+
+
+class _ReadProtocol(asyncio.Protocol):
+    """
+    Feeds everything read from the serial fd into the owning AsyncVESC.
+    """
+    def __init__(self, vesc):
+        self._vesc = vesc
+
+    def data_received(self, data):
+        self._vesc._data_received(data)
+
+    def connection_lost(self, exc):
+        self._vesc._fail_pending(exc or ConnectionError("Serial port closed."))
+
+
+class _WriteProtocol(asyncio.BaseProtocol):
+    """
+    Tracks flow control of the write side so writers can wait for the kernel buffer to drain.
+    """
+    def __init__(self):
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+
+    def pause_writing(self):
+        self._can_write.clear()
+
+    def resume_writing(self):
+        self._can_write.set()
+
+    def connection_lost(self, exc):
+        self._can_write.set()
+
+    async def drain(self):
+        await self._can_write.wait()
+
+
+class _TransportBridge(object):
+    """
+    Runs a blocking limmy.transport.Transport next to the event loop. A thread reads the transport and hands the data
+    to the loop, writes go straight to the transport. Stands in for both the write transport and its protocol.
+    """
+    def __init__(self, transport, vesc, loop):
+        self.transport = transport
+        self._vesc = vesc
+        self._loop = loop
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_loop, name="AsyncVESC transport", daemon=True)
+        self._thread.start()
+
+    def _read_loop(self):
+        buffer = bytearray(4096)
+        while not self._stop.is_set():
+            try:
+                count = self.transport.readinto(buffer)
+            except Exception as e:
+                if not self._stop.is_set():
+                    self._call(self._vesc._fail_pending, e)
+                return
+            if count:
+                self._call(self._vesc._data_received, bytes(buffer[:count]))
+
+    def _call(self, callback, *args):
+        try:
+            self._loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # the loop was closed under us
+            self._stop.set()
+
+    def write(self, data):
+        self.transport.write(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self._stop.set()
+        self.transport.close()
+
+
+class AsyncVESC(object):
+    """
+    asyncio counterpart of limmy.VESC. A serial fd is driven by the running event loop, so no threads are used for
+    reading, writing or the heartbeat. Other transports (TCP, SocketCAN, loopback) are read by one helper thread. Use
+    it as an async context manager, or call open and close yourself:
+
+        async with AsyncVESC(serial_port='/dev/ttyACM0') as motor:
+            await motor.set_rpm(1000)
+            print(await motor.get_rpm())
+    """
+    def __init__(self, serial_port, has_sensor=False, start_heartbeat=True, baudrate=115200, response_timeout=0.5,
+                 measurement_max_age=0.0, profile_cache=None, probe=True, probe_timeout=None):
+        """
+        :param serial_port: Serial device to use for communication (i.e. "/dev/ttyACM0"), a transport URL (see
+                            limmy.transport.open_transport) or an open limmy.transport.Transport
+        :param has_sensor: Whether or not the bldc motor is using a hall effect sensor
+        :param start_heartbeat: Whether or not to automatically start the heartbeat task that will keep commands alive.
+        :param baudrate: baudrate for the serial communication. Shouldn't need to change this.
+        :param response_timeout: default number of seconds to wait for the VESC to answer a request
+        :param measurement_max_age: default age in seconds up to which a cached measurement is reused by the getters
+        :param profile_cache: limmy.VESC.profile.ProfileCache, the path of its file or True for the default file. If it
+                              holds a profile of serial_port open doesn't wait for the VESC, the profile is checked
+                              against the VESC by a background task (see profile_check).
+        :param probe: whether open reads the firmware version of the VESC, see VESC
+        :param probe_timeout: seconds to wait for the firmware version, defaults to response_timeout
+        """
+        if serial is None and AsyncVESC._is_serial_path(serial_port):
+            raise ImportError("Need to install pyserial in order to use the AsyncVESC class with a serial port.")
+
+        self.port = serial_port
+        self.baudrate = baudrate
+        self.response_timeout = response_timeout
+        self.measurement_max_age = measurement_max_age
+        # last GetValues sample, and the request in flight that every concurrent caller shares
+        self._measurement = None
+        self._measurement_time = 0.0
+        self._measurement_task = None
+        self._has_sensor = has_sensor
+        self._start_heartbeat = start_heartbeat
+        self.serial_port = None
+        self._read_transport = None
+        self._write_transport = None
+        self._write_protocol = None
+        self._heartbeat_task = None
+        self._unpacker = Stateful()
+        self._pending = collections.defaultdict(collections.deque)
+        self._get_values_msg = get_values_msg
+        # message class per VedderCmd id decoding that id instead of the registered class, see Reader.decoders
+        self._decoders = {}
+        self.profile = None
+        # set by open, resolves to the profile once the VESC confirmed it, to None if it wasn't probed or the probe
+        # failed
+        self.profile_check = None
+        self._profile_cache = open_cache(profile_cache)
+        self._profile_key = profile_key(serial_port)
+        self._probe = probe
+        self._probe_timeout = response_timeout if probe_timeout is None else probe_timeout
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @staticmethod
+    def _is_serial_path(port):
+        return isinstance(port, str) and '://' not in port
+
+    async def open(self):
+        """
+        Opens the port, starts the heartbeat task if requested and probes the firmware version, in the background if
+        the profile cache has a profile of the port.
+        """
+        loop = asyncio.get_running_loop()
+        if AsyncVESC._is_serial_path(self.port):
+            # pyserial only configures the port (baudrate, raw mode), all I/O goes through the event loop
+            self.serial_port = serial.Serial(port=self.port, baudrate=self.baudrate, timeout=0)
+            write_pipe = os.fdopen(os.dup(self.serial_port.fileno()), 'wb', buffering=0)
+            self._read_transport, _ = await loop.connect_read_pipe(lambda: _ReadProtocol(self), self.serial_port)
+            self._write_transport, self._write_protocol = await loop.connect_write_pipe(_WriteProtocol, write_pipe)
+        else:
+            # connecting may block (i.e. TCP), keep it off the loop
+            transport = self.port if isinstance(self.port, Transport) else \
+                await loop.run_in_executor(None, open_transport, self.port, self.baudrate)
+            self.serial_port = transport
+            self._write_transport = self._write_protocol = _TransportBridge(transport, self, loop)
+        try:
+            if self._has_sensor:
+                await self.write(encode(SetRotorPositionMode(SetRotorPositionMode.DISP_POS_OFF)))
+            if self._start_heartbeat:
+                self.start_heartbeat()
+
+            # the firmware version picks the GetValues layout, a cached profile saves waiting for the VESC to tell it
+            cached = None
+            self.profile_check = None
+            if self._profile_cache is not None and self._profile_key is not None:
+                cached = await loop.run_in_executor(None, self._profile_cache.get, self._profile_key)
+            if cached is not None:
+                self._apply_profile(cached)
+                if self._probe:
+                    self.profile_check = loop.create_task(self._check_profile())
+            elif self._probe:
+                await self._update_profile(await self.get_firmware_version(self._probe_timeout))
+            if self.profile_check is None:
+                self.profile_check = loop.create_future()
+                self.profile_check.set_result(self.profile if self._probe else None)
+        except BaseException:
+            # don't leave the port open if the VESC never answers
+            await self.close()
+            raise
+
+    async def close(self):
+        """
+        Stops the heartbeat and closes the port.
+        """
+        await self.stop_heartbeat()
+        if self.profile_check is not None and not self.profile_check.done():
+            self.profile_check.cancel()
+        if self._write_transport is not None:
+            self._write_transport.close()
+            self._write_transport = None
+        if self._read_transport is not None:
+            # also closes self.serial_port
+            self._read_transport.close()
+            self._read_transport = None
+        self._fail_pending(ConnectionError("Port closed."))
+
+    @property
+    def firmware_version(self):
+        """
+        Firmware version from the device profile, None if it is unknown. Unlike get_firmware_version this doesn't
+        ask the VESC.
+        """
+        return self.profile.version if self.profile is not None else None
+
+    @property
+    def values_class(self):
+        """
+        Message class GetValues responses of this VESC are decoded into, its fields depend on the firmware version.
+        """
+        return self._decoders.get(GetValues.id, GetValues)
+
+    def _apply_profile(self, profile):
+        """
+        Decodes GetValues responses with the layout of the profile's firmware.
+        """
+        self.profile = profile
+        if profile.values_class is GetValues:
+            self._decoders.pop(GetValues.id, None)
+        else:
+            self._decoders[GetValues.id] = profile.values_class
+
+    async def _update_profile(self, version):
+        """
+        Applies the firmware version read from the VESC and caches it if it changed.
+        :return: the profile
+        """
+        profile = self.profile
+        if profile is None or profile.version != version:
+            capabilities = profile.capabilities if profile is not None else None
+            profile = DeviceProfile(self._profile_key, version, capabilities)
+            self._apply_profile(profile)
+            if self._profile_cache is not None and self._profile_key is not None:
+                # keep the disk off the loop
+                await asyncio.get_running_loop().run_in_executor(None, self._profile_cache.put, profile)
+        return profile
+
+    async def _check_profile(self):
+        """
+        Background task reading the firmware version and replacing the cached profile if it is stale.
+        """
+        cached = self.profile
+        try:
+            version = await self.get_firmware_version(self._probe_timeout)
+        except Exception as e:
+            if self._write_transport is not None:
+                _logger.warning('Could not check the cached profile of %s: %r', cached.port, e)
+            return None
+        if version != cached.version:
+            _logger.warning('%s runs firmware %s, its cached profile said %s. Profile updated.',
+                            cached.port, version, cached.version)
+        return await self._update_profile(version)
+
+    async def _heartbeat_cmd_func(self):
+        """
+        Continuous task that keeps the motor alive
+        """
+        while True:
+            await asyncio.sleep(0.1)
+            await self.write(alive_msg)
+
+    def start_heartbeat(self):
+        """
+        Starts a repetitive sending of the alive message to keep the motor alive. Must be called from the event loop.
+        """
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat_cmd_func())
+
+    async def stop_heartbeat(self):
+        """
+        Stops the heartbeat task.
+        """
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+
+    async def write(self, data, response_id=None, timeout=None):
+        """
+        Writes a packet and optionally waits for the response to it.
+        :param data: the byte string to be sent
+        :param response_id: VedderCmd id of the response to wait for, None if no response is expected
+        :param timeout: seconds to wait for the response, defaults to response_timeout
+        :return: decoded response, or None if no response was expected
+        """
+        if self._write_transport is None:
+            raise ConnectionError("AsyncVESC is not open.")
+        future = None
+        if response_id is not None:
+            # register before writing so a fast response can't be missed
+            future = asyncio.get_running_loop().create_future()
+            self._pending[response_id].append(future)
+        self._write_transport.write(data)
+        await self._write_protocol.drain()
+        if future is not None:
+            timeout = self.response_timeout if timeout is None else timeout
+            try:
+                # wait_for cancels the future on timeout, so a late response is not handed to the next caller
+                return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                raise asyncio.TimeoutError("No response received within %s seconds." % timeout)
+
+    def _data_received(self, data):
+        for payload in self._unpacker.feed(data):
+            queue = self._pending.get(payload[0])
+            while queue:
+                future = queue.popleft()
+                if future.done():
+                    # abandoned after a timeout
+                    continue
+                try:
+                    future.set_result(VESCMessage.unpack(payload, self._decoders.get(payload[0])))
+                except (KeyError, struct.error, UnicodeDecodeError) as e:
+                    future.set_exception(e)
+                break
+
+    def _fail_pending(self, exception):
+        pending = [future for queue in self._pending.values() for future in queue]
+        self._pending.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(exception)
+
+    async def engage(self, current, frequency):
+        """
+        Engage the motor
+        :param current: current to send to the motor
+        :param frequency: frequency to send to the motor
+        """
+        await self.write(encode_engage(current, frequency))
+
+    async def halt(self):
+        """
+        Halt the motor by setting output current to 0 Amps
+        """
+        await self.write(halt_msg)
+
+    async def send_terminal_cmd(self, cmd):
+        """
+        Send a terminal command to the VESC
+        :param cmd: terminal command to send
+        """
+        await self.write(encode_cached(SendTerminalCMD, cmd))
+
+    async def set_gpd_freq(self, new_gpd_freq):
+        """
+        Set the gpd frequency
+        :param new_gpd_freq: new gpd frequency
+        """
+        await self.write(encode_cached(SetGPDFreq, new_gpd_freq))
+
+    async def set_gpd_mode(self, new_gpd_mode):
+        """
+        Set the gpd mode, follow the VedderGPD enum for more info
+        :param new_gpd_mode: new gpd mode
+        """
+        await self.write(encode_cached(SetGPDMode, new_gpd_mode))
+
+    async def set_gpd_output_sample(self, gpd_sample):
+        """
+        Set the gpd output sample
+        :param gpd_sample: new gpd output sample
+        """
+        await self.write(encode(SetGPDOutputSample(gpd_sample)))
+
+    async def set_gpd_fill_buffer(self, gpd_sample):
+        """
+        Set the gpd fill buffer
+        :param gpd_sample: new gpd fill buffer
+        """
+        await self.write(encode(SetGPDFillBuffer(gpd_sample)))
+
+    async def set_gpd_int_scale(self, scale):
+        """
+        Set the gpd int scale
+        :param scale: new gpd int scale
+        """
+        await self.write(encode_cached(SetGPDIntScale, scale))
+
+    async def set_rpm(self, new_rpm):
+        """
+        Set the electronic RPM value (a.k.a. the RPM value of the stator)
+        :param new_rpm: new rpm value
+        """
+        await self.write(encode_cached(SetRPM, new_rpm))
+
+    async def set_speed_mph(self, new_speed_mph):
+        """
+        Set the speed in mph
+        :param new_speed_mph: new speed in mph
+        """
+        await self.write(encode_cached(SetRPM, new_speed_mph*784))
+
+    async def set_current(self, new_current):
+        """
+        :param new_current: new current in milli-amps for the motor
+        """
+        await self.write(encode_cached(SetCurrent, new_current))
+
+    async def set_duty_cycle(self, new_duty_cycle):
+        """
+        :param new_duty_cycle: Value of duty cycle to be set (range [-1e5, 1e5]).
+        """
+        await self.write(encode_cached(SetDutyCycle, new_duty_cycle))
+
+    async def set_servo(self, new_servo_pos):
+        """
+        :param new_servo_pos: New servo position. valid range [0, 1]
+        """
+        await self.write(encode_cached(SetServoPosition, new_servo_pos))
+
+    async def get_measurements(self, max_age=None):
+        """
+        Returns the latest measurements. A sample taken less than max_age seconds ago is reused, and callers arriving
+        while a request is in flight wait for that request instead of sending their own.
+        :param max_age: maximum age in seconds of a cached sample, defaults to measurement_max_age
+        :return: A msg object with attributes containing the measurement values
+        """
+        max_age = self.measurement_max_age if max_age is None else max_age
+        if self._measurement is not None and time.monotonic() - self._measurement_time <= max_age:
+            return self._measurement
+        if self._measurement_task is None:
+            self._measurement_task = asyncio.ensure_future(self._request_measurements())
+        # shield so a cancelled caller doesn't cancel the request other callers are waiting on
+        return await asyncio.shield(self._measurement_task)
+
+    async def _request_measurements(self):
+        request_time = time.monotonic()
+        try:
+            msg = await self.write(self._get_values_msg, response_id=GetValues.id)
+        finally:
+            self._measurement_task = None
+        self._measurement = msg
+        self._measurement_time = request_time
+        return msg
+
+    async def get_values(self, *fields, max_age=None):
+        """
+        Reads several fields from one measurement sample, i.e. rpm, v_in = await motor.get_values('rpm', 'v_in')
+        :param fields: names of GetValues fields
+        :param max_age: maximum age in seconds of a cached sample, defaults to measurement_max_age
+        :return: tuple with the value of each field
+        """
+        msg = await self.get_measurements(max_age)
+        return tuple(getattr(msg, field) for field in fields)
+
+    async def get_values_selective(self, *fields, timeout=None):
+        """
+        Requests only the named fields (COMM_GET_VALUES_SELECTIVE), which keeps the response short on slow links.
+        :param fields: names of the fields to request, see limmy.VESC.messages.selective_fields
+        :param timeout: seconds to wait for the response, defaults to response_timeout
+        :return: A msg object with an attribute for each requested field
+        """
+        return await self.write(encode(GetValuesSelective.from_fields(*fields)), response_id=GetValuesSelective.id,
+                                timeout=timeout)
+
+    async def get_firmware_version(self, timeout=None):
+        """
+        :param timeout: seconds to wait for the response, defaults to response_timeout
+        :return: firmware version string, i.e. "6.0.1"
+        """
+        return str(await self.write(get_version_msg, response_id=GetVersion.id, timeout=timeout))
+
+    async def get_rpm(self):
+        """
+        :return: Current motor rpm
+        """
+        return (await self.get_measurements()).rpm
+
+    async def get_duty_cycle(self):
+        """
+        :return: Current applied duty-cycle
+        """
+        return (await self.get_measurements()).duty_cycle_now
+
+    async def get_v_in(self):
+        """
+        :return: Current input voltage
+        """
+        return (await self.get_measurements()).v_in
+
+    async def get_motor_current(self):
+        """
+        :return: Current motor current
+        """
+        return (await self.get_measurements()).avg_motor_current
+
+    async def get_incoming_current(self):
+        """
+        :return: Current incoming current
+        """
+        return (await self.get_measurements()).avg_input_current
@@ -1,96 +1,458 @@
-from limmy.protocol.interface import encode_request, encode, decode
+from limmy.protocol.interface import encode, encode_cached, encode_request_cached
 from limmy.VESC.messages import *
+from limmy.VESC.reader import Reader
+from limmy.VESC.keepalive import KeepaliveScheduler
+from limmy.VESC.writer import Writer, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from limmy.VESC.profile import DeviceProfile, open_cache, profile_key
+from concurrent.futures import Future, TimeoutError
+import logging
 import time
 import threading
 import struct
 
-# because people may want to use this library for their own messaging, do not make this a required package
-try:
-    import serial
-except ImportError:
-    serial = None
+_logger = logging.getLogger(__name__)
+
+
+class _CanRoute(object):
+    """
+    Responses forwarded from CAN don't say which node sent them, so once CAN nodes are in use only one request per port
+    may be outstanding. Shared by the VESC on the port and its CAN handles.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # future of the outstanding request and time.monotonic() it was made, None while the route is free
+        self._outstanding = None
+
+    def acquire(self, reader, timeout):
+        """
+        Waits for the outstanding request to finish. A request still unanswered after timeout is abandoned like
+        Reader.wait does, so a lost response can't block the port when its caller hasn't waited on it yet.
+        :raises TimeoutError: if the route is still busy after that
+        """
+        if self._lock.acquire(timeout=timeout):
+            return
+        outstanding = self._outstanding
+        if outstanding is not None and time.monotonic() - outstanding[1] >= timeout and outstanding[0].cancel():
+            reader.timeouts += 1
+        if not self._lock.acquire(timeout=timeout):
+            raise TimeoutError("Another request through this port is still outstanding after %s seconds." % timeout)
+
+    def hold(self, future):
+        """
+        Keeps the route until future is done. Must be called after acquire.
+        """
+        self._outstanding = (future, time.monotonic())
+        future.add_done_callback(self._release)
+
+    def release(self):
+        self._outstanding = None
+        self._lock.release()
+
+    def _release(self, future):
+        self.release()
 
 
 class VESC(object):
-    def __init__(self, serial_port, has_sensor=False, start_heartbeat=True, baudrate=115200, timeout=0.05):
+    def __init__(self, serial_port, has_sensor=False, start_heartbeat=True, baudrate=115200, timeout=0.05,
+                 response_timeout=0.5, measurement_max_age=0.0, profile_cache=None, probe=True, probe_timeout=None):
         """
-        :param serial_port: Serial device to use for communication (i.e. "COM3" or "/dev/tty.usbmodem0")
+        :param serial_port: Serial device to use for communication (i.e. "COM3" or "/dev/tty.usbmodem0"), a transport
+                            URL (i.e. "tcp://192.168.4.1:65102" or "socketcan://can0/12", see open_transport) or an
+                            open limmy.transport.Transport
         :param has_sensor: Whether or not the bldc motor is using a hall effect sensor
         :param start_heartbeat: Whether or not to automatically start the heartbeat thread that will keep commands
                                 alive.
         :param baudrate: baudrate for the serial communication. Shouldn't need to change this.
-        :param timeout: timeout for the serial communication
-        """
-
-        if serial is None:
-            raise ImportError("Need to install pyserial in order to use the VESCMotor class.")
-
-        self.serial_port = serial.Serial(port=serial_port, baudrate=baudrate, timeout=timeout)
+        :param timeout: read timeout of the transport
+        :param response_timeout: default number of seconds to wait for the VESC to answer a request
+        :param measurement_max_age: default age in seconds up to which a cached measurement is reused by the getters
+        :param profile_cache: limmy.VESC.profile.ProfileCache, the path of its file or True for the default file. If it
+                              holds a profile of serial_port the constructor doesn't wait for the VESC, the profile is
+                              checked against the VESC in the background (see profile_check).
+        :param probe: whether to read the firmware version of the VESC. Without a cached profile the constructor waits
+                      for it; with neither, the GetValues layout of current firmware is assumed.
+        :param probe_timeout: seconds to wait for the firmware version, defaults to response_timeout
+        """
+
+        from limmy.transport import open_transport
+        self.transport = open_transport(serial_port, baudrate, timeout)
+        # kept under its old name for code written against the serial only versions
+        self.serial_port = self.transport
+        # None for the VESC on the serial port, the CAN id of the node for handles returned by can()
+        self.can_id = None
+        self.response_timeout = response_timeout
+        # time.monotonic() of the last command written, the keepalive skips the alive message while commands flow
+        self.last_command_time = 0.0
+        self.heartbeat_interval = 0.1
+        self.heartbeat_missed = 0
+        self._init_measurement_cache(measurement_max_age)
+        # the only thread writing to the port, frames from several threads never interleave and halts jump the queue
+        self._writer = Writer(self.serial_port)
+        self._writer.start()
+        # keeps registering a request and queueing it atomic, so requests go out in the order their futures wait
+        self._write_lock = threading.Lock()
+        # decodes frames as they arrive and hands each response to the request waiting on it
+        self._reader = Reader(self.serial_port)
+        self._reader.start()
+        # handles of the CAN nodes reached through this port, shared with those handles
+        self._can_nodes = {}
+        self._route = _CanRoute()
         if has_sensor:
-            self.serial_port.write(encode(SetRotorPositionMode(SetRotorPositionMode.DISP_POS_OFF)))
-
-        self.heart_beat_thread = threading.Thread(target=self._heartbeat_cmd_func)
-        self._stop_heartbeat = threading.Event()
+            self.write(self._encode(SetRotorPositionMode(SetRotorPositionMode.DISP_POS_OFF)))
 
         if start_heartbeat:
             self.start_heartbeat()
 
-        # check firmware version and set GetValue fields to old values if pre version 3.xx
-        version = self.get_firmware_version()
-        if int(version.split('.')[0]) < 3:
-            GetValues.fields = pre_v3_33_fields
+        # the firmware version picks the GetValues layout, a cached profile saves waiting for the VESC to tell it
+        self.profile = None
+        # resolves to the profile once the VESC confirmed it, to None if it wasn't probed or the probe failed
+        self.profile_check = Future()
+        self._profile_cache = open_cache(profile_cache)
+        self._profile_key = profile_key(serial_port)
+        probe_timeout = response_timeout if probe_timeout is None else probe_timeout
+        cached = None
+        if self._profile_cache is not None and self._profile_key is not None:
+            cached = self._profile_cache.get(self._profile_key)
+        if cached is not None:
+            self._apply_profile(cached)
+            if probe:
+                threading.Thread(target=self._check_profile, args=(probe_timeout,), name='limmy-probe',
+                                 daemon=True).start()
+            else:
+                self.profile_check.set_result(None)
+        elif probe:
+            try:
+                version = self.get_firmware_version(probe_timeout)
+            except Exception:
+                # don't leave the threads running if the VESC never answers
+                self.__exit__(None, None, None)
+                raise
+            self.profile_check.set_result(self._update_profile(version))
+        else:
+            self.profile_check.set_result(None)
 
         # store message info for getting values so it doesn't need to calculate it every time
-        msg = GetValues()
-        self._get_values_msg = encode_request(msg)
-        self._get_values_msg_expected_length = msg._full_msg_size
+        self._get_values_msg = get_values_msg
+        self._alive_msg = alive_msg
+        self._halt_msg = halt_msg
+
+    @property
+    def firmware_version(self):
+        """
+        Firmware version from the device profile, None if it is unknown. Unlike get_firmware_version this doesn't
+        ask the VESC.
+        """
+        return self.profile.version if self.profile is not None else None
+
+    @property
+    def values_class(self):
+        """
+        Message class GetValues responses of this VESC are decoded into, its fields depend on the firmware version.
+        """
+        return self._reader.decoders.get(GetValues.id, GetValues)
+
+    def _apply_profile(self, profile):
+        """
+        Decodes GetValues responses with the layout of the profile's firmware.
+        """
+        self.profile = profile
+        if profile.values_class is GetValues:
+            self._reader.decoders.pop(GetValues.id, None)
+        else:
+            self._reader.decoders[GetValues.id] = profile.values_class
+
+    def _update_profile(self, version):
+        """
+        Applies the firmware version read from the VESC and caches it if it changed.
+        :return: the profile
+        """
+        profile = self.profile
+        if profile is None or profile.version != version:
+            capabilities = profile.capabilities if profile is not None else None
+            profile = DeviceProfile(self._profile_key, version, capabilities)
+            self._apply_profile(profile)
+            self._save_profile()
+        return profile
+
+    def _save_profile(self):
+        if self._profile_cache is not None and self._profile_key is not None:
+            self._profile_cache.put(self.profile)
+
+    def _check_profile(self, timeout):
+        """
+        Runs on a background thread, reads the firmware version and replaces the cached profile if it is stale.
+        """
+        cached = self.profile
+        try:
+            version = self.get_firmware_version(timeout)
+        except Exception as e:
+            if self._reader.is_alive():
+                _logger.warning('Could not check the cached profile of %s: %r', cached.port, e)
+            self.profile_check.set_result(None)
+            return
+        if version != cached.version:
+            _logger.warning('%s runs firmware %s, its cached profile said %s. Profile updated.',
+                            cached.port, version, cached.version)
+        self.profile_check.set_result(self._update_profile(version))
+
+    def _init_measurement_cache(self, measurement_max_age):
+        self.stream = None
+        self.measurement_max_age = measurement_max_age
+        # last GetValues sample, and the request in flight that every concurrent caller shares
+        self._measurement = None
+        self._measurement_time = 0.0
+        self._measurement_future = None
+        self._measurement_lock = threading.Lock()
+
+    def can(self, can_id):
+        """
+        Returns a handle to a VESC on the CAN bus behind this one. The handle has the same methods as this object and
+        shares its transport, every command it sends is wrapped in COMM_FORWARD_CAN. Starting the heartbeat of this
+        object also starts the heartbeat of every handle.
+        :param can_id: CAN id of the node (see ping_can)
+        :return: VESC handle for the node
+        """
+        if self.can_id is not None:
+            raise ValueError("CAN handles can only be created from the VESC connected to the serial port.")
+        node = self._can_nodes.get(can_id)
+        if node is None:
+            node = VESC.__new__(VESC)
+            node.transport = self.transport
+            node.serial_port = self.transport
+            node.can_id = can_id
+            node.response_timeout = self.response_timeout
+            node.last_command_time = 0.0
+            node.heartbeat_interval = self.heartbeat_interval
+            node.heartbeat_missed = 0
+            # nodes may run other firmware, but their responses are decoded by the reader of the port
+            node.profile = None
+            node.profile_check = self.profile_check
+            node._profile_cache = None
+            node._profile_key = None
+            node._init_measurement_cache(self.measurement_max_age)
+            node._writer = self._writer
+            node._write_lock = self._write_lock
+            node._reader = self._reader
+            node._can_nodes = self._can_nodes
+            node._route = self._route
+            node._get_values_msg = node._encode_request(GetValues)
+            node._alive_msg = node._encode(Alive())
+            node._halt_msg = node._encode(SetCurrent(0))
+            self._can_nodes[can_id] = node
+            if self in KeepaliveScheduler.shared():
+                node.start_heartbeat()
+        return node
+
+    def ping_can(self, timeout=3.0):
+        """
+        Asks the VESC on the serial port which nodes answer on its CAN bus (COMM_PING_CAN). The firmware pings every
+        possible id, so this takes a few seconds.
+        :param timeout: seconds to wait for the response
+        :return: list of CAN ids
+        """
+        can_ids = self.write(self._encode_request(PingCAN), response_id=PingCAN.id, timeout=timeout).can_ids
+        if self.profile is not None and self.profile.capabilities.get('can_ids') != can_ids:
+            # remembered so a program can reconnect its nodes without pinging again
+            self.profile.capabilities['can_ids'] = can_ids
+            self._save_profile()
+        return can_ids
+
+    def _encode(self, msg):
+        """
+        Encodes a message for this VESC, forwarding it over CAN for CAN handles.
+        """
+        msg.can_id = self.can_id
+        return encode(msg)
+
+    def _encode_cached(self, msg_cls, *values):
+        """
+        Encodes a message for this VESC from its field values, reusing the packet if the same message was encoded
+        recently. See encode_cached.
+        """
+        return encode_cached(msg_cls, *values, can_id=self.can_id)
+
+    def _encode_request(self, msg_cls):
+        """
+        Encodes a getter request for this VESC, forwarding it over CAN for CAN handles.
+        """
+        return encode_request_cached(msg_cls, self.can_id)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop_stream()
+        if self.can_id is not None:
+            # CAN handles share the port of their parent, which owns it
+            self.stop_heartbeat()
+            self._can_nodes.pop(self.can_id, None)
+            return
         self.stop_heartbeat()
-        if self.serial_port.is_open:
-            self.serial_port.flush()
-            self.serial_port.close()
+        # let queued frames (i.e. a final halt) go out before closing
+        self._writer.stop(timeout=1.0)
+        self._reader.stop()
+        self.stop_recording()
+        if self.transport.is_open:
+            self.transport.flush()
+            self.transport.close()
 
-    def _heartbeat_cmd_func(self):
+    def start_heartbeat(self):
         """
-        Continuous function calling that keeps the motor alive
+        Keeps the motor alive by sending an alive message whenever no other command was sent for heartbeat_interval
+        seconds. Every VESC shares one keepalive thread, see KeepaliveScheduler. Also covers the CAN handles of this
+        VESC. May be called again after stop_heartbeat.
         """
-        while not self._stop_heartbeat.isSet():
-            time.sleep(0.1)
-            self.write(alive_msg)
+        keepalive = KeepaliveScheduler.shared()
+        keepalive.register(self, self.heartbeat_interval)
+        if self.can_id is None:
+            for node in list(self._can_nodes.values()):
+                keepalive.register(node, node.heartbeat_interval)
 
-    def start_heartbeat(self):
+    def stop_heartbeat(self):
         """
-        Starts a repetitive calling of the last set cmd to keep the motor alive.
+        Stops keeping the motor (and its CAN handles) alive, the VESC then stops the motor after its timeout.
         """
-        self.heart_beat_thread.start()
+        keepalive = KeepaliveScheduler.shared()
+        keepalive.unregister(self)
+        if self.can_id is None:
+            for node in list(self._can_nodes.values()):
+                keepalive.unregister(node)
 
-    def stop_heartbeat(self):
+    def start_stream(self, rate, capacity=10000):
+        """
+        Starts polling GetValues at a fixed rate on a background thread. Samples are timestamped and written into
+        preallocated ring buffers, read them with self.stream.latest(n) or self.stream.column(name, n).
+        :param rate: samples per second
+        :param capacity: number of samples kept
+        :return: the TelemetryStream, also available as self.stream
+        """
+        # the stream and GPD modules use numpy, which is slow to import, so they are only imported when used
+        from limmy.VESC.stream import TelemetryStream
+        self.stop_stream()
+        self.stream = TelemetryStream(self, rate, capacity)
+        self.stream.start()
+        return self.stream
+
+    def stop_stream(self):
         """
-        Stops the heartbeat thread and resets the last cmd function. THIS MUST BE CALLED BEFORE THE OBJECT GOES OUT OF
-        SCOPE UNLESS WRAPPING IN A WITH STATEMENT (Assuming the heartbeat was started).
+        Stops the telemetry stream if it is running. The samples stay available in self.stream.
         """
-        if self.heart_beat_thread.is_alive():
-            self._stop_heartbeat.set()
-            self.heart_beat_thread.join()
+        if getattr(self, 'stream', None) is not None:
+            self.stream.stop()
 
-    def write(self, data, num_read_bytes=None):
+    def write(self, data, response_id=None, timeout=None, priority=PRIORITY_NORMAL, supersede=False):
         """
         A write wrapper function implemented like this to try and make it easier to incorporate other communication
-        methods than UART in the future.
+        methods than UART in the future. Safe to call from several threads at once. Commands are queued for the writer
+        thread and this returns without waiting for them to go out.
         :param data: the byte string to be sent
-        :param num_read_bytes: number of bytes to read for decoding response
-        :return: decoded response from buffer
-        """
-        self.serial_port.write(data)
-        if num_read_bytes is not None:
-            while self.serial_port.in_waiting <= num_read_bytes:
-                time.sleep(0.000001)  # add some delay just to help the CPU
-            response, consumed = decode(self.serial_port.read(self.serial_port.in_waiting))
-            return response
+        :param response_id: VedderCmd id of the response to wait for, None if no response is expected
+        :param timeout: seconds to wait for the response, defaults to response_timeout
+        :param priority: transmit lane, PRIORITY_HIGH is for safety commands
+        :param supersede: drop commands to this VESC still queued in lower lanes, see Writer.put
+        :return: decoded response, or None if no response was expected
+        """
+        if response_id is None:
+            self._writer.put(data, priority, self.can_id, True, supersede)
+            self.last_command_time = time.monotonic()
+            return None
+        return self.wait(self.request(data, response_id, priority=priority, timeout=timeout), timeout)
+
+    def request(self, data, response_id, raw=False, priority=PRIORITY_NORMAL, timeout=None):
+        """
+        Writes a request without waiting for the response, so requests to several VESCs can be in flight at once. Once
+        CAN nodes are in use, requests through the same port go out one at a time, see _CanRoute.
+        :param data: the byte string to be sent
+        :param response_id: VedderCmd id of the expected response
+        :param raw: resolve the future to the payload bytes instead of a decoded message
+        :param priority: transmit lane
+        :param timeout: seconds to wait for the outstanding request through the port, defaults to response_timeout
+        :return: Future of the decoded response, pass it to wait
+        """
+        routed = bool(self._can_nodes)
+        if routed:
+            # released when the response arrives or the request is abandoned
+            self._route.acquire(self._reader, self.response_timeout if timeout is None else timeout)
+        try:
+            with self._write_lock:
+                # register before writing so a fast response can't be missed
+                future = self._reader.expect(response_id, raw)
+                self._writer.put(data, priority, self.can_id, False)
+        except BaseException:
+            if routed:
+                self._route.release()
+            raise
+        if routed:
+            self._route.hold(future)
+        return future
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued frame has been written to the serial port.
+        :param timeout: seconds to wait, None waits forever
+        :return: True if everything was written within timeout
+        """
+        return self._writer.flush(timeout)
+
+    def start_recording(self, log, **kwargs):
+        """
+        Records every frame sent and received on this VESC's link to a log, see limmy.recorder. CAN handles share the
+        link, so their frames are recorded too. The recording is stopped by stop_recording or when the VESC is closed.
+        :param log: path of the log, or an open limmy.recorder.Recorder
+        :param kwargs: passed to Recorder when log is a path
+        :return: the Recorder
+        """
+        from limmy.recorder import Recorder
+        self.stop_recording()
+        recorder = Recorder(log, **kwargs) if isinstance(log, str) else log
+        self._writer.recorder = recorder
+        self._reader.recorder = recorder
+        return recorder
+
+    def stop_recording(self):
+        """
+        Stops recording and closes the log. Does nothing if not recording.
+        """
+        recorder = self._writer.recorder
+        if recorder is not None:
+            self._writer.recorder = None
+            self._reader.recorder = None
+            recorder.close()
+
+    def transmit_stats(self):
+        """
+        :return: queue depth, coalescing and latency statistics of the writer thread, see Writer.stats
+        """
+        return self._writer.stats()
+
+    def stats(self):
+        """
+        Statistics of the link, to tell a noisy or saturated link from a stalled controller. CAN handles share the
+        link of their parent, so only the heartbeat section is their own. Export them with
+        limmy.VESC.stats.to_prometheus.
+        :return: dict of sections:
+                 sent: see Writer.stats
+                 received: frames, bytes, corrupt frames, crc_errors, dropped_bytes skipped while resyncing,
+                           decode_errors, unsolicited frames and request timeouts, see Reader.stats
+                 rtt: round trip time histogram per response command, i.e. stats()['rtt']['COMM_GET_VALUES']['p99']
+                 heartbeat: alive messages that went out later than the heartbeat interval (missed)
+                 busy: seconds the reader and writer threads spent working
+        """
+        sent = self._writer.stats()
+        received = self._reader.stats()
+        rtt = received.pop('rtt')
+        return {'sent': sent, 'received': received, 'rtt': rtt,
+                'heartbeat': {'missed': self.heartbeat_missed, 'interval': self.heartbeat_interval},
+                'busy': {'reader': received['busy'], 'writer': sent['busy']}}
+
+    def wait(self, future, timeout=None):
+        """
+        Waits for the response to a request.
+        :param future: Future returned by request
+        :param timeout: seconds to wait for the response, defaults to response_timeout
+        :return: decoded response
+        """
+        return self._reader.wait(future, self.response_timeout if timeout is None else timeout)
         
     def engage(self,current,frequency):
         """
@@ -98,125 +460,205 @@ class VESC(object):
         :param current: current to send to the motor
         :param frequency: frequency to send to the motor
         """
-        self.send_terminal_cmd(f'foc_openloop {current} {int(frequency*60)}')
+        self.write(encode_engage(current, frequency, self.can_id))
     
     def halt(self):
         """
-        Halt the motor by setting output current to 0 Amps
+        Halt the motor by setting output current to 0 Amps. Jumps ahead of every queued frame and drops the commands to
+        this motor that were still queued.
         """
-        self.set_current(0)
+        self.write(self._halt_msg, priority=PRIORITY_HIGH, supersede=True)
     
     def send_terminal_cmd(self, cmd):
         """
         Send a terminal command to the VESC
         :param cmd: terminal command to send
         """
-        self.write(encode(SendTerminalCMD(cmd)))
+        self.write(self._encode_cached(SendTerminalCMD, cmd))
 
     def set_gpd_freq(self, new_gpd_freq):
         """
         Set the gpd frequency
         :param new_gpd_freq: new gpd frequency
         """
-        self.write(encode(SetGPDFreq(new_gpd_freq)))
+        self.write(self._encode_cached(SetGPDFreq, new_gpd_freq))
     
     def set_gpd_mode(self, new_gpd_mode):
         """
         Set the gpd mode, follow the VedderGPD enum for more info
         :param new_gpd_mode: new gpd mode
         """
-        self.write(encode(SetGPDMode(new_gpd_mode)))
+        self.write(self._encode_cached(SetGPDMode, new_gpd_mode))
 
     def set_gpd_output_sample(self, gpd_sample):
         """
         Set the gpd output sample
         :param gpd_sample: new gpd output sample
         """
-        self.write(encode(SetGPDOutputSample(gpd_sample)))
+        self.write(self._encode(SetGPDOutputSample(gpd_sample)))
     
     def set_gpd_fill_buffer(self, gpd_sample):
         """
         Set the gpd fill buffer
         :param gpd_sample: new gpd fill buffer
         """
-        self.write(encode(SetGPDFillBuffer(gpd_sample)))
+        self.write(self._encode(SetGPDFillBuffer(gpd_sample)))
     
     def set_gpd_fill_buffer_int8(self, gpd_sample):
         """
         Set the gpd fill buffer, expects an 8 bit int
         :param gpd_sample: new gpd fill buffer
         """
-        self.write(encode(SetGPDFillBufferINT8(gpd_sample)))
+        self.write(self._encode(SetGPDFillBufferINT8(gpd_sample)))
     
     def set_gpd_fill_buffer_int16(self, gpd_sample):
         """
-        UNIMPLEMENTED - LIKELY DOES NOT WORK
         Set the gpd fill buffer, expects an 16 bit int
         :param gpd_sample: new gpd fill buffer
         """
-        print('[WARNING] set_gpd_fill_buffer_int16 likely does not work')
-        self.write(encode(SetGPDFillBufferINT16(gpd_sample)))
+        self.write(self._encode(SetGPDFillBufferINT16(gpd_sample)))
 
     def set_gpd_int_scale(self, scale):
         """
         Set the gpd int scale
         :param gpd_sample: new gpd int scale
         """
-        self.write(encode(SetGPDIntScale(scale)))
+        self.write(self._encode_cached(SetGPDIntScale, scale))
+
+    def stream_gpd(self, samples, sample_format='float', repeat=False, wait=True, **kwargs):
+        """
+        Streams a waveform into the gpd buffer, many samples per frame and only as fast as the VESC plays them. Set the
+        gpd mode and frequency first.
+        :param samples: numpy array, sequence or iterator of samples
+        :param sample_format: 'float', 'int8' or 'int16', integer samples are scaled by set_gpd_int_scale
+        :param repeat: play the samples over and over until the streamer is stopped
+        :param wait: block until every sample is written, otherwise stream on a background thread
+        :param kwargs: see GPDStreamer
+        :return: the GPDStreamer, call stop on it to end a background stream
+        """
+        from limmy.VESC.gpd import GPDStreamer
+        streamer = GPDStreamer(self, samples, sample_format, repeat, **kwargs)
+        if wait:
+            streamer.run()
+        else:
+            streamer.start()
+        return streamer
     
     def set_rpm(self, new_rpm):
         """
         Set the electronic RPM value (a.k.a. the RPM value of the stator)
         :param new_rpm: new rpm value
         """
-        self.write(encode(SetRPM(new_rpm)))
+        self.write(self._encode_cached(SetRPM, new_rpm))
     
     def set_speed_mph(self, new_speed_mph):
         """
         Set the speed in mph
         :param new_speed_mph: new speed in mph
         """
-        self.write(encode(SetRPM(new_speed_mph*784)))
+        self.write(self._encode_cached(SetRPM, new_speed_mph*784))
 
     def set_current(self, new_current):
         """
-        :param new_current: new current in milli-amps for the motor
+        :param new_current: new current in milli-amps for the motor, 0 is sent like halt
         """
-        self.write(encode(SetCurrent(new_current)))
+        if new_current == 0:
+            self.halt()
+            return
+        self.write(self._encode_cached(SetCurrent, new_current))
 
     def set_duty_cycle(self, new_duty_cycle):
         """
         :param new_duty_cycle: Value of duty cycle to be set (range [-1e5, 1e5]).
         """
-        self.write(encode(SetDutyCycle(new_duty_cycle)))
+        self.write(self._encode_cached(SetDutyCycle, new_duty_cycle))
 
     def set_servo(self, new_servo_pos):
         """
         :param new_servo_pos: New servo position. valid range [0, 1]
         """
-        self.write(encode(SetServoPosition(new_servo_pos)))
+        self.write(self._encode_cached(SetServoPosition, new_servo_pos))
 
-    def get_measurements(self):
+    def get_measurements(self, max_age=None):
         """
+        Returns the latest measurements. A sample taken less than max_age seconds ago is reused, and callers arriving
+        while a request is in flight wait for that request instead of sending their own.
+        :param max_age: maximum age in seconds of a cached sample, defaults to measurement_max_age
         :return: A msg object with attributes containing the measurement values
         """
-        return self.write(self._get_values_msg, num_read_bytes=self._get_values_msg_expected_length)
+        max_age = self.measurement_max_age if max_age is None else max_age
+        with self._measurement_lock:
+            if self._measurement is not None and time.monotonic() - self._measurement_time <= max_age:
+                return self._measurement
+            future = self._measurement_future
+            if future is not None:
+                owner = False
+            else:
+                owner = True
+                future = self._measurement_future = Future()
+        if not owner:
+            # the owner's request is bounded by response_timeout, so this always resolves
+            return future.result()
+
+        request_time = time.monotonic()
+        try:
+            msg = self.write(self._get_values_msg, response_id=GetValues.id)
+        except BaseException as e:
+            with self._measurement_lock:
+                self._measurement_future = None
+            future.set_exception(e)
+            raise
+        with self._measurement_lock:
+            self._measurement = msg
+            self._measurement_time = request_time
+            self._measurement_future = None
+        future.set_result(msg)
+        return msg
+
+    def get_values(self, *fields, max_age=None):
+        """
+        Reads several fields from one measurement sample, i.e. rpm, v_in = motor.get_values('rpm', 'v_in')
+        :param fields: names of GetValues fields
+        :param max_age: maximum age in seconds of a cached sample, defaults to measurement_max_age
+        :return: tuple with the value of each field
+        """
+        msg = self.get_measurements(max_age)
+        return tuple(getattr(msg, field) for field in fields)
+    
+    def get_values_selective(self, *fields, timeout=None):
+        """
+        Requests only the named fields (COMM_GET_VALUES_SELECTIVE), which keeps the response short on slow links.
+        :param fields: names of the fields to request, see limmy.VESC.messages.selective_fields
+        :param timeout: seconds to wait for the response, defaults to response_timeout
+        :return: A msg object with an attribute for each requested field
+        """
+        return self.write(self._encode(GetValuesSelective.from_fields(*fields)),
+                          response_id=GetValuesSelective.id, timeout=timeout)
     
-    def get_gpd_buffer_size_left(self):
+    def get_gpd_buffer_size_left(self, timeout=None):
         """
-        :return: The number of bytes left in the GPD buffer
+        :param timeout: seconds to wait for the response, defaults to response_timeout
+        :return: The number of samples that still fit in the GPD buffer
         """
-        return self.write(encode(GetGPDBufferSizeLeft()))
+        return int(self.write(self._encode_request(GetGPDBufferSizeLeft), response_id=GetGPDBufferSizeLeft.id,
+                              timeout=timeout).buffer_size_left)
     
-    def get_gpd_buffer_notify(self):
+    def get_gpd_buffer_notify(self, timeout=None):
         """
-        :return: bytes in buffer are lower than the threshold
+        Waits for the VESC to report that the samples in the GPD buffer dropped below the threshold. Nothing is sent,
+        the VESC sends the notification on its own.
+        :param timeout: seconds to wait, defaults to response_timeout
+        :return: the notification message
         """
-        return self.write(encode(GetGPDBufferNotify()))
+        return self.wait(self._reader.expect(GetGPDBufferNotify.id), timeout)
 
-    def get_firmware_version(self):
-        msg = GetVersion()
-        return str(self.write(encode_request(msg), num_read_bytes=msg._full_msg_size))
+    def get_firmware_version(self, timeout=None):
+        """
+        Asks the VESC its firmware version, see firmware_version for the version of the device profile.
+        :param timeout: seconds to wait for the response, defaults to response_timeout
+        :return: firmware version string, i.e. "6.0.1"
+        """
+        return str(self.write(self._encode_request(GetVersion), response_id=GetVersion.id, timeout=timeout))
 
     def get_rpm(self):
         """
@@ -228,7 +670,7 @@ class VESC(object):
         """
         :return: Current applied duty-cycle
         """
-        return self.get_measurements().duty_now
+        return self.get_measurements().duty_cycle_now
 
     def get_v_in(self):
         """
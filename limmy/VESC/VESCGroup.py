@@ -0,0 +1,182 @@
+from limmy.VESC.messages import *
+from limmy.VESC.VESC import VESC
+import collections
+import time
+
+# an aligned set of measurements, one per member, requested together at timestamp (time.monotonic())
+GroupSample = collections.namedtuple('GroupSample', ['timestamp', 'measurements'])
+
+
+class VESCGroup(object):
+    """
+    Owns several VESCs and drives them together, i.e. the two stators of a LIM:
+
+        with VESCGroup(['/dev/ttyACM0', '/dev/ttyACM1']) as lim:
+            lim.engage(30, 30)
+            sample = lim.get_measurements()
+            lim.halt()
+
+    Commands are encoded before anything is queued and then queued for every port back to back, so the skew between
+    controllers is a few syscalls rather than a round trip. Members are kept alive by the shared keepalive thread, and
+    may also be CAN handles (see VESC.can), each command is then forwarded to the right node.
+    """
+    def __init__(self, motors, start_heartbeat=True, **vesc_kwargs):
+        """
+        :param motors: list of serial ports (i.e. "COM3" or "/dev/ttyACM0") or already connected VESC objects.
+        :param start_heartbeat: Whether or not to start the heartbeat of every member.
+        :param vesc_kwargs: keyword arguments passed to VESC for each serial port in motors.
+        """
+        vesc_kwargs['start_heartbeat'] = False
+        self.motors = []
+        try:
+            for motor in motors:
+                self.motors.append(motor if isinstance(motor, VESC) else VESC(serial_port=motor, **vesc_kwargs))
+        except Exception:
+            self.close()
+            raise
+
+        if start_heartbeat:
+            self.start_heartbeat()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.motors)
+
+    def __getitem__(self, index):
+        return self.motors[index]
+
+    def close(self):
+        """
+        Stops the heartbeats and closes every member.
+        """
+        self.stop_heartbeat()
+        for motor in self.motors:
+            motor.__exit__(None, None, None)
+
+    def start_heartbeat(self):
+        """
+        Starts the heartbeat of every member, they all share the process-wide keepalive thread.
+        """
+        for motor in self.motors:
+            motor.start_heartbeat()
+
+    def stop_heartbeat(self):
+        """
+        Stops the heartbeat of every member.
+        """
+        for motor in self.motors:
+            motor.stop_heartbeat()
+
+    def send(self, msg):
+        """
+        Encodes a message for every member, then writes it to all of them back to back.
+        :param msg: limmy message to be sent
+        """
+        self.send_each([motor._encode(msg) for motor in self.motors])
+
+    def send_cached(self, msg_cls, *values):
+        """
+        Like send, for a message built from field values. Packets are reused from the encode cache, see encode_cached.
+        :param msg_cls: class of the message to be sent
+        :param values: field values of the message
+        """
+        self.send_each([motor._encode_cached(msg_cls, *values) for motor in self.motors])
+
+    def send_each(self, packets):
+        """
+        Writes a different encoded packet to each member, back to back. Use None to leave a member untouched.
+        :param packets: list of byte strings, one per member
+        """
+        if len(packets) != len(self.motors):
+            raise ValueError("Expected %u packets, received %u" % (len(self.motors), len(packets)))
+        for motor, packet in zip(self.motors, packets):
+            if packet is not None:
+                motor.write(packet)
+
+    def engage(self, current, frequency):
+        """
+        Engage every member
+        :param current: current to send to the motors
+        :param frequency: frequency to send to the motors
+        """
+        self.send_each([encode_engage(current, frequency, motor.can_id) for motor in self.motors])
+
+    def engage_only(self, index, current, frequency):
+        """
+        Engage one member and halt every other member in the same burst of writes
+        :param index: index of the member to engage
+        :param current: current to send to the motor
+        :param frequency: frequency to send to the motor
+        """
+        engage = encode_engage(current, frequency, self.motors[index].can_id)
+        # halt first so two stators are never driven against each other
+        for i, motor in enumerate(self.motors):
+            if i != index:
+                motor.halt()
+        self.motors[index].write(engage)
+
+    def halt(self):
+        """
+        Halt every member by setting output current to 0 Amps, ahead of anything still queued for them
+        """
+        for motor in self.motors:
+            motor.halt()
+
+    def set_current(self, new_current):
+        """
+        :param new_current: new current for every member, 0 is sent like halt
+        """
+        if new_current == 0:
+            self.halt()
+            return
+        self.send_cached(SetCurrent, new_current)
+
+    def set_rpm(self, new_rpm):
+        """
+        :param new_rpm: new electronic rpm for every member
+        """
+        self.send_cached(SetRPM, new_rpm)
+
+    def set_duty_cycle(self, new_duty_cycle):
+        """
+        :param new_duty_cycle: new duty cycle for every member
+        """
+        self.send_cached(SetDutyCycle, new_duty_cycle)
+
+    def get_measurements(self, timeout=None):
+        """
+        Requests measurements from every member and waits for all of them. Members on different ports are asked at
+        once. CAN handles sharing a port are asked one after the other, a port only has one forwarded request
+        outstanding at a time (see VESC.request).
+        :param timeout: seconds to wait for each response, defaults to each member's response_timeout
+        :return: GroupSample with the request time and one measurement message per member
+        """
+        # indices of the members per port, the reader is shared by a VESC and its CAN handles
+        ports = collections.OrderedDict()
+        for index, motor in enumerate(self.motors):
+            ports.setdefault(motor._reader, []).append(index)
+        measurements = [None] * len(self.motors)
+        timestamp = time.monotonic()
+        for rank in range(max((len(indices) for indices in ports.values()), default=0)):
+            # the next member of every port, each port's previous response has arrived
+            futures = [(index, self.motors[index].request(self.motors[index]._get_values_msg, GetValues.id,
+                                                          timeout=timeout))
+                       for index in (indices[rank] for indices in ports.values() if rank < len(indices))]
+            for index, future in futures:
+                measurements[index] = self.motors[index].wait(future, timeout)
+        return GroupSample(timestamp, measurements)
+
+    def get_values(self, *fields, timeout=None):
+        """
+        Reads several fields from every member in one aligned sample.
+        :param fields: names of GetValues fields
+        :param timeout: seconds to wait for each response, defaults to each member's response_timeout
+        :return: list with a tuple of field values per member
+        """
+        sample = self.get_measurements(timeout)
+        return [tuple(getattr(msg, field) for field in fields) for msg in sample.measurements]
@@ -1 +1,45 @@
-from .VESC import VESC
\ No newline at end of file
+import importlib
+import sys
+import types
+from .VESC import VESC
+
+# name exported by the package -> the submodule defining it, imported the first time the name is used so importing
+# limmy doesn't pay for asyncio and the modules a program never touches
+_lazy = {
+    'AsyncVESC': 'AsyncVESC',
+    'VESCGroup': 'VESCGroup',
+    'GroupSample': 'VESCGroup',
+    'DeadlineScheduler': 'scheduler',
+    'SlipController': 'control',
+    'Histogram': 'stats',
+    'to_prometheus': 'stats',
+    'DeviceProfile': 'profile',
+    'ProfileCache': 'profile',
+}
+
+__all__ = ['VESC'] + list(_lazy)
+
+
+def __getattr__(name):
+    module = _lazy.get(name)
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy))
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        # importing a submodule binds it on the package under its own name, which for AsyncVESC and VESCGroup is also
+        # the name of the class it defines. Keep the class, as the package did when it imported them eagerly
+        if isinstance(value, types.ModuleType) and _lazy.get(name) == name:
+            value = getattr(value, name)
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
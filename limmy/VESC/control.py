@@ -0,0 +1,157 @@
+from limmy.VESC.scheduler import DeadlineScheduler
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class SlipController(object):
+    """
+    Closed-loop slip frequency control of a LIM. Every tick the speed of the rotor (the reaction plate) is read, the
+    stator frequency that keeps the target slip is computed, and engage is re-issued:
+
+        f_rotor = v / (2 * pole_pitch)
+        f_stator = f_rotor / (1 - slip) + slip_frequency
+
+    clamped to [min_frequency, max_frequency]. The stator field then always runs ahead of the rotor, so the LIM pushes
+    instead of braking. Ticks run on a DeadlineScheduler, see stats for the achieved loop period and jitter.
+
+        with VESC('/dev/ttyACM0') as motor:
+            controller = SlipController(motor, current=30, slip_frequency=5, rate=200)
+            controller.start()
+            ...
+            controller.stop()
+
+    The drive may be a VESC or a VESCGroup, anything with engage(current, frequency), halt() and stop_heartbeat().
+
+    A tick whose speed read fails re-issues the previous frequency, a tick whose engage fails is skipped. After
+    max_errors failed ticks in a row the loop is no longer closed, so it halts the drive and stops. stop_reason then
+    holds the last exception.
+    """
+    def __init__(self, drive, current, slip_frequency=0.0, slip=0.0, rate=100, speed=None, pole_pitch=None,
+                 min_frequency=1.0, max_frequency=None, spin=0.0, max_errors=10):
+        """
+        :param drive: VESC or VESCGroup to engage
+        :param current: current in Amps sent with every engage, may be changed while running
+        :param slip_frequency: slip in Hz added to the rotor frequency, may be changed while running
+        :param slip: fractional slip (0 <= slip < 1), may be changed while running
+        :param rate: control loop rate in Hz
+        :param speed: function returning the rotor speed in m/s, pole_pitch is then required. Defaults to the rpm
+                      reported by the drive, read as electrical rpm of the rotor (needs a speed sensor on the VESC).
+        :param pole_pitch: pole pitch of the stator in meters
+        :param min_frequency: lowest stator frequency in Hz, also used at standstill
+        :param max_frequency: highest stator frequency in Hz, None for no limit
+        :param spin: see DeadlineScheduler
+        :param max_errors: failed ticks in a row after which the drive is halted and the loop stops, None to keep
+                           ticking whatever fails
+        """
+        if speed is not None and not pole_pitch:
+            raise ValueError("pole_pitch is needed to convert speed to frequency")
+        self.drive = drive
+        self.current = current
+        self.slip_frequency = slip_frequency
+        self.slip = slip
+        self.speed = speed
+        self.pole_pitch = pole_pitch
+        self.min_frequency = min_frequency
+        self.max_frequency = max_frequency
+        # latest rotor and stator frequencies in Hz, and when they were computed (time.monotonic())
+        self.rotor_frequency = 0.0
+        self.frequency = min_frequency
+        self.timestamp = None
+        # ticks where the speed could not be read or engage failed
+        self.errors = 0
+        self.max_errors = max_errors
+        self._consecutive_errors = 0
+        # exception that made the loop give up, None while it runs or if it was stopped by stop
+        self.stop_reason = None
+        self.scheduler = DeadlineScheduler(rate, self._tick, name='limmy-slip-controller', spin=spin)
+
+    def start(self):
+        """
+        Starts the control loop on a background thread.
+        """
+        self.scheduler.start()
+
+    def is_alive(self):
+        """
+        :return: whether the control loop is running, see stop_reason if it stopped on its own
+        """
+        return self.scheduler.is_alive()
+
+    def stop(self, halt=True):
+        """
+        Stops the control loop.
+        :param halt: also halt the drive
+        """
+        self.scheduler.stop()
+        if halt:
+            self.drive.halt()
+
+    def stats(self):
+        """
+        See DeadlineScheduler.stats, with the latest rotor and stator frequencies, the number of failed ticks, whether
+        the loop is running and why it stopped on its own (repr of stop_reason, None if it didn't)
+        """
+        stats = self.scheduler.stats()
+        stats.update(rotor_frequency=self.rotor_frequency, frequency=self.frequency, errors=self.errors,
+                     alive=self.is_alive(), stop_reason=None if self.stop_reason is None else repr(self.stop_reason))
+        return stats
+
+    def read_rotor_frequency(self):
+        """
+        :return: the rotor speed expressed as a frequency of the stator field, in Hz
+        """
+        if self.speed is not None:
+            return self.speed() / (2 * self.pole_pitch)
+        rpms = self.drive.get_values('rpm')
+        if isinstance(rpms, list):
+            # VESCGroup, one tuple per member
+            return sum(rpm for rpm, in rpms) / len(rpms) / 60
+        return rpms[0] / 60
+
+    def stator_frequency(self, rotor_frequency):
+        """
+        :return: the stator frequency for the target slip at the given rotor frequency
+        """
+        frequency = abs(rotor_frequency) / (1 - self.slip) + self.slip_frequency
+        frequency = max(frequency, self.min_frequency)
+        if self.max_frequency is not None:
+            frequency = min(frequency, self.max_frequency)
+        return frequency
+
+    def _tick(self):
+        error = None
+        try:
+            self.rotor_frequency = self.read_rotor_frequency()
+        except Exception as e:
+            error = e
+        else:
+            self.frequency = self.stator_frequency(self.rotor_frequency)
+            self.timestamp = time.monotonic()
+        try:
+            self.drive.engage(self.current, self.frequency)
+        except Exception as e:
+            error = e
+        if error is None:
+            self._consecutive_errors = 0
+            return
+        self.errors += 1
+        self._consecutive_errors += 1
+        if self.max_errors is not None and self._consecutive_errors >= self.max_errors:
+            self._give_up(error)
+
+    def _give_up(self, error):
+        """
+        Stops the loop from its own thread and halts the drive, the heartbeat would otherwise keep the motor running
+        at the last frequency with nothing closing the loop.
+        """
+        self.stop_reason = error
+        self.scheduler.stop()
+        _logger.error("Slip controller stopped after %u failed ticks in a row: %r", self._consecutive_errors, error)
+        try:
+            self.drive.halt()
+        except Exception:
+            # let the firmware timeout release the motor instead
+            _logger.exception("Could not halt the drive, stopping its heartbeat")
+            self.drive.stop_heartbeat()
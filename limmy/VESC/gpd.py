@@ -0,0 +1,182 @@
+from limmy.protocol.base import VESCMessage
+from limmy.protocol.packet.codec import frame
+from limmy.protocol.packet.structure import Header
+from limmy.VESC.messages import VedderCmd, GetGPDBufferNotify
+import itertools
+import struct
+import threading
+
+# numpy is optional, without it samples are packed with struct
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class GPDStreamer(object):
+    """
+    Streams a waveform into the GPD (general purpose drive) sample buffer of a VESC, packing many samples into each
+    COMM_GPD_FILL_BUFFER* frame. The firmware plays the buffer at the GPD switching frequency, so the streamer keeps it
+    topped up with credit based flow control: COMM_GPD_BUFFER_SIZE_LEFT says how many samples fit, exactly that many
+    are written, and the next top-up happens when the VESC sends COMM_GPD_BUFFER_NOTIFY (or poll_interval passes).
+
+        with VESC('/dev/ttyACM0') as motor:
+            motor.set_gpd_mode(VedderGPD.GPD_OUTPUT_MODE_VOLTAGE)
+            motor.set_gpd_freq(20000)
+            motor.stream_gpd(0.1 * numpy.sin(numpy.linspace(0, 2 * numpy.pi, 400, endpoint=False)), repeat=True,
+                             wait=False)
+    """
+    # sample format name to (fill buffer command, struct format character, numpy dtype)
+    FORMATS = {
+        'float': (VedderCmd.COMM_GPD_FILL_BUFFER, 'f', '>f4'),
+        'int8': (VedderCmd.COMM_GPD_FILL_BUFFER_INT8, 'b', '>i1'),
+        'int16': (VedderCmd.COMM_GPD_FILL_BUFFER_INT16, 'h', '>i2'),
+    }
+    # the payload length field of a packet is 16 bits wide, limmy's own receive path (Stateful) accepts all of them
+    MAX_PAYLOAD = Header.MAX_PAYLOAD_LENGTH
+
+    def __init__(self, vesc, samples, sample_format='float', repeat=False,
+                 max_payload=Header.FIRMWARE_MAX_PAYLOAD_LENGTH, poll_interval=0.05, min_credit=None):
+        """
+        :param vesc: connected VESC (or CAN handle) to stream to
+        :param samples: numpy array, sequence or iterator of samples. Integer formats are scaled by set_gpd_int_scale.
+        :param sample_format: 'float', 'int8' or 'int16'
+        :param repeat: play samples over and over until stopped, samples must then be an array or a sequence
+        :param max_payload: largest payload per frame in bytes, up to MAX_PAYLOAD. The default fits the receive buffer
+                            of the stock firmware, only raise it for firmware (or an emulator) built with a larger
+                            PACKET_MAX_PL_LEN.
+        :param poll_interval: seconds between buffer size requests when no notification arrives
+        :param min_credit: free samples the buffer must have before another frame is written, defaults to a full frame
+        """
+        if sample_format not in GPDStreamer.FORMATS:
+            raise ValueError("Unknown sample format %r, expected one of %s" %
+                             (sample_format, ', '.join(GPDStreamer.FORMATS)))
+        if not 0 < max_payload <= GPDStreamer.MAX_PAYLOAD:
+            raise ValueError("max_payload must be between 1 and %u bytes" % GPDStreamer.MAX_PAYLOAD)
+        self.vesc = vesc
+        self.sample_format = sample_format
+        self.poll_interval = poll_interval
+        cmd, self._fmt, self._dtype = GPDStreamer.FORMATS[sample_format]
+        if vesc.can_id is None:
+            self._prefix = struct.pack('!B', cmd)
+        else:
+            self._prefix = struct.pack('!BBB', VESCMessage._comm_forward_can, vesc.can_id, cmd)
+        self._sample_size = struct.calcsize('!' + self._fmt)
+        self.samples_per_frame = (max_payload - len(self._prefix)) // self._sample_size
+        if self.samples_per_frame < 1:
+            raise ValueError("max_payload of %u bytes can't hold a sample" % max_payload)
+        self.min_credit = self.samples_per_frame if min_credit is None else max(1, min_credit)
+
+        self._array = None
+        if numpy is not None and isinstance(samples, numpy.ndarray):
+            # convert once up front, every frame is then a slice of this array
+            self._array = numpy.ascontiguousarray(samples, dtype=self._dtype).ravel()
+            self._position = 0
+            self._repeat = repeat and len(self._array) > 0
+        else:
+            self._iterator = itertools.cycle(samples) if repeat else iter(samples)
+
+        # samples written, frames written, buffer size requests, times the buffer was found empty mid-stream
+        self.sent = 0
+        self.frames = 0
+        self.polls = 0
+        self.underruns = 0
+        # largest size left reported, taken as the capacity of the buffer
+        self.capacity = 0
+        self._notified = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.exception = None
+
+    def _take(self, count):
+        """
+        :return: packed bytes of up to count samples, empty once the samples are exhausted
+        """
+        if self._array is not None:
+            chunks = []
+            while count > 0:
+                if self._position == len(self._array):
+                    if not self._repeat:
+                        break
+                    self._position = 0
+                chunk = self._array[self._position:self._position + count]
+                self._position += len(chunk)
+                count -= len(chunk)
+                chunks.append(chunk.tobytes())
+            return b''.join(chunks)
+        chunk = list(itertools.islice(self._iterator, count))
+        return struct.pack('!%u%s' % (len(chunk), self._fmt), *chunk)
+
+    def _on_notify(self, msg):
+        self._notified.set()
+
+    def _credit(self):
+        """
+        Asks the VESC how many samples fit in its buffer.
+        """
+        left = self.vesc.get_gpd_buffer_size_left()
+        self.polls += 1
+        if self.sent and left >= self.capacity > 0:
+            self.underruns += 1
+        self.capacity = max(self.capacity, left)
+        return left
+
+    def run(self):
+        """
+        Streams every sample, blocking until they have all been written or stop is called. Returns as soon as the last
+        frame is on the wire, the VESC is still playing the buffered samples at that point.
+        :return: number of samples written
+        """
+        self.vesc._reader.subscribe(GetGPDBufferNotify.id, self._on_notify)
+        try:
+            while not self._stop.is_set():
+                credit = self._credit()
+                if credit < self.min_credit:
+                    # the buffer is full enough, wait for the VESC to drain it
+                    self._notified.wait(self.poll_interval)
+                    self._notified.clear()
+                    continue
+                while credit > 0:
+                    data = self._take(min(credit, self.samples_per_frame))
+                    if not data:
+                        self.vesc.flush()
+                        return self.sent
+                    count = len(data) // self._sample_size
+                    self.vesc.write(frame(self._prefix + data))
+                    self.sent += count
+                    self.frames += 1
+                    credit -= count
+            return self.sent
+        finally:
+            self.vesc._reader.unsubscribe(GetGPDBufferNotify.id, self._on_notify)
+
+    def _run_thread(self):
+        try:
+            self.run()
+        except Exception as e:
+            self.exception = e
+
+    def start(self):
+        """
+        Streams on a background thread, see run.
+        """
+        self._thread = threading.Thread(target=self._run_thread, name='limmy-gpd', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops writing samples. Samples already in the VESC's buffer are still played.
+        """
+        self._stop.set()
+        self._notified.set()
+        self.join()
+
+    def join(self, timeout=None):
+        """
+        Waits for the background thread to finish writing.
+        :return: True if it finished
+        """
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        return True
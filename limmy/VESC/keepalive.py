@@ -0,0 +1,164 @@
+import threading
+import time
+
+
+class _Entry(object):
+    """
+    A device registered with the keepalive scheduler, and where it sits in the wheel.
+    """
+    __slots__ = ('device', 'interval', 'rounds', 'cancelled', 'registered')
+
+    def __init__(self, device, interval, registered):
+        self.device = device
+        self.interval = interval
+        self.rounds = 0
+        self.cancelled = False
+        # gaps from before registration are not the scheduler's to keep
+        self.registered = registered
+
+
+class KeepaliveScheduler(object):
+    """
+    One daemon thread that keeps every registered VESC alive, using a hashed timer wheel: time is cut into ticks, each
+    device waits in the slot of the tick its deadline falls in, and every tick only the devices in one slot are looked
+    at. A device's deadline is interval after the last command written to it, so while other commands are flowing no
+    alive message is sent at all.
+
+    Use the process-wide instance from KeepaliveScheduler.shared(). A device must have last_command_time (the
+    time.monotonic() of its last command), heartbeat_missed (incremented whenever the gap between two of its commands
+    exceeds its interval by more than a tick), _alive_msg and write(data).
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, tick=0.01, slots=64):
+        """
+        :param tick: resolution of the wheel in seconds
+        :param slots: number of slots, deadlines further away than tick * slots wait for several turns of the wheel
+        """
+        self.tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._start = None
+        self._current = 0
+        # alive messages written, alive messages skipped because another command went out in time, and alive messages
+        # that went out too late (i.e. the thread was starved)
+        self.sent = 0
+        self.skipped = 0
+        self.missed = 0
+
+    @staticmethod
+    def shared():
+        """
+        :return: the process-wide scheduler
+        """
+        with KeepaliveScheduler._shared_lock:
+            if KeepaliveScheduler._shared is None:
+                KeepaliveScheduler._shared = KeepaliveScheduler()
+            return KeepaliveScheduler._shared
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, device):
+        return device in self._entries
+
+    def register(self, device, interval=0.1):
+        """
+        Starts keeping a device alive. Registering a device again only changes its interval.
+        :param device: VESC or CAN handle
+        :param interval: longest time in seconds between two commands to the device
+        """
+        with self._lock:
+            entry = self._entries.get(device)
+            if entry is not None:
+                entry.interval = interval
+                return
+            now = time.monotonic()
+            if self._thread is None:
+                self._start = now
+                self._thread = threading.Thread(target=self._run, name='limmy-keepalive', daemon=True)
+                self._thread.start()
+            if not self._entries:
+                # the wheel stopped turning while idle, move it to the present
+                self._current = int((now - self._start) / self.tick)
+            entry = _Entry(device, interval, now)
+            self._entries[device] = entry
+            self._schedule(entry, now)
+        self._wakeup.set()
+
+    def unregister(self, device):
+        """
+        Stops keeping a device alive. Does nothing if it isn't registered.
+        """
+        with self._lock:
+            entry = self._entries.pop(device, None)
+            if entry is not None:
+                # left in its slot and dropped when the slot comes up
+                entry.cancelled = True
+
+    def _schedule(self, entry, deadline):
+        """
+        Puts an entry in the slot of its deadline. Must hold the lock.
+        """
+        ticks = max(1, int((deadline - self._start) / self.tick) - self._current)
+        entry.rounds = (ticks - 1) // len(self._slots)
+        self._slots[(self._current + ticks) % len(self._slots)].append(entry)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._entries
+            if idle:
+                # nothing to keep alive, sleep until something registers
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            deadline = self._start + (self._current + 1) * self.tick
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                self._current += 1
+                slot = self._slots[self._current % len(self._slots)]
+                due = []
+                waiting = []
+                for entry in slot:
+                    if entry.cancelled:
+                        continue
+                    if entry.rounds > 0:
+                        entry.rounds -= 1
+                        waiting.append(entry)
+                    else:
+                        due.append(entry)
+                slot[:] = waiting
+            for entry in due:
+                self._service(entry)
+
+    def _service(self, entry):
+        """
+        Sends the alive message of a due device, unless another command went out within its interval.
+        """
+        device = entry.device
+        now = time.monotonic()
+        next_deadline = device.last_command_time + entry.interval
+        if next_deadline > now + self.tick:
+            self.skipped += 1
+        else:
+            if now - max(device.last_command_time, entry.registered) - entry.interval > self.tick:
+                self.missed += 1
+                device.heartbeat_missed += 1
+            try:
+                device.write(device._alive_msg)
+            except Exception:
+                # the connection is gone, stop servicing it
+                self.unregister(device)
+                return
+            self.sent += 1
+            next_deadline = now + entry.interval
+        with self._lock:
+            if not entry.cancelled:
+                self._schedule(entry, next_deadline)
@@ -1,5 +1,8 @@
 from limmy.protocol.base import VESCMessage
+from limmy.protocol.interface import encode_request
 from limmy.VESC.messages import VedderCmd
+from functools import lru_cache
+import struct
 
 
 pre_v3_33_fields = [('temp_mos1', 'h', 10),
@@ -22,6 +25,29 @@ pre_v3_33_fields = [('temp_mos1', 'h', 10),
                     ('tachometer_abs', 'i', 1),
                     ('mc_fault_code', 'c', 0)]
 
+# fields returned by COMM_GET_VALUES_SELECTIVE, the index in this list is the bit of the mask that selects them
+selective_fields = [[('temp_fet', 'h', 10)],
+                    [('temp_motor', 'h', 10)],
+                    [('avg_motor_current', 'i', 100)],
+                    [('avg_input_current', 'i', 100)],
+                    [('avg_id', 'i', 100)],
+                    [('avg_iq', 'i', 100)],
+                    [('duty_cycle_now', 'h', 1000)],
+                    [('rpm', 'i', 1)],
+                    [('v_in', 'h', 10)],
+                    [('amp_hours', 'i', 10000)],
+                    [('amp_hours_charged', 'i', 10000)],
+                    [('watt_hours', 'i', 10000)],
+                    [('watt_hours_charged', 'i', 10000)],
+                    [('tachometer', 'i', 1)],
+                    [('tachometer_abs', 'i', 1)],
+                    [('mc_fault_code', 'c', 0)],
+                    [('pid_pos_now', 'i', 1000000)],
+                    [('app_controller_id', 'c', 0)],
+                    [('temp_mos1', 'h', 10), ('temp_mos2', 'h', 10), ('temp_mos3', 'h', 10)],
+                    [('avg_vd', 'i', 1000)],
+                    [('avg_vq', 'i', 1000)]]
+
 
 class GetVersion(metaclass=VESCMessage):
     """ Gets version fields
@@ -66,6 +92,18 @@ class GetValues(metaclass=VESCMessage):
     ]
 
 
+class GetValuesPreV3_33(metaclass=VESCMessage):
+    """ GetValues response of firmware older than 3.33
+
+    Not registered under its id, a VESC whose profile says it runs such firmware decodes its GetValues responses with
+    this class instead (see limmy.VESC.profile).
+    """
+    id = VedderCmd.COMM_GET_VALUES
+    _register = False
+
+    fields = pre_v3_33_fields
+
+
 class GetRotorPosition(metaclass=VESCMessage):
     """ Gets rotor position data
     
@@ -80,7 +118,7 @@ class GetRotorPosition(metaclass=VESCMessage):
 
 class GetGPDBufferSizeLeft(metaclass=VESCMessage):
     """ 
-    Gets the number of bytes left in the buffer
+    Gets the number of samples that still fit in the GPD sample buffer
     """
     id = VedderCmd.COMM_GPD_BUFFER_SIZE_LEFT
 
@@ -90,10 +128,93 @@ class GetGPDBufferSizeLeft(metaclass=VESCMessage):
 
 class GetGPDBufferNotify(metaclass=VESCMessage):
     """ 
-    Bytes in buffer are lower than the threshold
+    Sent by the VESC on its own when the samples in the GPD buffer drop below the threshold. It carries no data.
     """
     id = VedderCmd.COMM_GPD_BUFFER_NOTIFY
 
+    fields = []
+
+
+class GetValuesSelective(metaclass=VESCMessage):
+    """ Gets a chosen subset of the internal sensor data
+
+    The request carries a bitmask of the wanted fields (see selective_fields), the response echoes the mask followed
+    by only those fields. Build requests with GetValuesSelective.from_fields('rpm', 'avg_motor_current').
+    """
+    id = VedderCmd.COMM_GET_VALUES_SELECTIVE
+
     fields = [
-            ('buffer_notify', 'i', 1)
-    ]
\ No newline at end of file
+            ('mask', 'I')
+    ]
+
+    _bit_of_field = {field[0]: bit for bit, group in enumerate(selective_fields) for field in group}
+    _mask_struct = struct.Struct('!I')
+
+    @staticmethod
+    def mask_for(field_names):
+        """
+        :param field_names: iterable of field names, see selective_fields
+        :return: bitmask selecting those fields
+        """
+        mask = 0
+        for name in field_names:
+            try:
+                mask |= 1 << GetValuesSelective._bit_of_field[name]
+            except KeyError:
+                raise ValueError("%s is not available in selective value requests" % name)
+        return mask
+
+    @staticmethod
+    def from_fields(*field_names):
+        """
+        :param field_names: names of the fields to request, see selective_fields
+        :return: GetValuesSelective request message
+        """
+        return GetValuesSelective(GetValuesSelective.mask_for(field_names))
+
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def _codec(mask):
+        """
+        Compiles the layout of a response for one mask.
+        :return: (struct.Struct of the selected fields, their names, (index, scalar) of every scaled field)
+        """
+        selected = [field for bit, group in enumerate(selective_fields) if mask & (1 << bit) for field in group]
+        fmt = VESCMessage._endian_fmt + ''.join(field[1] for field in selected)
+        scales = tuple((idx, field[2]) for idx, field in enumerate(selected) if len(field) >= 3 and field[2])
+        return struct.Struct(fmt), tuple(field[0] for field in selected), scales
+
+    @staticmethod
+    def _decode(msg_bytes):
+        mask, = GetValuesSelective._mask_struct.unpack_from(msg_bytes, 1)
+        fields_struct, names, scales = GetValuesSelective._codec(mask)
+        data = list(fields_struct.unpack_from(msg_bytes, 1 + GetValuesSelective._mask_struct.size))
+        for idx, scalar in scales:
+            data[idx] = data[idx] / scalar
+        msg = GetValuesSelective(mask)
+        msg.__dict__.update(zip(names, data))
+        return msg
+
+
+class PingCAN(metaclass=VESCMessage):
+    """ Lists the ids of the VESCs that answer on the CAN bus
+
+    Request it with encode_request(PingCAN), the response holds one byte per node found, decoded into can_ids.
+    """
+    id = VedderCmd.COMM_PING_CAN
+
+    fields = []
+
+    @staticmethod
+    def _decode(msg_bytes):
+        msg = PingCAN()
+        msg.can_ids = list(msg_bytes[1:])
+        return msg
+
+
+# statically save the requests because they do not need to be recalculated
+get_version_msg = encode_request(GetVersion)
+get_values_msg = encode_request(GetValues)
+get_rotor_position_msg = encode_request(GetRotorPosition)
+get_gpd_buffer_size_left_msg = encode_request(GetGPDBufferSizeLeft)
+ping_can_msg = encode_request(PingCAN)
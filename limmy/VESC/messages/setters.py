@@ -1,5 +1,6 @@
 from limmy.protocol.base import VESCMessage
-from limmy.protocol.interface import encode
+from limmy.protocol.interface import encode, ENCODE_CACHE_SIZE
+from functools import lru_cache
 from limmy.VESC.messages import VedderCmd
 
 class SendTerminalCMD(metaclass=VESCMessage):
@@ -41,13 +42,13 @@ class SetGPDIntScale(metaclass=VESCMessage):
 class SetGPDFillBufferINT8(metaclass=VESCMessage):
     id = VedderCmd.COMM_GPD_FILL_BUFFER_INT8
     fields = [
-        ('sample','i',1)
+        ('sample','b',1)
     ]
 
 class SetGPDFillBufferINT16(metaclass=VESCMessage):
     id = VedderCmd.COMM_GPD_FILL_BUFFER_INT16
     fields = [
-        ('sample','b',1)
+        ('sample','h',1)
     ]
 
 class SetDutyCycle(metaclass=VESCMessage):
@@ -145,5 +146,20 @@ class Alive(metaclass=VESCMessage):
     fields = []
 
 
-# statically save this message because it does not need to be recalculated
+# statically save these messages because they do not need to be recalculated
 alive_msg = encode(Alive())
+halt_msg = encode(SetCurrent(0))
+
+
+# typed, the command text of 30 and 30.0 differs
+@lru_cache(maxsize=ENCODE_CACHE_SIZE, typed=True)
+def encode_engage(current, frequency, can_id=None):
+    """
+    Encodes the terminal command that engages a LIM in open loop at the given current and frequency. The packets are
+    cached, so re-engaging at the same setpoint costs a dictionary lookup.
+    :param current: current in Amps
+    :param frequency: frequency in Hz
+    :param can_id: CAN id to forward the command to, None for the VESC on the serial port
+    :return: the packet
+    """
+    return encode(SendTerminalCMD(f'foc_openloop {current} {int(frequency*60)}', can_id=can_id))
@@ -0,0 +1,159 @@
+from limmy.VESC.messages import GetValues, GetValuesPreV3_33
+import json
+import logging
+import os
+import threading
+import time
+
+# GetValues layout per schema name
+SCHEMAS = {'v3.33': GetValues, 'pre_v3.33': GetValuesPreV3_33}
+
+_logger = logging.getLogger(__name__)
+
+
+def schema_for(version):
+    """
+    :param version: firmware version string, i.e. "6.0.1"
+    :return: name of the GetValues layout the firmware sends, a key of SCHEMAS
+    """
+    return 'pre_v3.33' if int(version.split('.')[0]) < 3 else 'v3.33'
+
+
+def default_path():
+    """
+    :return: path of the profile cache shared by every program of the user, under $XDG_CACHE_HOME (~/.cache)
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'limmy', 'profiles.json')
+
+
+def profile_key(port):
+    """
+    :param port: serial port, transport URL or open transport passed to VESC
+    :return: key of the port in a ProfileCache, None for an open transport, which has no name to find it by again
+    """
+    return port if isinstance(port, str) else None
+
+
+def open_cache(profile_cache):
+    """
+    :param profile_cache: ProfileCache, path of its file, True for the default path, or None
+    :return: the ProfileCache, None if profile_cache is None or False
+    """
+    if profile_cache is None or profile_cache is False:
+        return None
+    if isinstance(profile_cache, ProfileCache):
+        return profile_cache
+    return ProfileCache(None if profile_cache is True else profile_cache)
+
+
+class DeviceProfile(object):
+    """
+    What is known about the VESC on a port without asking it: its firmware version, the GetValues layout (schema) of
+    that version and capabilities found earlier, i.e. the CAN ids that answered ping_can.
+    """
+    def __init__(self, port, version, capabilities=None, probed=None):
+        """
+        :param port: serial port or transport URL of the VESC
+        :param version: firmware version string
+        :param capabilities: dict of JSON serializable values
+        :param probed: time.time() the version was read from the VESC, defaults to now
+        """
+        self.port = port
+        self.version = version
+        self.capabilities = dict(capabilities or {})
+        self.probed = time.time() if probed is None else probed
+
+    def __repr__(self):
+        return 'DeviceProfile(%r, %r, capabilities=%r)' % (self.port, self.version, self.capabilities)
+
+    @property
+    def schema(self):
+        return schema_for(self.version)
+
+    @property
+    def values_class(self):
+        """
+        :return: message class GetValues responses of this VESC are decoded with
+        """
+        return SCHEMAS[self.schema]
+
+    def to_dict(self):
+        return {'version': self.version, 'schema': self.schema, 'capabilities': self.capabilities,
+                'probed': self.probed}
+
+    @classmethod
+    def from_dict(cls, port, data):
+        return cls(port, data['version'], data.get('capabilities'), data.get('probed'))
+
+
+class ProfileCache(object):
+    """
+    Device profiles by port, kept in a JSON file so the next connection to a port can skip waiting for the firmware
+    probe. Several processes may share the file, every save merges with what is on disk and replaces the file
+    atomically. The cache only saves time, a file that can't be read or written is treated as empty.
+    """
+    def __init__(self, path=None):
+        """
+        :param path: path of the JSON file, defaults to default_path()
+        """
+        self.path = default_path() if path is None else os.fspath(path)
+        self._lock = threading.Lock()
+        self._profiles = None
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                profiles = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return profiles if isinstance(profiles, dict) else {}
+
+    def _write(self, profiles):
+        directory = os.path.dirname(self.path)
+        tmp_path = '%s.%u.tmp' % (self.path, os.getpid())
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(profiles, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            _logger.warning('Could not save the device profiles to %s: %s', self.path, e)
+
+    def get(self, port):
+        """
+        :param port: serial port or transport URL
+        :return: the DeviceProfile of the port, None if there is none
+        """
+        with self._lock:
+            if self._profiles is None:
+                self._profiles = self._read()
+            data = self._profiles.get(port)
+        if data is None:
+            return None
+        try:
+            profile = DeviceProfile.from_dict(port, data)
+            schema_for(profile.version)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            # written by another version of limmy or edited by hand
+            return None
+        return profile
+
+    def put(self, profile):
+        """
+        Saves a profile, replacing the one of its port.
+        """
+        with self._lock:
+            self._profiles = self._read()
+            self._profiles[profile.port] = profile.to_dict()
+            self._write(self._profiles)
+
+    def remove(self, port):
+        """
+        Forgets the profile of a port, the next connection probes the VESC again.
+        """
+        with self._lock:
+            self._profiles = self._read()
+            if self._profiles.pop(port, None) is not None:
+                self._write(self._profiles)
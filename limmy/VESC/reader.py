@@ -0,0 +1,210 @@
+from limmy.protocol.base import VESCMessage
+from limmy.protocol.packet.codec import Stateful
+from limmy.VESC.stats import Histogram, command_name
+from concurrent.futures import CancelledError, Future, TimeoutError
+import collections
+import logging
+import threading
+import struct
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class Reader(object):
+    """
+    Background thread that decodes every frame arriving on a transport and hands each response to the caller that
+    requested it. Pending requests are futures queued per VedderCmd id and resolved in the order they were sent.
+    Messages the VESC sends on its own, such as COMM_GPD_BUFFER_NOTIFY, are passed to subscribed callbacks.
+    """
+    def __init__(self, serial_port):
+        """
+        :param serial_port: open limmy.transport.Transport. Its read timeout sets how quickly the thread notices stop.
+        """
+        self.serial_port = serial_port
+        self._unpacker = Stateful()
+        self._pending = collections.defaultdict(collections.deque)
+        self._pending_lock = threading.Lock()
+        self._subscribers = collections.defaultdict(list)
+        # message class per VedderCmd id decoding that id instead of the registered class, i.e. the GetValues layout
+        # of old firmware
+        self.decoders = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_loop, name='limmy-reader', daemon=True)
+        # bytes read, frames that failed to decode or that nobody waited for, requests that timed out, exceptions
+        # raised by subscribers, seconds spent decoding and dispatching, and round trip times per response id
+        self.bytes = 0
+        self.decode_errors = 0
+        self.unsolicited = 0
+        self.timeouts = 0
+        self.subscriber_errors = 0
+        self.busy_time = 0.0
+        self._rtt = {}
+        # limmy.recorder.Recorder every valid received frame is recorded to, if not None
+        self.recorder = None
+
+    def start(self):
+        """
+        Starts the reader thread.
+        """
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the reader thread and fails every request still waiting for a response.
+        """
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._fail_pending(ConnectionError("Reader stopped before a response was received."))
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def expect(self, msg_id, raw=False):
+        """
+        Registers interest in the next response with the given id. Must be called before the request is written so a
+        fast response cannot be missed.
+        :param msg_id: VedderCmd id of the expected response.
+        :param raw: resolve to the payload (a memoryview of the receive buffer) instead of a decoded message, for
+                    callers that decode it themselves.
+        :return: Future that resolves to the decoded response message.
+        """
+        future = Future()
+        with self._pending_lock:
+            self._pending[msg_id].append((future, raw, time.perf_counter()))
+        return future
+
+    def subscribe(self, msg_id, callback):
+        """
+        Calls callback with every decoded message of the given id, whether or not a request is waiting on it. The
+        callback runs on the reader thread, so it must return quickly and must not wait on another response.
+        :param msg_id: VedderCmd id of the messages.
+        :param callback: function taking the decoded message.
+        """
+        with self._pending_lock:
+            self._subscribers[msg_id].append(callback)
+
+    def unsubscribe(self, msg_id, callback):
+        """
+        Removes a callback added with subscribe.
+        """
+        with self._pending_lock:
+            callbacks = self._subscribers.get(msg_id)
+            if callbacks and callback in callbacks:
+                callbacks.remove(callback)
+
+    def wait(self, future, timeout):
+        """
+        Waits for a response future. On timeout the request is abandoned so a late response is not handed to the next
+        caller waiting on the same id.
+        :param future: Future returned by expect.
+        :param timeout: seconds to wait, None waits forever.
+        :return: the decoded response message.
+        """
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            if future.cancel():
+                self.timeouts += 1
+            raise TimeoutError("No response received within %s seconds." % timeout)
+        except CancelledError:
+            # abandoned by a later request through the same CAN route, see VESC.request
+            raise TimeoutError("No response received, the request was abandoned.")
+
+    def _read_loop(self):
+        """
+        Continuously reads the transport and dispatches every complete payload.
+        """
+        while not self._stop.is_set():
+            try:
+                # waits until some bytes arrive or the transport timeout expires, bytes land straight in the
+                # unpacker's receive buffer
+                count = self._unpacker.readinto(self.serial_port)
+            except Exception as e:
+                if not self._stop.is_set():
+                    self._fail_pending(e)
+                return
+            if count:
+                busy_start = time.perf_counter()
+                self.bytes += count
+                unpacker = self._unpacker
+                recorder = self.recorder
+                payload = unpacker.unpack()
+                while payload is not None:
+                    if recorder is not None:
+                        recorder.record(recorder.RX, unpacker.last_frame)
+                    self._dispatch(payload)
+                    payload = unpacker.unpack()
+                self.busy_time += time.perf_counter() - busy_start
+
+    def _next_future(self, msg_id):
+        """
+        :return: (the oldest future still waiting on msg_id, whether it wants the raw payload, the subscribed
+                 callbacks), future is None if no request is waiting.
+        """
+        with self._pending_lock:
+            callbacks = tuple(self._subscribers.get(msg_id, ()))
+            queue = self._pending.get(msg_id)
+            while queue:
+                future, raw, sent = queue.popleft()
+                if future.set_running_or_notify_cancel():
+                    histogram = self._rtt.get(msg_id)
+                    if histogram is None:
+                        histogram = self._rtt[msg_id] = Histogram()
+                    histogram.observe(time.perf_counter() - sent)
+                    return future, raw, callbacks
+        return None, False, callbacks
+
+    def _dispatch(self, payload):
+        """
+        Decodes a payload, resolves the future waiting on it and calls its subscribers. Messages nobody is waiting for
+        are dropped.
+        """
+        future, raw, callbacks = self._next_future(payload[0])
+        if future is None and not callbacks:
+            self.unsolicited += 1
+            return
+        if raw and not callbacks:
+            future.set_result(payload)
+            return
+        try:
+            msg = VESCMessage.unpack(payload, self.decoders.get(payload[0]))
+        except (KeyError, struct.error, UnicodeDecodeError) as e:
+            self.decode_errors += 1
+            if raw:
+                future.set_result(payload)
+            elif future is not None:
+                future.set_exception(e)
+            return
+        for callback in callbacks:
+            try:
+                callback(msg)
+            except Exception:
+                self.subscriber_errors += 1
+                _logger.exception('Subscriber of message %u raised', payload[0])
+        if future is not None:
+            future.set_result(payload if raw else msg)
+
+    def stats(self):
+        """
+        :return: dict with the frames and bytes received, corrupt frames and those among them with a bad checksum,
+                 bytes skipped while resyncing, frames that failed to decode or that nobody waited for, requests that
+                 timed out, exceptions raised by subscribers, the seconds spent decoding and dispatching (busy), and
+                 rtt: the round trip time histogram snapshot (see Histogram.snapshot) per response command name
+        """
+        unpacker = self._unpacker
+        with self._pending_lock:
+            rtt = {command_name(msg_id): histogram.snapshot() for msg_id, histogram in self._rtt.items()}
+        return {'frames': unpacker.packets, 'bytes': self.bytes, 'corrupt': unpacker.corrupt,
+                'crc_errors': unpacker.crc_errors, 'dropped_bytes': unpacker.dropped,
+                'decode_errors': self.decode_errors, 'unsolicited': self.unsolicited, 'timeouts': self.timeouts,
+                'subscriber_errors': self.subscriber_errors, 'busy': self.busy_time, 'rtt': rtt}
+
+    def _fail_pending(self, exception):
+        with self._pending_lock:
+            pending = [future for queue in self._pending.values() for future, _, _ in queue]
+            self._pending.clear()
+        for future in pending:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(exception)
@@ -0,0 +1,98 @@
+from array import array
+import math
+import threading
+import time
+
+
+class DeadlineScheduler(object):
+    """
+    Calls a task at a fixed rate on a background thread. Deadlines are multiples of the period after the start, so
+    lateness never accumulates: a slow call delays only the ticks it overlaps, and deadlines that already passed are
+    skipped (and counted in missed) instead of being run back to back to catch up.
+
+    The start time of every call is recorded, stats() reports the loop period and the jitter (how late each call
+    started after its deadline) over the most recent calls.
+    """
+    def __init__(self, rate, task, name='limmy-scheduler', spin=0.0, history=1000):
+        """
+        :param rate: calls per second
+        :param task: function called once per tick with no arguments
+        :param name: name of the thread
+        :param spin: seconds before each deadline to stop sleeping and busy wait instead. Trades CPU time for less
+                     jitter, a few hundred microseconds is plenty.
+        :param history: number of recent calls kept for stats
+        """
+        self.period = 1.0 / rate
+        self.task = task
+        self.spin = spin
+        self.ticks = 0
+        self.missed = 0
+        # start time and lateness of the latest calls, ring buffers of history entries
+        self._starts = array('d', bytes(8 * history))
+        self._lateness = array('d', bytes(8 * history))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _sleep_until(self, deadline):
+        now = time.monotonic()
+        if deadline - now > self.spin:
+            self._stop.wait(deadline - now - self.spin)
+        while time.monotonic() < deadline and not self._stop.is_set():
+            pass
+
+    def run(self):
+        """
+        Runs the loop on the calling thread until stop is called.
+        """
+        history = len(self._starts)
+        start = time.monotonic()
+        tick = 0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            slot = self.ticks % history
+            self._starts[slot] = now
+            self._lateness[slot] = now - (start + tick * self.period)
+            self.ticks += 1
+            self.task()
+            tick += 1
+            deadline = start + tick * self.period
+            now = time.monotonic()
+            if now > deadline:
+                # fell behind, skip the deadlines that already passed instead of bursting to catch up
+                skipped = int((now - deadline) / self.period) + 1
+                self.missed += skipped
+                tick += skipped
+                deadline = start + tick * self.period
+            self._sleep_until(deadline)
+
+    def stats(self):
+        """
+        :return: dict with the number of ticks run and missed, and the mean, standard deviation, min and max of the
+                 loop period and the mean, 99th percentile and max of the jitter, in seconds, over the recent calls
+        """
+        count = min(self.ticks, len(self._starts))
+        first = self.ticks - count
+        history = len(self._starts)
+        starts = [self._starts[i % history] for i in range(first, self.ticks)]
+        lateness = sorted(self._lateness[i % history] for i in range(first, self.ticks))
+        periods = [b - a for a, b in zip(starts, starts[1:])]
+        stats = {'ticks': self.ticks, 'missed': self.missed, 'period': self.period}
+        if periods:
+            mean = sum(periods) / len(periods)
+            stats.update(period_mean=mean, period_min=min(periods), period_max=max(periods),
+                         period_std=math.sqrt(sum((p - mean) ** 2 for p in periods) / len(periods)))
+        if lateness:
+            stats.update(jitter_mean=sum(lateness) / len(lateness), jitter_max=lateness[-1],
+                         jitter_p99=lateness[min(len(lateness) - 1, int(0.99 * len(lateness)))])
+        return stats
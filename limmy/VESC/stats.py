@@ -0,0 +1,138 @@
+from limmy.VESC.messages import VedderCmd
+import bisect
+
+# name of every VedderCmd id, for labelling per command statistics
+_command_names = {value: name for name, value in vars(VedderCmd).items() if name.startswith('COMM_')}
+
+
+def command_name(msg_id):
+    """
+    :param msg_id: VedderCmd id
+    :return: name of the command, i.e. "COMM_GET_VALUES"
+    """
+    return _command_names.get(msg_id, str(msg_id))
+
+
+class Histogram(object):
+    """
+    Counts observations in fixed buckets, the way Prometheus histograms do, so recording a value costs a binary search
+    and no memory grows with the number of observations. Only one thread may observe, any thread may snapshot.
+    """
+    # seconds, from a fast USB round trip to a response that is about to time out
+    LATENCY_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        """
+        :param bounds: increasing upper bounds of the buckets, values above the last one land in an overflow bucket
+        """
+        self.bounds = tuple(bounds)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        :param q: quantile in [0, 1]
+        :return: upper bound of the bucket the quantile falls in (max for the overflow bucket), None if empty
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self._counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        """
+        :return: dict with count, sum, mean, max, p50 and p99 (see quantile) and buckets, a list of (upper bound,
+                 cumulative count) ending with (inf, count)
+        """
+        counts = list(self._counts)
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else None,
+                'max': self.max, 'p50': self.quantile(0.5), 'p99': self.quantile(0.99), 'buckets': buckets}
+
+
+# (section, key) of VESC.stats() exported as counters, with their help text
+_counters = [
+    ('sent', 'frames', "Frames written to the link."),
+    ('sent', 'writes', "Writes to the link, several frames may be coalesced into one."),
+    ('sent', 'bytes', "Bytes written to the link."),
+    ('sent', 'dropped', "Queued commands dropped by a superseding command."),
+    ('received', 'frames', "Valid frames received from the link."),
+    ('received', 'bytes', "Bytes received from the link."),
+    ('received', 'crc_errors', "Frames received with a bad checksum."),
+    ('received', 'corrupt', "Corrupt frames received, including bad checksums."),
+    ('received', 'dropped_bytes', "Bytes skipped while resynchronizing after corruption."),
+    ('received', 'decode_errors', "Frames that could not be decoded into a message."),
+    ('received', 'unsolicited', "Frames received that nobody was waiting for."),
+    ('received', 'timeouts', "Requests that timed out waiting for their response."),
+    ('received', 'subscriber_errors', "Exceptions raised by subscriber callbacks."),
+    ('heartbeat', 'missed', "Times the gap between commands exceeded the heartbeat interval."),
+    ('busy', 'reader', "Seconds the reader thread spent decoding and dispatching."),
+    ('busy', 'writer', "Seconds the writer thread spent writing."),
+]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in labels.items())
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def to_prometheus(stats, labels=None, prefix='limmy'):
+    """
+    Formats the statistics of a VESC in the Prometheus text exposition format, i.e. for a /metrics endpoint.
+    :param stats: dict returned by VESC.stats, or a list of them to export several VESCs at once
+    :param labels: labels added to every sample, i.e. {'port': '/dev/ttyACM0'}, or a list with one dict per stats
+    :param prefix: prefix of the metric names
+    :return: the text
+    """
+    if isinstance(stats, dict):
+        stats = [stats]
+        labels = [labels]
+    elif labels is None:
+        labels = [None] * len(stats)
+    lines = []
+    for section, key, help_text in _counters:
+        name = '%s_%s_%s_total' % (prefix, section, key)
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s counter' % name)
+        for vesc_stats, vesc_labels in zip(stats, labels):
+            value = vesc_stats.get(section, {}).get(key)
+            if value is not None:
+                lines.append('%s%s %s' % (name, _format_labels(vesc_labels), _format_value(value)))
+    name = '%s_request_duration_seconds' % prefix
+    lines.append('# HELP %s Round trip time of requests, from queueing to the decoded response.' % name)
+    lines.append('# TYPE %s histogram' % name)
+    for vesc_stats, vesc_labels in zip(stats, labels):
+        for command, histogram in sorted(vesc_stats.get('rtt', {}).items()):
+            sample_labels = dict(vesc_labels or {}, command=command)
+            for bound, count in histogram['buckets']:
+                bucket_labels = dict(sample_labels, le=_format_value(bound))
+                lines.append('%s_bucket%s %u' % (name, _format_labels(bucket_labels), count))
+            lines.append('%s_sum%s %s' % (name, _format_labels(sample_labels), _format_value(histogram['sum'])))
+            lines.append('%s_count%s %u' % (name, _format_labels(sample_labels), histogram['count']))
+    return '\n'.join(lines) + '\n'
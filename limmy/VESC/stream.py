@@ -0,0 +1,176 @@
+from limmy.VESC.messages import GetValues
+from limmy.VESC.scheduler import DeadlineScheduler
+from limmy.VESC.writer import PRIORITY_LOW
+from array import array
+import struct
+import time
+
+# numpy is optional, without it the ring buffer columns are array.array and views are memoryviews
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class RingBuffer(object):
+    """
+    Fixed-size, preallocated ring buffer of float columns. Every sample is written twice, at its slot and at its slot
+    plus the capacity, so the latest N samples are always one contiguous region and can be handed out as views without
+    copying.
+    """
+    def __init__(self, columns, capacity):
+        """
+        :param columns: list of column names
+        :param capacity: number of samples kept
+        """
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.count = 0
+        if numpy is not None:
+            # one row per column, so each column is contiguous
+            self._data = numpy.zeros((len(self.columns), 2 * capacity), dtype=numpy.float64)
+            self._columns = list(self._data)
+        else:
+            self._columns = [array('d', bytes(8 * 2 * capacity)) for _ in self.columns]
+        self._index = {name: idx for idx, name in enumerate(self.columns)}
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, values):
+        """
+        Writes one sample.
+        :param values: one value per column, in column order
+        """
+        slot = self.count % self.capacity
+        mirror = slot + self.capacity
+        if numpy is not None:
+            self._data[:, slot] = values
+            self._data[:, mirror] = self._data[:, slot]
+        else:
+            for column, value in zip(self._columns, values):
+                column[slot] = value
+                column[mirror] = value
+        self.count += 1
+
+    def _window(self, n):
+        n = len(self) if n is None else min(n, len(self))
+        end = (self.count - 1) % self.capacity + 1 + self.capacity if self.count else self.capacity
+        return end - n, end
+
+    def latest(self, n=None):
+        """
+        Returns views of the latest n samples, oldest first. The views share memory with the buffer, so copy them if
+        they must outlive the next capacity samples.
+        :param n: number of samples, defaults to every sample held
+        :return: dict of column name to numpy array (or memoryview without numpy)
+        """
+        start, end = self._window(n)
+        if numpy is not None:
+            return {name: self._columns[idx][start:end] for idx, name in enumerate(self.columns)}
+        return {name: memoryview(self._columns[idx])[start:end] for idx, name in enumerate(self.columns)}
+
+    def column(self, name, n=None):
+        """
+        Returns a view of the latest n values of one column, oldest first.
+        :param name: column name
+        :param n: number of samples, defaults to every sample held
+        """
+        start, end = self._window(n)
+        if numpy is not None:
+            return self._columns[self._index[name]][start:end]
+        return memoryview(self._columns[self._index[name]])[start:end]
+
+
+class TelemetryStream(object):
+    """
+    Polls GetValues from a VESC at a fixed rate on a background thread and writes every sample, stamped with
+    time.monotonic() at the moment of the request, into a RingBuffer. Responses are decoded straight into the buffer
+    columns, so no message object is allocated per sample.
+
+    The columns are the GetValues fields of the VESC's firmware. If its profile changes while streaming (i.e. the
+    background check of a cached profile finds other firmware), the stream starts a new buffer with the new columns.
+    """
+    def __init__(self, vesc, rate, capacity=10000):
+        """
+        :param vesc: connected VESC to poll
+        :param rate: samples per second
+        :param capacity: number of samples kept
+        """
+        self.vesc = vesc
+        self.period = 1.0 / rate
+        self.capacity = capacity
+        self._set_layout(vesc.values_class)
+        self._failed = 0
+        self.scheduler = DeadlineScheduler(rate, self._poll, name='limmy-stream')
+
+    @property
+    def missed(self):
+        """
+        Samples lost to failed requests or to deadlines skipped after a slow response.
+        """
+        return self._failed + self.scheduler.missed
+
+    def start(self):
+        self.scheduler.start()
+
+    def stop(self):
+        self.scheduler.stop()
+
+    def stats(self):
+        """
+        See DeadlineScheduler.stats
+        """
+        return self.scheduler.stats()
+
+    def latest(self, n=None):
+        """
+        See RingBuffer.latest
+        """
+        return self.buffer.latest(n)
+
+    def column(self, name, n=None):
+        """
+        See RingBuffer.column
+        """
+        return self.buffer.column(name, n)
+
+    def _set_layout(self, values_class):
+        """
+        Decodes samples with the fields of values_class into a new buffer.
+        """
+        # mc_fault_code and app_controller_id are single chars in GetValues, read them as numbers here
+        fields = values_class.fields
+        self._values_class = values_class
+        self._struct = struct.Struct('!' + ''.join('B' if field[1] == 'c' else field[1] for field in fields))
+        self._scales = [field[2] if len(field) >= 3 and field[2] else 1 for field in fields]
+        if numpy is not None:
+            self._scale_vector = numpy.array([1.0] + self._scales)
+        self.buffer = RingBuffer(['timestamp'] + [field[0] for field in fields], self.capacity)
+
+    def _append(self, timestamp, payload):
+        raw = self._struct.unpack_from(payload, 1)
+        if numpy is not None:
+            slot = self.buffer.count % self.buffer.capacity
+            data = self.buffer._data
+            data[0, slot] = timestamp
+            data[1:, slot] = raw
+            data[:, slot] /= self._scale_vector
+            data[:, slot + self.buffer.capacity] = data[:, slot]
+            self.buffer.count += 1
+        else:
+            self.buffer.append([timestamp] + [value / scale for value, scale in zip(raw, self._scales)])
+
+    def _poll(self):
+        timestamp = time.monotonic()
+        try:
+            # telemetry must never delay commands
+            future = self.vesc.request(self.vesc._get_values_msg, GetValues.id, raw=True, priority=PRIORITY_LOW)
+            payload = self.vesc.wait(future)
+            # the layout is looked up per sample, the profile may change while streaming
+            values_class = self.vesc.values_class
+            if values_class is not self._values_class:
+                self._set_layout(values_class)
+            self._append(timestamp, payload)
+        except Exception:
+            self._failed += 1
@@ -0,0 +1,182 @@
+from array import array
+import collections
+import threading
+import time
+
+# transmit lanes, lower is sent first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class Writer(object):
+    """
+    The only thread that writes to a transport. Frames are queued in priority lanes and written in lane order, so a
+    halt never waits behind queued traffic for longer than the batch being written. Frames that are queued together
+    are coalesced into one write of up to max_batch bytes.
+
+    A frame queued with supersede (i.e. a halt) also drops the commands to the same target that are still queued in
+    the lower lanes, so a stale setpoint can't follow the halt onto the wire. Requests are never dropped.
+    """
+    LANES = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+
+    def __init__(self, serial_port, max_batch=1024, max_queued=1024, history=1000):
+        """
+        :param serial_port: open limmy.transport.Transport
+        :param max_batch: largest number of bytes coalesced into one write
+        :param max_queued: frames a normal or low lane holds before put blocks, the high lane never blocks
+        :param history: number of recent frames kept for the latency stats
+        """
+        self.serial_port = serial_port
+        self.max_batch = max_batch
+        self.max_queued = max_queued
+        # each entry is (data, target, is_command, time queued)
+        self._lanes = [collections.deque() for _ in Writer.LANES]
+        self._cond = threading.Condition()
+        self._busy = False
+        self._stop = False
+        self.error = None
+        # frames, writes and bytes sent, queued commands dropped by a superseding frame, deepest queue seen
+        self.frames = 0
+        self.writes = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.max_depth = 0
+        # seconds spent in writes to the transport
+        self.busy_time = 0.0
+        # limmy.recorder.Recorder every frame written is recorded to, if not None
+        self.recorder = None
+        # time from queueing to the end of the write, of the latest frames
+        self._latency = array('d', bytes(8 * history))
+        self._thread = threading.Thread(target=self._write_loop, name='limmy-writer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Writes whatever is still queued, then stops the writer thread.
+        :param timeout: seconds to wait for the queue to drain, None waits forever
+        """
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def depth(self):
+        """
+        :return: number of frames queued in each lane
+        """
+        with self._cond:
+            return [len(lane) for lane in self._lanes]
+
+    def put(self, data, priority=PRIORITY_NORMAL, target=None, is_command=True, supersede=False):
+        """
+        Queues a frame for writing.
+        :param data: the encoded frame
+        :param priority: lane to queue it in, PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW
+        :param target: CAN id the frame is addressed to, None for the VESC on the port
+        :param is_command: False for requests, which supersede never drops
+        :param supersede: drop the commands to target still queued in lower lanes
+        """
+        now = time.monotonic()
+        with self._cond:
+            if self.error is not None:
+                raise self.error
+            if self._stop:
+                raise ConnectionError("Writer stopped.")
+            lane = self._lanes[priority]
+            if priority != PRIORITY_HIGH:
+                while len(lane) >= self.max_queued and self.error is None and not self._stop:
+                    self._cond.wait()
+            if supersede:
+                for lower in self._lanes[priority + 1:]:
+                    kept = [entry for entry in lower if not (entry[2] and entry[1] == target)]
+                    self.dropped += len(lower) - len(kept)
+                    lower.clear()
+                    lower.extend(kept)
+            lane.append((data, target, is_command, now))
+            self.max_depth = max(self.max_depth, sum(len(lane) for lane in self._lanes))
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued frame has been written.
+        :return: True if the queue drained within timeout
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.error is not None or
+                                       (not self._busy and not any(self._lanes)), timeout)
+
+    def _take_batch(self):
+        """
+        Takes frames in lane order until max_batch bytes, always at least one. Must hold the lock.
+        """
+        batch = []
+        size = 0
+        for lane in self._lanes:
+            while lane and (not batch or size + len(lane[0][0]) <= self.max_batch):
+                entry = lane.popleft()
+                batch.append(entry)
+                size += len(entry[0])
+            if size >= self.max_batch:
+                break
+        return batch
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stop or any(self._lanes))
+                if not any(self._lanes):
+                    return
+                batch = self._take_batch()
+                self._busy = True
+                # room in the lanes, wake blocked producers
+                self._cond.notify_all()
+            write_start = time.perf_counter()
+            try:
+                data = batch[0][0] if len(batch) == 1 else b''.join(entry[0] for entry in batch)
+                self.serial_port.write(data)
+            except Exception as e:
+                with self._cond:
+                    self.error = e
+                    self._busy = False
+                    for lane in self._lanes:
+                        lane.clear()
+                    self._cond.notify_all()
+                return
+            recorder = self.recorder
+            if recorder is not None:
+                recorder.record_many(recorder.TX, [entry[0] for entry in batch])
+            now = time.monotonic()
+            with self._cond:
+                self.busy_time += time.perf_counter() - write_start
+                history = len(self._latency)
+                for entry in batch:
+                    self._latency[self.frames % history] = now - entry[3]
+                    self.frames += 1
+                self.writes += 1
+                self.bytes += len(data)
+                self._busy = False
+                self._cond.notify_all()
+
+    def stats(self):
+        """
+        :return: dict with the frames, writes and bytes sent, frames dropped by supersede, the current depth of each
+                 lane, the deepest queue seen, the seconds spent writing (busy), and the mean, 99th percentile and max
+                 latency in seconds from queueing to the end of the write over the recent frames
+        """
+        with self._cond:
+            count = min(self.frames, len(self._latency))
+            latency = sorted(self._latency[:count]) if count < len(self._latency) else sorted(self._latency)
+            stats = {'frames': self.frames, 'writes': self.writes, 'bytes': self.bytes, 'dropped': self.dropped,
+                     'depth': [len(lane) for lane in self._lanes], 'max_depth': self.max_depth,
+                     'busy': self.busy_time}
+        if latency:
+            stats.update(latency_mean=sum(latency) / len(latency), latency_max=latency[-1],
+                         latency_p99=latency[min(len(latency) - 1, int(0.99 * len(latency)))])
+        return stats
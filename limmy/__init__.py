@@ -6,14 +6,66 @@ following functions:
         provides methods for controlling the motor, as well as reading
         data from the motor controller.
 
+    * AsyncVESC: The asyncio counterpart of VESC, for programs that already
+        run an event loop.
+
+    * VESCGroup: Owns several VESCs and sends commands to all of them
+        together, with one shared heartbeat.
+
+    * SlipController: Closed-loop slip frequency control of a LIM, re-issuing
+        engage at a fixed rate as the measured speed changes.
+
+    * limmy.transport: The links a VESC can be reached over (serial, TCP,
+        SocketCAN and an in-memory loopback).
+
+    * limmy.emulator: An emulated VESC on a pseudo-terminal, for running and
+        load-testing without hardware.
+
+    * limmy.recorder: Records every frame of a link to a binary log and
+        reads logs back with a time index.
+
+    * DeviceProfile, ProfileCache: The firmware version and capabilities of
+        the VESC on each port, cached between runs so connecting doesn't wait
+        for the firmware probe.
+
+    Only VESC and the protocol functions are imported with limmy, everything
+    else is imported the first time it is used.
+
     For examples on how to use, see examples in the examples directory.
 
 Written by Adrian Ornelas, with help from Lea Pang and Saketh Karumuri
 '''
 
 import sys
-if sys.version_info < (3, 3):
-    raise SystemExit("Invalid Python version. limmy requires Python 3.3 or greater.")
+if sys.version_info < (3, 7):
+    raise SystemExit("Invalid Python version. limmy requires Python 3.7 or greater.")
 
+import importlib
 from limmy.protocol import *
-from limmy.VESC import *
+from limmy.VESC import VESC
+
+# subpackages imported the first time they are used
+_submodules = ('transport', 'emulator', 'recorder', 'benchmarks')
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    # the rest of limmy.VESC, i.e. AsyncVESC, is imported when first used, see limmy.VESC._lazy
+    if not name.startswith('_'):
+        try:
+            return getattr(sys.modules['limmy.VESC'], name)
+        except AttributeError:
+            pass
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(sys.modules['limmy.VESC'].__all__) | set(_submodules))
+
+
+# what from limmy import * gets: the protocol API and everything limmy.VESC exports, including the names it imports
+# when first used
+__all__ = ['VESCMessage', 'encode', 'encode_request', 'encode_cached', 'encode_request_cached', 'encode_many', 'decode',
+           'iter_decode', 'decode_all', 'decode_file', 'frame', 'unframe', 'Stateless', 'Stateful', 'Header', 'Footer',
+           'CrcXmodem', 'CorruptPacket', 'InvalidChecksum', 'InvalidPayload'] + sys.modules['limmy.VESC'].__all__
@@ -0,0 +1,14 @@
+'''
+Benchmarks for limmy:
+
+    * crc: CRC16-XMODEM throughput.
+    * protocol: encode and decode per message class, unpacking clean and
+        corrupted streams.
+    * link: round trip latency and pipelined throughput of VESC against the
+        emulator (limmy.emulator) on a pty or a loopback.
+
+python -m limmy.benchmarks runs them all and writes the results to a JSON
+file. Each module can also be run on its own, i.e.
+
+    python -m limmy.benchmarks.crc
+'''
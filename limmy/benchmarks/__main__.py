@@ -0,0 +1,76 @@
+'''
+Runs every benchmark and writes the results to a JSON file, so runs on
+different commits or machines can be compared:
+
+    python -m limmy.benchmarks -o results.json
+    python -m limmy.benchmarks --quick --suite protocol link
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+from limmy.benchmarks import crc, link, protocol
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(suites, quick=False, transports=('pty', 'loopback')):
+    """
+    :param suites: names of the suites to run, from 'crc', 'protocol' and 'link'
+    :param quick: use fewer iterations, for a smoke test rather than numbers to compare
+    :param transports: transports the link suite runs over
+    :return: dict of results per suite
+    """
+    scale = 10 if quick else 1
+    results = {}
+    if 'crc' in suites:
+        results['crc'] = {'mb_per_s': crc.benchmark_crc(number=20 // scale)}
+    if 'protocol' in suites:
+        results['protocol'] = {
+            'encode_us': protocol.benchmark_encode(number=20000 // scale),
+            'decode_us': protocol.benchmark_decode(number=20000 // scale),
+            'unpack': protocol.benchmark_unpack(num_packets=2000 // scale),
+        }
+    if 'link' in suites:
+        results['link'] = {transport: {
+            'round_trip': link.benchmark_round_trip(transport, num_requests=1000 // scale),
+            'throughput': link.benchmark_throughput(transport, num_requests=5000 // scale),
+        } for transport in transports}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the limmy benchmarks.")
+    parser.add_argument('-o', '--output', default='benchmarks.json', help="JSON file to write the results to")
+    parser.add_argument('--suite', nargs='+', choices=('crc', 'protocol', 'link'),
+                        default=['crc', 'protocol', 'link'], help="suites to run")
+    parser.add_argument('--transport', nargs='+', choices=('pty', 'loopback'), default=['pty', 'loopback'],
+                        help="transports of the link suite")
+    parser.add_argument('--quick', action='store_true', help="fewer iterations, for a smoke test")
+    args = parser.parse_args(argv)
+
+    report = {
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'revision': _git_revision(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'quick': args.quick,
+        'results': run(args.suite, args.quick, args.transport),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("[INFO] Benchmark results written to %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import os
+import timeit
+from limmy.protocol.packet.crc import CrcXmodem
+
+# the previous crc path, only needed to compare against
+try:
+    from crccheck.crc import CrcXmodem as CrccheckXmodem
+except ImportError:
+    CrccheckXmodem = None
+
+
+def _throughput(func, total_bytes, number):
+    """
+    :return: throughput of func in MB/s
+    """
+    elapsed = min(timeit.repeat(func, number=number, repeat=3))
+    return total_bytes * number / elapsed / 1e6
+
+
+def benchmark_crc(payload_size=64, num_payloads=1000, number=20):
+    """
+    Compares the built-in CRC engine against crccheck.
+    :param payload_size: size of each payload in bytes (a GetValues payload is 64 bytes)
+    :param num_payloads: number of payloads checked per run
+    :param number: number of runs per measurement
+    :return: dict of throughputs in MB/s
+    """
+    payloads = [os.urandom(payload_size) for _ in range(num_payloads)]
+    crcs = CrcXmodem.calc_many(payloads)
+    total_bytes = payload_size * num_payloads
+    results = {
+        'builtin_calc': _throughput(lambda: [CrcXmodem.calc(p) for p in payloads], total_bytes, number),
+        'builtin_check_many': _throughput(lambda: CrcXmodem.check_many(payloads, crcs), total_bytes, number),
+    }
+    if CrccheckXmodem is not None:
+        checker = CrccheckXmodem()
+        assert [checker.calc(p) for p in payloads] == crcs
+        results['crccheck_calc'] = _throughput(lambda: [checker.calc(p) for p in payloads], total_bytes, 1)
+    return results
+
+
+if __name__ == '__main__':
+    for name, mb_per_s in benchmark_crc().items():
+        print(f'{name:20s} {mb_per_s:10.2f} MB/s')
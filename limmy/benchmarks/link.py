@@ -0,0 +1,83 @@
+from concurrent.futures import TimeoutError
+import statistics
+import time
+from limmy.emulator import VESCEmulator
+from limmy.VESC import VESC
+from limmy.VESC.messages import GetValues, get_values_msg
+
+
+def _emulator(transport, **kwargs):
+    if transport == 'pty':
+        return VESCEmulator(**kwargs)
+    if transport == 'loopback':
+        return VESCEmulator.loopback(**kwargs)
+    raise ValueError("Unknown transport %r, use 'pty' or 'loopback'" % transport)
+
+
+def benchmark_round_trip(transport='pty', num_requests=1000, latency=0.0, jitter=0.0):
+    """
+    Times GetValues requests to an emulated VESC, one at a time.
+    :param transport: 'pty' for the emulator on a pseudo-terminal, 'loopback' to leave the kernel out
+    :param num_requests: number of requests timed
+    :param latency: response delay of the emulator in seconds, see VESCEmulator
+    :param jitter: random extra response delay of the emulator in seconds
+    :return: dict of round trip statistics in milliseconds and requests/s
+    """
+    with _emulator(transport, latency=latency, jitter=jitter) as emulator:
+        with VESC(emulator.port, start_heartbeat=False) as motor:
+            # warm up the caches and the reader thread
+            for _ in range(10):
+                motor.write(get_values_msg, GetValues.id)
+            times = []
+            start = time.perf_counter()
+            for _ in range(num_requests):
+                request_start = time.perf_counter()
+                motor.write(get_values_msg, GetValues.id)
+                times.append((time.perf_counter() - request_start) * 1000)
+            elapsed = time.perf_counter() - start
+    times.sort()
+    return {'mean_ms': statistics.mean(times),
+            'p50_ms': times[len(times) // 2],
+            'p99_ms': times[int(len(times) * 0.99)],
+            'max_ms': times[-1],
+            'requests_per_s': num_requests / elapsed}
+
+
+def benchmark_throughput(transport='pty', num_requests=5000, window=32, latency=0.0):
+    """
+    Keeps window GetValues requests in flight to an emulated VESC, which shows how many measurements per second the
+    library can move when the link latency is hidden.
+    :param transport: 'pty' or 'loopback', see benchmark_round_trip
+    :param num_requests: number of requests sent
+    :param window: number of requests in flight at once
+    :param latency: response delay of the emulator in seconds
+    :return: dict with requests/s and the number of responses that did not arrive
+    """
+    with _emulator(transport, latency=latency) as emulator:
+        with VESC(emulator.port, start_heartbeat=False) as motor:
+            in_flight = []
+            lost = 0
+            start = time.perf_counter()
+            for _ in range(num_requests):
+                if len(in_flight) >= window:
+                    try:
+                        motor.wait(in_flight.pop(0))
+                    except TimeoutError:
+                        lost += 1
+                in_flight.append(motor.request(get_values_msg, GetValues.id))
+            for future in in_flight:
+                try:
+                    motor.wait(future)
+                except TimeoutError:
+                    lost += 1
+            elapsed = time.perf_counter() - start
+    return {'requests_per_s': num_requests / elapsed, 'lost': lost, 'window': window}
+
+
+if __name__ == '__main__':
+    for transport in ('pty', 'loopback'):
+        stats = benchmark_round_trip(transport)
+        print(f'{transport:8s} round trip p50 {stats["p50_ms"]:6.3f} ms  p99 {stats["p99_ms"]:6.3f} ms  '
+              f'{stats["requests_per_s"]:8.0f} req/s')
+        stats = benchmark_throughput(transport)
+        print(f'{transport:8s} pipelined {stats["requests_per_s"]:8.0f} req/s  lost {stats["lost"]}')
@@ -0,0 +1,126 @@
+import random
+import timeit
+from limmy.protocol.base import VESCMessage
+from limmy.protocol.interface import encode
+from limmy.protocol.packet.codec import Stateful, Stateless, frame
+from limmy.VESC.messages import GetValues
+
+# sample value for each struct format character, scaled fields are given in their unscaled unit
+_sample_values = {'c': b'\x01', 's': 'foc_openloop 30 1800', 'f': 0.5, 'd': 0.5, '?': True}
+
+
+def _per_call(func, number):
+    """
+    :return: best time per call of func in microseconds
+    """
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def _sample_message(msg_cls):
+    """
+    :return: instance of msg_cls with a plausible value in every field
+    """
+    return msg_cls(*(_sample_values.get(field[1], 1) for field in msg_cls.fields))
+
+
+def _message_classes():
+    """
+    :return: registered message classes decoded from their fields layout, by name
+    """
+    classes = {msg_cls.__name__: msg_cls for msg_cls in VESCMessage._msg_registry.values()
+               if msg_cls._decode is None}
+    return dict(sorted(classes.items()))
+
+
+def benchmark_encode(number=20000):
+    """
+    :param number: number of encodes per measurement
+    :return: dict of message class name to microseconds per encode, framing included
+    """
+    results = {}
+    for name, msg_cls in _message_classes().items():
+        msg = _sample_message(msg_cls)
+        results[name] = _per_call(lambda: encode(msg), number)
+    return results
+
+
+def benchmark_decode(number=20000):
+    """
+    :param number: number of decodes per measurement
+    :return: dict of message class name to microseconds per decode of a payload
+    """
+    results = {}
+    for name, msg_cls in _message_classes().items():
+        payload = VESCMessage.pack(_sample_message(msg_cls))
+        results[name] = _per_call(lambda: VESCMessage.unpack(payload), number)
+    return results
+
+
+def noisy_stream(num_packets, corruption, seed=0):
+    """
+    Builds a stream of GetValues packets as a VESC would send them, with random bytes flipped.
+    :param num_packets: number of packets in the stream
+    :param corruption: probability that a byte is flipped
+    :param seed: seed of the random generator
+    :return: the stream
+    """
+    packet = frame(VESCMessage.pack(GetValues(*(_sample_values.get(field[1], 1) for field in GetValues.fields))))
+    stream = bytearray(packet * num_packets)
+    rng = random.Random(seed)
+    if corruption:
+        for _ in range(int(len(stream) * corruption)):
+            stream[rng.randrange(len(stream))] ^= rng.randrange(1, 256)
+    return bytes(stream)
+
+
+def _unpack_stateless(stream):
+    view = memoryview(stream)
+    count = 0
+    while view:
+        payload, consumed = Stateless.unpack(view)
+        if consumed == 0:
+            break
+        if payload is not None:
+            count += 1
+        view = view[consumed:]
+    return count
+
+
+def _unpack_stateful(stream, chunk_size=4096):
+    unpacker = Stateful()
+    count = 0
+    for idx in range(0, len(stream), chunk_size):
+        count += len(unpacker.feed(stream[idx:idx + chunk_size]))
+    return count
+
+
+def benchmark_unpack(corruption_rates=(0.0, 0.0001, 0.001, 0.01), num_packets=2000, number=3):
+    """
+    Unpacks streams of GetValues packets with the given fraction of corrupted bytes.
+    :param corruption_rates: fractions of bytes to corrupt, one measurement each
+    :param num_packets: number of packets per stream
+    :param number: number of runs per measurement
+    :return: dict of corruption rate to results of both unpackers: MB/s, packets/s and the fraction of packets
+             recovered
+    """
+    results = {}
+    for rate in corruption_rates:
+        stream = noisy_stream(num_packets, rate)
+        result = {}
+        for name, func in (('stateless', _unpack_stateless), ('stateful', _unpack_stateful)):
+            elapsed = min(timeit.repeat(lambda: func(stream), number=number, repeat=3)) / number
+            recovered = func(stream)
+            result[name] = {'mb_per_s': len(stream) / elapsed / 1e6,
+                            'packets_per_s': recovered / elapsed,
+                            'recovered': recovered / num_packets}
+        results[str(rate)] = result
+    return results
+
+
+if __name__ == '__main__':
+    for title, results in (('encode', benchmark_encode()), ('decode', benchmark_decode())):
+        for name, us in results.items():
+            print(f'{title} {name:28s} {us:8.2f} us')
+    for rate, result in benchmark_unpack().items():
+        for name, stats in result.items():
+            print(f'unpack {rate:8s} {name:10s} {stats["mb_per_s"]:8.2f} MB/s {stats["recovered"]:7.1%} recovered')
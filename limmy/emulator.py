@@ -0,0 +1,477 @@
+'''
+Emulates the VESC firmware, so limmy (and anything built on it) can be run,
+load-tested and debugged without hardware:
+
+    with VESCEmulator(latency=0.002, jitter=0.001, noise=0.01) as emulator:
+        motor = limmy.VESC(serial_port=emulator.port)
+        motor.engage(30, 30)
+        print(motor.get_rpm())
+
+By default the emulator opens a pseudo-terminal and port is the path of its
+slave end, which can be handed to anything expecting a serial device. Run
+
+    python -m limmy.emulator
+
+to print that path and serve until interrupted, i.e. for the examples. Pass
+transport=LoopbackTransport.pair() ends (or use VESCEmulator.loopback()) to
+skip the kernel altogether.
+
+The emulator answers GetVersion, GetValues, GetValuesSelective,
+GetRotorPosition, PingCAN, COMM_FORWARD_CAN to the nodes in can_ids, the GPD
+commands (with a buffer that drains at the GPD sample rate) and terminal
+commands. Responses can be delayed (latency, jitter), measurements made noisy
+and response frames corrupted to exercise the error paths of the host.
+'''
+from limmy.protocol.base import VESCMessage
+from limmy.protocol.packet.codec import Stateful, frame
+from limmy.transport import Transport, LoopbackTransport
+from limmy.VESC.messages import *
+from limmy.VESC.profile import SCHEMAS, schema_for
+import collections
+import heapq
+import logging
+import os
+import random
+import select
+import struct
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class PtyTransport(Transport):
+    """
+    Master end of a pseudo-terminal. Whatever is written to it is read from the slave device at path, and the other
+    way around. POSIX only.
+    """
+    def __init__(self, timeout=0.05):
+        import pty
+        import tty
+        super(PtyTransport, self).__init__(timeout)
+        self.master, self._slave = pty.openpty()
+        # no echo or line editing, the packets are binary
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+
+    def fileno(self):
+        return self.master
+
+    def write(self, data):
+        with memoryview(data) as view:
+            while view:
+                view = view[os.write(self.master, view):]
+
+    def readinto(self, buffer):
+        if not select.select([self.master], [], [], self.timeout)[0]:
+            return 0
+        data = os.read(self.master, len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            os.close(self.master)
+            os.close(self._slave)
+
+
+class _Motor(object):
+    """
+    State of one emulated VESC and a first order model of the motor it drives.
+    """
+    # seconds the rpm takes to settle to about 63% of a new setpoint
+    TIME_CONSTANT = 0.2
+
+    def __init__(self, can_id, v_in, gpd_buffer_size):
+        self.can_id = can_id
+        self.v_in = v_in
+        self.current = 0.0
+        self.duty = 0.0
+        self.target_rpm = 0.0
+        self.rpm = 0.0
+        self.tachometer = 0.0
+        self.rotor_pos = 0.0
+        self.last_update = time.monotonic()
+        self.last_command = self.last_update
+        self.start_time = self.last_update
+        self.gpd_frequency = 20000
+        self.gpd_buffer_size = gpd_buffer_size
+        self.gpd_level = 0.0
+        self.gpd_notified = True
+        self.gpd_underruns = 0
+
+    def update(self, now, timeout):
+        """
+        Advances the model to now.
+        :param now: time.monotonic() timestamp
+        :param timeout: seconds without commands after which the firmware releases the motor, 0 to never time out
+        """
+        if timeout and now - self.last_command > timeout:
+            self.release()
+        dt = now - self.last_update
+        self.last_update = now
+        self.rpm += (self.target_rpm - self.rpm) * min(1.0, dt / _Motor.TIME_CONSTANT)
+        revolutions = self.rpm / 60 * dt
+        self.tachometer += revolutions * 6
+        self.rotor_pos = (self.rotor_pos + revolutions * 360) % 360
+        if self.gpd_level > 0:
+            self.gpd_level -= self.gpd_frequency * dt
+            if self.gpd_level <= 0:
+                self.gpd_level = 0.0
+                self.gpd_underruns += 1
+
+    def release(self):
+        self.current = 0.0
+        self.duty = 0.0
+        self.target_rpm = 0.0
+
+    def fill_gpd(self, samples):
+        if self.gpd_level == 0 and samples:
+            # the buffer ran dry, restart playback from now
+            self.gpd_notified = False
+        self.gpd_level = min(self.gpd_buffer_size, self.gpd_level + samples)
+        if self.gpd_level > self.gpd_buffer_size / 2:
+            self.gpd_notified = False
+
+    def values(self):
+        """
+        :return: dict of every GetValues field of current and pre v3.33 firmware, unscaled
+        """
+        return {
+            'temp_fet': 25.0 + abs(self.current) * 0.2,
+            'temp_motor': 25.0 + abs(self.current) * 0.3,
+            'avg_motor_current': self.current,
+            'avg_input_current': self.current * abs(self.duty),
+            'avg_id': 0.0,
+            'avg_iq': self.current,
+            'duty_cycle_now': self.duty,
+            'rpm': self.rpm,
+            'v_in': self.v_in,
+            'amp_hours': 0.0,
+            'amp_hours_charged': 0.0,
+            'watt_hours': 0.0,
+            'watt_hours_charged': 0.0,
+            'tachometer': int(self.tachometer),
+            'tachometer_abs': int(abs(self.tachometer)),
+            'mc_fault_code': b'\x00',
+            'pid_pos_now': self.rotor_pos,
+            'app_controller_id': bytes((self.can_id or 0,)),
+            'time_ms': int((self.last_update - self.start_time) * 1000),
+            'temp_mos1': 25.0,
+            'temp_mos2': 25.0,
+            'temp_mos3': 25.0,
+            'avg_vd': 0.0,
+            'avg_vq': 0.0,
+            'temp_mos4': 25.0,
+            'temp_mos5': 25.0,
+            'temp_mos6': 25.0,
+            'temp_pcb': 25.0,
+            'current_motor': self.current,
+            'current_in': self.current * abs(self.duty),
+            'duty_now': self.duty,
+        }
+
+
+class VESCEmulator(object):
+    """
+    Emulated VESC speaking the VESC protocol over a pseudo-terminal or any other Transport. See the module docstring.
+    """
+    # measurements that noise is applied to
+    NOISY_FIELDS = frozenset(('temp_fet', 'temp_motor', 'avg_motor_current', 'avg_input_current', 'avg_id', 'avg_iq',
+                              'rpm', 'v_in', 'temp_mos1', 'temp_mos2', 'temp_mos3', 'avg_vd', 'avg_vq'))
+    # struct format character of the samples carried by each GPD fill buffer command
+    GPD_SAMPLE_FORMATS = {VedderCmd.COMM_GPD_FILL_BUFFER: 'f',
+                          VedderCmd.COMM_GPD_FILL_BUFFER_INT8: 'b',
+                          VedderCmd.COMM_GPD_FILL_BUFFER_INT16: 'h'}
+
+    def __init__(self, transport=None, version='6.0.1', can_ids=(), latency=0.0, jitter=0.0, noise=0.0,
+                 corruption=0.0, timeout=1.0, v_in=48.0, gpd_buffer_size=4096, seed=None):
+        """
+        :param transport: device end of the link, a new pseudo-terminal if None
+        :param version: firmware version to report, i.e. "5.2.0"
+        :param can_ids: controller ids of emulated VESCs on the CAN bus behind this one
+        :param latency: seconds between receiving a request and sending its response
+        :param jitter: maximum random extra delay in seconds, added to latency
+        :param noise: standard deviation of the measurement noise, relative to each value
+        :param corruption: probability that a byte of a response frame is flipped
+        :param timeout: seconds without commands after which the motor is released like the firmware does, 0 disables
+        :param v_in: input voltage to report
+        :param gpd_buffer_size: number of samples the GPD buffer holds
+        :param seed: seed of the random generator, for reproducible noise and corruption
+        """
+        parts = version.split('.')
+        if len(parts) != 3 or not all(part.isdigit() for part in parts):
+            raise ValueError("version must be three numbers separated by dots, i.e. \"5.2.0\", not %r" % version)
+        self.version = tuple(int(part) for part in parts)
+        self.transport = PtyTransport() if transport is None else transport
+        # GetValues layout of the firmware version
+        self._values_class = SCHEMAS[schema_for(version)]
+        self.latency = latency
+        self.jitter = jitter
+        self.noise = noise
+        self.corruption = corruption
+        self.timeout = timeout
+        self._random = random.Random(seed)
+        self._motors = {can_id: _Motor(can_id, v_in, gpd_buffer_size) for can_id in (None,) + tuple(can_ids)}
+        self._unpacker = Stateful()
+        # responses waiting for their send time, (time, sequence number, frame)
+        self._outbox = []
+        self._sequence = 0
+        self._last_due = 0.0
+        self._lock = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        # statistics
+        self.requests = collections.Counter()
+        self.responses = 0
+        self.corrupted = 0
+        # requests whose handling raised, the emulator skips them and keeps serving
+        self.errors = 0
+
+    @staticmethod
+    def loopback(**kwargs):
+        """
+        :param kwargs: see VESCEmulator
+        :return: emulator on one end of a LoopbackTransport, its port is the other end
+        """
+        host, device = LoopbackTransport.pair()
+        emulator = VESCEmulator(transport=device, **kwargs)
+        emulator._host = host
+        return emulator
+
+    @property
+    def port(self):
+        """
+        What to pass as serial_port to VESC: the pty device path, or the host end of a loopback.
+        """
+        if isinstance(self.transport, PtyTransport):
+            return self.transport.path
+        return getattr(self, '_host', None)
+
+    @property
+    def gpd_underruns(self):
+        return sum(motor.gpd_underruns for motor in self._motors.values())
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        """
+        Starts answering in background threads.
+        """
+        self._threads = [threading.Thread(target=self._read_loop, name="limmy-emulator-rx", daemon=True),
+                         threading.Thread(target=self._write_loop, name="limmy-emulator-tx", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Stops the threads and closes the transport.
+        """
+        self._stop.set()
+        with self._lock:
+            self._lock.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self.transport.close()
+
+    def serve_forever(self):
+        """
+        Starts answering and blocks until interrupted.
+        """
+        self.start()
+        try:
+            while not self._stop.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def _read_loop(self):
+        while not self._stop.is_set():
+            try:
+                if not self._unpacker.readinto(self.transport):
+                    continue
+            except (OSError, ConnectionError):
+                return
+            for payload in self._unpacker.unpack_all():
+                try:
+                    self._handle(bytes(payload))
+                except Exception:
+                    self.errors += 1
+                    _logger.exception("Emulated VESC failed to handle request %s", bytes(payload).hex())
+
+    def _write_loop(self):
+        with self._lock:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                self._check_gpd(now)
+                if self._outbox and self._outbox[0][0] <= now:
+                    _, _, data = heapq.heappop(self._outbox)
+                    try:
+                        self.transport.write(data)
+                    except (OSError, ConnectionError):
+                        return
+                    continue
+                # wake up for the next response, and often enough to notice the GPD buffer running low
+                wait = 0.005 if not self._outbox else min(0.005, self._outbox[0][0] - now)
+                self._lock.wait(wait)
+
+    def _send(self, payload):
+        """
+        Queues a response, delayed by latency and jitter and possibly corrupted. Must hold the lock.
+        """
+        data = bytearray(frame(payload))
+        if self.corruption:
+            for idx in range(len(data)):
+                if self._random.random() < self.corruption:
+                    data[idx] ^= self._random.randrange(1, 256)
+                    self.corrupted += 1
+        due = time.monotonic() + self.latency
+        if self.jitter:
+            due += self._random.uniform(0, self.jitter)
+        # a serial link delivers in order, so jitter can delay a response but never reorder it
+        due = max(due, self._last_due)
+        self._last_due = due
+        self._sequence += 1
+        heapq.heappush(self._outbox, (due, self._sequence, bytes(data)))
+        self.responses += 1
+        self._lock.notify()
+
+    def _check_gpd(self, now):
+        """
+        Sends COMM_GPD_BUFFER_NOTIFY when a GPD buffer drains below half, like the firmware. Must hold the lock.
+        """
+        for motor in self._motors.values():
+            if motor.gpd_notified:
+                continue
+            motor.update(now, self.timeout)
+            if motor.gpd_level < motor.gpd_buffer_size / 2:
+                motor.gpd_notified = True
+                self._send(bytes((VedderCmd.COMM_GPD_BUFFER_NOTIFY,)))
+
+    def _noisy(self, name, value):
+        if self.noise and name in VESCEmulator.NOISY_FIELDS:
+            return value + self._random.gauss(0.0, self.noise * abs(value))
+        return value
+
+    def _handle(self, payload):
+        """
+        Answers one request.
+        """
+        with self._lock:
+            can_id = None
+            if payload[0] == VedderCmd.COMM_FORWARD_CAN:
+                can_id = payload[1]
+                payload = payload[2:]
+                if can_id not in self._motors:
+                    # nobody on the bus with that id
+                    return
+            self.requests[payload[0]] += 1
+            motor = self._motors[can_id]
+            now = time.monotonic()
+            motor.update(now, self.timeout)
+            response = self._respond(motor, payload, now)
+            if response is not None:
+                self._send(response)
+
+    def _respond(self, motor, payload, now):
+        """
+        Applies a request to the model of a motor.
+        :return: the response payload, None if the request has none
+        """
+        cmd = payload[0]
+        if cmd == VedderCmd.COMM_FW_VERSION:
+            return VESCMessage.pack(GetVersion(*self.version))
+        if cmd == VedderCmd.COMM_GET_VALUES:
+            values = motor.values()
+            values_class = self._values_class
+            return VESCMessage.pack(values_class(*(self._noisy(name, values[name])
+                                                   for name in values_class._field_names)))
+        if cmd == VedderCmd.COMM_GET_VALUES_SELECTIVE:
+            mask, = struct.unpack_from('!I', payload, 1)
+            fields_struct, names, scales = GetValuesSelective._codec(mask)
+            values = motor.values()
+            data = [self._noisy(name, values[name]) for name in names]
+            for idx, scalar in scales:
+                data[idx] = int(data[idx] * scalar)
+            return payload[:5] + fields_struct.pack(*data)
+        if cmd == VedderCmd.COMM_ROTOR_POSITION:
+            return VESCMessage.pack(GetRotorPosition(motor.rotor_pos))
+        if cmd == VedderCmd.COMM_PING_CAN:
+            return bytes((cmd,)) + bytes(can_id for can_id in self._motors if can_id is not None)
+        if cmd == VedderCmd.COMM_GPD_BUFFER_SIZE_LEFT:
+            return VESCMessage.pack(GetGPDBufferSizeLeft(int(motor.gpd_buffer_size - motor.gpd_level)))
+        if cmd == VedderCmd.COMM_TERMINAL_CMD:
+            motor.last_command = now
+            return self._terminal(motor, payload[1:].decode('ascii', 'replace'))
+        if cmd in VESCEmulator.GPD_SAMPLE_FORMATS:
+            motor.last_command = now
+            motor.fill_gpd((len(payload) - 1) // struct.calcsize(VESCEmulator.GPD_SAMPLE_FORMATS[cmd]))
+        elif cmd == VedderCmd.COMM_GPD_SET_FSW:
+            motor.gpd_frequency = VESCMessage.unpack(payload).frequency
+        elif cmd == VedderCmd.COMM_SET_CURRENT:
+            motor.last_command = now
+            motor.current = VESCMessage.unpack(payload).current
+            motor.target_rpm = motor.current * 100
+        elif cmd == VedderCmd.COMM_SET_CURRENT_BRAKE:
+            motor.last_command = now
+            motor.current = 0.0
+            motor.target_rpm = 0.0
+        elif cmd == VedderCmd.COMM_SET_RPM:
+            motor.last_command = now
+            motor.target_rpm = VESCMessage.unpack(payload).rpm
+        elif cmd == VedderCmd.COMM_SET_DUTY:
+            motor.last_command = now
+            motor.duty = VESCMessage.unpack(payload).duty_cycle
+            motor.target_rpm = motor.duty * 50000
+        elif cmd == VedderCmd.COMM_ALIVE:
+            motor.last_command = now
+        return None
+
+    def _terminal(self, motor, command):
+        """
+        Runs a terminal command.
+        :return: COMM_PRINT payload with the reply, None if there is nothing to print
+        """
+        args = command.split()
+        reply = None
+        if not args:
+            return None
+        if args[0] == 'foc_openloop' and len(args) == 3:
+            try:
+                motor.current = float(args[1])
+                motor.target_rpm = float(args[2])
+            except ValueError:
+                reply = "Invalid arguments\n"
+        elif args[0] == 'help':
+            reply = "Valid commands are:\nhelp\nfoc_openloop [current] [erpm]\n"
+        else:
+            reply = "Invalid command: %s\ntype help to list all available commands\n" % args[0]
+        if reply is None:
+            return None
+        return bytes((VedderCmd.COMM_PRINT,)) + reply.encode('ascii')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Emulate a VESC on a pseudo-terminal.")
+    parser.add_argument('--version', default='6.0.1', help="firmware version to report")
+    parser.add_argument('--can-ids', type=int, nargs='*', default=[], help="ids of emulated VESCs on the CAN bus")
+    parser.add_argument('--latency', type=float, default=0.0, help="response delay in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="maximum random extra delay in seconds")
+    parser.add_argument('--noise', type=float, default=0.0, help="relative standard deviation of measurements")
+    parser.add_argument('--corruption', type=float, default=0.0, help="probability of flipping a response byte")
+    parser.add_argument('--seed', type=int, default=None, help="seed for reproducible noise and corruption")
+    args = parser.parse_args()
+    emulator = VESCEmulator(version=args.version, can_ids=args.can_ids, latency=args.latency, jitter=args.jitter,
+                            noise=args.noise, corruption=args.corruption, seed=args.seed)
+    print("[INFO] Emulated VESC on %s" % emulator.port)
+    emulator.serve_forever()
@@ -1,4 +1,11 @@
+import logging
 import struct
+from functools import lru_cache
+
+_logger = logging.getLogger(__name__)
+
+# struct format characters that hold integers, scaled values for these fields are truncated to int when packing
+_int_fmt_chars = frozenset('bBhHiIlLqQnN')
 
 
 class VESCMessage(type):
@@ -9,12 +16,21 @@ class VESCMessage(type):
     fields: list of tuples. tuples are of size 2, first element is the field name, second element is the fields type
             the third optional element is a scalar that will be applied to the data upon unpack
     format character. For more info on struct format characters see: https://docs.python.org/2/library/struct.html
+
+    Messages whose layout depends on the payload itself (i.e. a field bitmask) may also declare a static or class
+    method _decode(msg_bytes) returning the message instance; it is used by unpack instead of the fields layout.
+
+    A class declaring _register = False is not registered under its id. It describes another layout of a registered
+    message (i.e. GetValues of old firmware) and is only used when passed to unpack explicitly.
+
+    Each message class is compiled once when it is declared: the struct.Struct objects and the scale vector used by
+    pack and unpack are cached on the class so no format strings are built per message.
     """
     _msg_registry = {}
     _endian_fmt = '!'
     _id_fmt = 'B'
     _can_id_fmt = 'BB'
-    _comm_forward_can = 33
+    _comm_forward_can = 34  # VedderCmd.COMM_FORWARD_CAN
     _entry_msg_registry = None
 
     def __init__(cls, name, bases, clsdict):
@@ -24,12 +40,24 @@ class VESCMessage(type):
         for klass in bases:
             if isinstance(klass, VESCMessage):
                 raise TypeError("VESC messages cannot be inherited.")
-        # check for duplicate id
-        if msg_id in VESCMessage._msg_registry:
-            raise TypeError("ID conflict with %s" % str(VESCMessage._msg_registry[msg_id]))
-        else:
+        # check for duplicate id, alternative layouts of a message are not registered
+        if clsdict.get('_register', True):
+            if msg_id in VESCMessage._msg_registry:
+                raise TypeError("ID conflict with %s" % str(VESCMessage._msg_registry[msg_id]))
             VESCMessage._msg_registry[msg_id] = cls
+        if '_decode' not in clsdict:
+            cls._decode = None
 
+        VESCMessage._compile(cls)
+        super(VESCMessage, cls).__init__(name, bases, clsdict)
+
+    @staticmethod
+    def _compile(cls):
+        """
+        Precomputes everything pack and unpack need for a message class. Called again whenever the fields of a
+        message class are replaced.
+        :param cls: message class to compile.
+        """
         # initialize cls static variables
         cls._string_field = None
         cls._fmt_fields = ''
@@ -47,14 +75,65 @@ class VESCMessage(type):
         try:
             cls._full_msg_size = struct.calcsize(cls._fmt_fields)
         except struct.error:
-            print(f'[INFO] Message {cls.__name__} has variable length')
+            _logger.debug('Message %s has variable length', cls.__name__)
         # check that at most 1 field is a string
         string_field_count = cls._fmt_fields.count('s')
         if string_field_count > 1:
             raise TypeError("Max number of string fields is 1.")
         if 'p' in cls._fmt_fields:
             raise TypeError("Field with format character 'p' detected. For string field use 's'.")
-        super(VESCMessage, cls).__init__(name, bases, clsdict)
+        endian = VESCMessage._endian_fmt
+        cls._header = struct.pack(endian + VESCMessage._id_fmt, cls.id)
+        # scale vector, fields without a scalar or with a 0 scalar are passed through untouched
+        cls._scale_vector = tuple(field[2] if len(field) >= 3 and field[2] else None for field in cls.fields)
+        cls._build_msg, cls._field_values = VESCMessage._generate_converters(cls)
+        if cls._string_field is None:
+            cls._fields_struct = struct.Struct(endian + cls._fmt_fields)
+            cls._struct = struct.Struct(endian + VESCMessage._id_fmt + cls._fmt_fields)
+            cls._can_struct = struct.Struct(endian + VESCMessage._can_id_fmt + VESCMessage._id_fmt + cls._fmt_fields)
+        else:
+            cls._fields_struct = None
+            cls._struct = None
+            cls._can_struct = None
+            cls._fixed_size = struct.calcsize(endian + cls._fmt_fields.replace('%u', '').replace('s', ''))
+            cls._string_struct = staticmethod(lru_cache(maxsize=64)(
+                lambda length, _fmt=endian + cls._fmt_fields: struct.Struct(_fmt % length)))
+
+    @staticmethod
+    def _generate_converters(cls):
+        """
+        Generates the functions that move field values between a message instance and a struct tuple, applying the
+        scale vector on the way. Generating them once per class keeps the per message cost to a single call.
+        :param cls: message class to generate the converters for.
+        :return: (function building a message from a struct tuple, function returning the struct tuple of a message)
+        """
+        unpack_exprs = []
+        pack_exprs = []
+        for idx, (name, scalar) in enumerate(zip(cls._field_names, cls._scale_vector)):
+            if scalar is None:
+                unpack_exprs.append('%r: d[%u]' % (name, idx))
+                pack_exprs.append('m.%s' % name)
+            else:
+                unpack_exprs.append('%r: d[%u] / %r' % (name, idx, scalar))
+                if cls.fields[idx][1] in _int_fmt_chars:
+                    pack_exprs.append('int(m.%s * %r)' % (name, scalar))
+                else:
+                    pack_exprs.append('m.%s * %r' % (name, scalar))
+        source = ("def build_msg(d, _new=object.__new__, _cls=cls):\n"
+                  "    m = _new(_cls)\n"
+                  "    m.__dict__ = {'can_id': None, %s}\n"
+                  "    return m\n"
+                  "def field_values(m):\n"
+                  "    return (%s)\n") % (', '.join(unpack_exprs), ''.join(e + ', ' for e in pack_exprs))
+        namespace = {'cls': cls}
+        exec(source, namespace)
+        return staticmethod(namespace['build_msg']), staticmethod(namespace['field_values'])
+
+    def __setattr__(cls, name, value):
+        super(VESCMessage, cls).__setattr__(name, value)
+        if name == 'fields':
+            # the layout changed, so the cached codecs are stale
+            VESCMessage._compile(cls)
 
     def __call__(cls, *args, **kwargs):
         instance = super(VESCMessage, cls).__call__()
@@ -65,8 +144,7 @@ class VESCMessage(type):
         if args:
             if len(args) != len(cls.fields):
                 raise AttributeError("Expected %u arguments, received %u" % (len(cls.fields), len(args)))
-            for name, value in zip(cls._field_names, args):
-                setattr(instance, name, value)
+            instance.__dict__.update(zip(cls._field_names, args))
         return instance
 
     @staticmethod
@@ -74,71 +152,41 @@ class VESCMessage(type):
         return VESCMessage._msg_registry[id]
 
     @staticmethod
-    def unpack(msg_bytes):
-        msg_id = struct.unpack_from(VESCMessage._endian_fmt + VESCMessage._id_fmt, msg_bytes, 0)
-        msg_type = VESCMessage.msg_type(*msg_id)
-        data = None
-        if not (msg_type._string_field is None):
-            # string field
-            fmt_wo_string = msg_type._fmt_fields.replace('%u', '')
-            fmt_wo_string = fmt_wo_string.replace('s', '')
-            len_string = len(msg_bytes) - struct.calcsize(VESCMessage._endian_fmt + fmt_wo_string) - 1
-            fmt_w_string = msg_type._fmt_fields % (len_string)
-            data = struct.unpack_from(VESCMessage._endian_fmt + fmt_w_string, msg_bytes, 1)
-        else:
-            data = list(struct.unpack_from(VESCMessage._endian_fmt + msg_type._fmt_fields, msg_bytes, 1))
-
-            for k, field in enumerate(data):
-                try:
-                    if msg_type._field_scalars[k] != 0:
-                        data[k] = data[k]/msg_type._field_scalars[k]
-                except (TypeError, IndexError) as e:
-                    print("Error ecountered on field " + msg_type.fields[k][0])
-                    print(e)
-        msg = msg_type(*data)
-        if not (msg_type._string_field is None):
-            string_field_name = msg_type._field_names[msg_type._string_field]
-            setattr(msg,
-                    string_field_name,
-                    getattr(msg, string_field_name).decode('ascii'))
-        return msg
+    def unpack(msg_bytes, msg_type=None):
+        """
+        :param msg_bytes: payload, starting with the message id
+        :param msg_type: message class to decode the payload with, defaults to the class registered for its id
+        :return: the message
+        """
+        if msg_type is None:
+            msg_type = VESCMessage._msg_registry[msg_bytes[0]]
+        if msg_type._decode is not None:
+            return msg_type._decode(msg_bytes)
+        if msg_type._string_field is None:
+            return msg_type._build_msg(msg_type._fields_struct.unpack_from(msg_bytes, 1))
+        len_string = len(msg_bytes) - msg_type._fixed_size - 1
+        data = list(msg_type._string_struct(len_string).unpack_from(msg_bytes, 1))
+        data[msg_type._string_field] = data[msg_type._string_field].decode('ascii')
+        return msg_type._build_msg(data)
 
     @staticmethod
     def pack(instance, header_only=None):
         if header_only:
             if instance.can_id is not None:
-                fmt = VESCMessage._endian_fmt + VESCMessage._can_id_fmt + VESCMessage._id_fmt
-                values = (VESCMessage._comm_forward_can, instance.can_id, instance.id)
-            else:
-                fmt = VESCMessage._endian_fmt + VESCMessage._id_fmt
-                values = (instance.id,)
-            return struct.pack(fmt, *values)
-
-        field_values = []
-        if not instance._field_scalars:
-            for field_name in instance._field_names:
-                field_values.append(getattr(instance, field_name))
-        else:
-            for field_name, field_scalar in zip(instance._field_names, instance._field_scalars):
-                field_values.append(int(getattr(instance, field_name) * field_scalar))
-        if not (instance._string_field is None):
-            # string field
-            string_field_name = instance._field_names[instance._string_field]
-            string_length = len(getattr(instance, string_field_name))
-            field_values[instance._string_field] = field_values[instance._string_field].encode('latin-1')
-            values = ((instance.id,) + tuple(field_values))
-            if instance.can_id is not None:
-                fmt = VESCMessage._endian_fmt + VESCMessage._can_id_fmt + VESCMessage._id_fmt\
-                      + (instance._fmt_fields % (string_length))
-                values = (VESCMessage._comm_forward_can, instance.can_id) + values
-            else:
-                fmt = VESCMessage._endian_fmt + VESCMessage._id_fmt + (instance._fmt_fields % (string_length))
-            return struct.pack(fmt, *values)
-        else:
-            values = ((instance.id,) + tuple(field_values))
+                return struct.pack(VESCMessage._endian_fmt + VESCMessage._can_id_fmt + VESCMessage._id_fmt,
+                                   VESCMessage._comm_forward_can, instance.can_id, instance.id)
+            return instance._header
+
+        if instance._string_field is None:
             if instance.can_id is not None:
-                fmt = VESCMessage._endian_fmt + VESCMessage._can_id_fmt + VESCMessage._id_fmt + instance._fmt_fields
-                values = (VESCMessage._comm_forward_can, instance.can_id) + values
-            else:
-                fmt = VESCMessage._endian_fmt + VESCMessage._id_fmt + instance._fmt_fields
-            return struct.pack(fmt, *values)
+                return instance._can_struct.pack(VESCMessage._comm_forward_can, instance.can_id, instance.id,
+                                                 *instance._field_values(instance))
+            return instance._struct.pack(instance.id, *instance._field_values(instance))
+        # string field
+        field_values = list(instance._field_values(instance))
+        field_values[instance._string_field] = field_values[instance._string_field].encode('latin-1')
+        body = instance._string_struct(len(field_values[instance._string_field])).pack(*field_values)
+        if instance.can_id is not None:
+            return struct.pack(VESCMessage._endian_fmt + VESCMessage._can_id_fmt + VESCMessage._id_fmt,
+                               VESCMessage._comm_forward_can, instance.can_id, instance.id) + body
+        return instance._header + body
@@ -0,0 +1,175 @@
+"""
+Bulk decoding of recorded streams of one fixed-layout message, i.e. GetValues responses captured over a test day:
+
+    from limmy.VESC.messages import GetValues
+    samples = decode_file('capture.bin', GetValues)
+    print(samples['rpm'].mean(), samples['v_in'][-10:])
+
+Every frame of a message with fixed-size fields has the same length, start byte, length byte and id, so the frames are
+found, checked and decoded for the whole buffer at once with NumPy instead of one message object at a time. Bytes that
+are not frames of the message (other messages, line noise, a limmy.recorder log's entry headers) are skipped.
+"""
+from limmy.protocol.interface import _numpy_dtypes
+from limmy.protocol.packet.structure import Footer
+from binascii import crc_hqx
+import mmap
+
+# numpy is required for bulk decoding but optional for the rest of limmy
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# bytes of a file mapped and scanned at once by decode_file
+CHUNK_SIZE = 1 << 26
+
+_crc_table = None
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("Need to install numpy in order to use bulk decoding.")
+
+
+def _field_dtype(field):
+    # 'c' fields are single characters, keep them as one byte strings like struct does
+    return 'S1' if field[1] == 'c' else _numpy_dtypes[field[1]]
+
+
+def _check_layout(msg_cls):
+    if msg_cls._string_field is not None or msg_cls._decode is not None:
+        raise ValueError("%s has no fixed layout, it can't be decoded in bulk" % msg_cls.__name__)
+
+
+def raw_dtype(msg_cls):
+    """
+    :param msg_cls: VESC message class with fixed-size fields
+    :return: structured dtype of the fields as they are sent, big endian and unscaled
+    """
+    _require_numpy()
+    _check_layout(msg_cls)
+    return numpy.dtype([(field[0], _field_dtype(field)) for field in msg_cls.fields])
+
+
+def scaled_dtype(msg_cls):
+    """
+    :param msg_cls: VESC message class with fixed-size fields
+    :return: structured dtype of decoded samples: scaled fields are float64, the others keep their raw dtype
+    """
+    _require_numpy()
+    _check_layout(msg_cls)
+    return numpy.dtype([(field[0], 'f8' if scale is not None else _field_dtype(field))
+                        for field, scale in zip(msg_cls.fields, msg_cls._scale_vector)])
+
+
+def crc_rows(rows):
+    """
+    CRC16-XMODEM of every row of a 2d uint8 array, computed column by column for all rows at once.
+    :param rows: array of shape (n, length)
+    :return: uint16 array of n checksums
+    """
+    global _crc_table
+    _require_numpy()
+    if _crc_table is None:
+        # with a zero running value the table-driven step reduces to the checksum of the byte alone
+        _crc_table = numpy.array([crc_hqx(bytes((byte,)), 0) for byte in range(256)], dtype=numpy.uint16)
+    crc = numpy.zeros(len(rows), dtype=numpy.uint16)
+    columns = numpy.asfortranarray(rows)
+    for idx in range(columns.shape[1]):
+        crc = (crc << 8) ^ _crc_table[(crc >> 8) ^ columns[:, idx]]
+    return crc
+
+
+def _scan(data, msg_cls, limit=None, validate=True):
+    """
+    Finds the frames of msg_cls in a uint8 array.
+    :param limit: only frames starting before this index are returned
+    :return: (start index of every frame, frames as a 2d uint8 array)
+    """
+    payload_size = msg_cls._struct.size
+    if payload_size >= 256:
+        raise ValueError("Bulk decoding only supports payloads shorter than 256 bytes")
+    frame_size = 2 + payload_size + Footer.SIZE
+    count = len(data) - frame_size + 1
+    if limit is not None:
+        count = min(count, limit)
+    if count <= 0:
+        return numpy.empty(0, dtype=numpy.int64), numpy.empty((0, frame_size), dtype=numpy.uint8)
+    candidates = ((data[:count] == 0x2) & (data[1:count + 1] == payload_size) & (data[2:count + 2] == msg_cls.id) &
+                  (data[frame_size - 1:frame_size - 1 + count] == Footer.TERMINATOR))
+    starts = numpy.flatnonzero(candidates)
+    frames = data[starts[:, None] + numpy.arange(frame_size)]
+    if validate:
+        expected = (frames[:, -3].astype(numpy.uint16) << 8) | frames[:, -2]
+        valid = crc_rows(frames[:, 2:2 + payload_size]) == expected
+        starts = starts[valid]
+        frames = frames[valid]
+    return starts, frames
+
+
+def _decode_frames(starts, frames, msg_cls, scale, return_offsets):
+    frame_size = frames.shape[1]
+    if len(starts) > 1 and (numpy.diff(starts) < frame_size).any():
+        # a candidate inside another frame passed the checks, keep the first of every overlapping run
+        keep = numpy.zeros(len(starts), dtype=bool)
+        next_free = -1
+        for idx, start in enumerate(starts.tolist()):
+            if start >= next_free:
+                keep[idx] = True
+                next_free = start + frame_size
+        starts = starts[keep]
+        frames = frames[keep]
+    # skip start byte, length and id
+    records = numpy.ascontiguousarray(frames[:, 3:3 + msg_cls._fields_struct.size]).view(raw_dtype(msg_cls)).ravel()
+    if scale:
+        samples = numpy.empty(len(records), dtype=scaled_dtype(msg_cls))
+        for field, scalar in zip(msg_cls.fields, msg_cls._scale_vector):
+            column = records[field[0]]
+            samples[field[0]] = column if scalar is None else column / scalar
+        records = samples
+    return (records, starts) if return_offsets else records
+
+
+def decode_bulk(buffer, msg_cls, scale=True, validate=True, return_offsets=False):
+    """
+    Decodes every frame of msg_cls in a buffer.
+    :param buffer: bytes-like object holding the frames
+    :param msg_cls: VESC message class with fixed-size fields, i.e. GetValues
+    :param scale: divide scaled fields by their scalar, see scaled_dtype; raw big endian values otherwise, see raw_dtype
+    :param validate: drop frames whose checksum doesn't match
+    :param return_offsets: also return the offset of every frame in the buffer
+    :return: structured array with one sample per frame, in buffer order, and the offsets if requested
+    """
+    _require_numpy()
+    _check_layout(msg_cls)
+    starts, frames = _scan(numpy.frombuffer(buffer, dtype=numpy.uint8), msg_cls, validate=validate)
+    return _decode_frames(starts, frames, msg_cls, scale, return_offsets)
+
+
+def decode_file(path, msg_cls, scale=True, validate=True, return_offsets=False, chunk_size=CHUNK_SIZE):
+    """
+    decode_bulk for a file, i.e. a raw serial capture or a limmy.recorder log. The file is memory-mapped and scanned
+    in chunks, so only the decoded samples have to fit in memory.
+    :param path: path of the file
+    :param chunk_size: bytes scanned at once
+    :return: see decode_bulk
+    """
+    _require_numpy()
+    _check_layout(msg_cls)
+    frame_size = 2 + msg_cls._struct.size + Footer.SIZE
+    all_starts = []
+    all_frames = []
+    with open(path, 'rb') as f:
+        if not f.seek(0, 2):
+            return decode_bulk(b'', msg_cls, scale, validate, return_offsets)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            data = numpy.frombuffer(mapped, dtype=numpy.uint8)
+            for position in range(0, len(data), chunk_size):
+                # chunks overlap by a frame so frames crossing a boundary are found, in the chunk they start in
+                starts, frames = _scan(data[position:position + chunk_size + frame_size - 1], msg_cls, chunk_size,
+                                       validate)
+                all_starts.append(starts + position)
+                all_frames.append(frames)
+            del data
+    return _decode_frames(numpy.concatenate(all_starts), numpy.concatenate(all_frames), msg_cls, scale,
+                          return_offsets)
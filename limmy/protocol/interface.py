@@ -1,5 +1,34 @@
 import limmy.protocol.base
 import limmy.protocol.packet.codec
+from limmy.protocol.packet.crc import CrcXmodem
+from limmy.protocol.packet.structure import Footer
+from functools import lru_cache
+import mmap
+import os
+import struct
+
+# numpy is optional, without it encode_many packs rows one at a time with struct. It takes longer to import than the
+# rest of limmy, so it is imported the first time encode_many needs it (see _import_numpy)
+numpy = None
+_numpy_imported = False
+
+# struct format characters to the big endian numpy dtype of the same size, used by encode_many
+_numpy_dtypes = {'b': 'i1', 'B': 'u1', '?': '?', 'h': '>i2', 'H': '>u2', 'i': '>i4', 'I': '>u4', 'l': '>i4',
+                 'L': '>u4', 'q': '>i8', 'Q': '>u8', 'f': '>f4', 'd': '>f8'}
+
+
+def _import_numpy():
+    """
+    :return: the numpy module, None if it isn't installed
+    """
+    global numpy, _numpy_imported
+    if not _numpy_imported:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy_imported = True
+    return numpy
 
 
 def decode(buffer):
@@ -51,3 +80,294 @@ def encode_request(msg_cls):
     msg_payload = limmy.protocol.base.VESCMessage.pack(msg_cls, header_only=True)
     packet = limmy.protocol.packet.codec.frame(msg_payload)
     return packet
+
+
+# number of distinct packets kept by encode_cached and encode_request_cached
+ENCODE_CACHE_SIZE = 1024
+
+
+# typed, so equal values of different types (30 and 30.0, True and 1) are never handed each other's packet
+@lru_cache(maxsize=ENCODE_CACHE_SIZE, typed=True)
+def encode_cached(msg_cls, *values, can_id=None):
+    """
+    Encodes a message like encode, but remembers the most recently used
+    packets, so repeating a command (i.e. holding a current setpoint) costs a
+    dictionary lookup instead of packing and checksumming the message again.
+
+        packet = encode_cached(SetCurrent, 10)
+
+    Clear the cache with encode_cached.cache_clear() if the fields of a message
+    class are reassigned.
+
+    :param msg_cls: The class of the message.
+    :type msg_cls: limmy message class
+
+    :param values: Field values of the message, must be hashable.
+
+    :param can_id: CAN id to forward the message to, None for the VESC on the
+                   serial port.
+    :type can_id: int
+
+    :return: The packet.
+    :rtype: bytes
+    """
+    return encode(msg_cls(*values, can_id=can_id))
+
+
+@lru_cache(maxsize=ENCODE_CACHE_SIZE)
+def encode_request_cached(msg_cls, can_id=None):
+    """
+    Cached version of encode_request, see encode_cached.
+
+    :param msg_cls: The message type which you are requesting.
+    :type msg_cls: limmy.messages.getters.[requested getter]
+
+    :param can_id: CAN id to forward the request to, None for the VESC on the
+                   serial port.
+    :type can_id: int
+
+    :return: The encoded limmy message which can be sent.
+    :rtype: bytes
+    """
+    if can_id is None:
+        return encode_request(msg_cls)
+    return encode_request(msg_cls(can_id=can_id))
+
+
+def encode_many(messages, values=None, can_id=None):
+    """
+    Encodes a batch of messages into one contiguous buffer of packets, ready
+    for a single write. The CRCs of all packets are calculated in one batch
+    call.
+
+    Either pass a sequence of limmy messages:
+
+        encode_many([SetCurrent(10), SetRPM(3000)])
+
+    or one message class and an array with a row of field values per
+    message, i.e. a precomputed setpoint schedule:
+
+        encode_many(SetCurrent, numpy.linspace(0, 10, 100))
+
+    :param messages: The messages to encode, or the class of every message
+                     when values is given.
+    :type messages: sequence of limmy messages, or a limmy message class
+
+    :param values: Field values, in the order of the class' fields, one row per
+                   message. May be 1-d for classes with a single field.
+    :type values: numpy array or sequence of sequences
+
+    :param can_id: CAN id to forward the messages built from values to, None to
+                   send them to the VESC on the serial port. Ignored for a
+                   sequence of messages, which carry their own can_id.
+    :type can_id: int
+
+    :return: The packets, back to back.
+    :rtype: bytes
+    """
+    if values is None:
+        payloads = [limmy.protocol.base.VESCMessage.pack(msg) for msg in messages]
+        return _frame_many(payloads)
+    msg_cls = messages
+    if msg_cls._string_field is not None:
+        raise TypeError("encode_many can't encode %s from values, it has a variable length field. "
+                        "Pass a sequence of messages instead." % msg_cls.__name__)
+    if len(values) == 0:
+        return b''
+    formats = [field[1] for field in msg_cls.fields]
+    if _import_numpy() is not None and all(fmt in _numpy_dtypes for fmt in formats):
+        return _encode_many_numpy(msg_cls, numpy.asarray(values), can_id)
+    base = limmy.protocol.base.VESCMessage
+    if can_id is None:
+        prefix = (msg_cls.id,)
+        packer = msg_cls._struct
+    else:
+        prefix = (base._comm_forward_can, can_id, msg_cls.id)
+        packer = msg_cls._can_struct
+    scales = [(scale, fmt in limmy.protocol.base._int_fmt_chars) for scale, fmt in zip(msg_cls._scale_vector, formats)]
+    payloads = []
+    for row in values:
+        if len(msg_cls.fields) == 1 and not isinstance(row, (list, tuple)):
+            row = (row,)
+        payloads.append(packer.pack(*prefix, *[value if scale is None else int(value * scale) if is_int else
+                                               value * scale for value, (scale, is_int) in zip(row, scales)]))
+    return _frame_many(payloads)
+
+
+def _frame_many(payloads):
+    """
+    Frames a list of payloads back to back.
+    """
+    crcs = CrcXmodem.calc_many(payloads)
+    parts = []
+    for payload, crc in zip(payloads, crcs):
+        length = len(payload)
+        if length < 256:
+            parts.append(struct.pack('>BB', 0x2, length))
+        elif length < 65536:
+            parts.append(struct.pack('>BH', 0x3, length))
+        else:
+            raise limmy.protocol.packet.codec.InvalidPayload(
+                "Invalid payload size. Payload must be less than 65536 bytes.")
+        parts.append(payload)
+        parts.append(struct.pack('>HB', crc, Footer.TERMINATOR))
+    return b''.join(parts)
+
+
+def _encode_many_numpy(msg_cls, values, can_id):
+    """
+    encode_many for a message class whose fields are all numeric. Every packet
+    has the same layout, so the packets are built as one structured array.
+    """
+    base = limmy.protocol.base.VESCMessage
+    fields = msg_cls.fields
+    if values.ndim == 1 and len(fields) == 1:
+        values = values.reshape(-1, 1)
+    if values.ndim != 2 or values.shape[1] != len(fields):
+        raise ValueError("Expected values of shape (n, %u), received %s" % (len(fields), values.shape))
+    count = len(values)
+    payload_size = (msg_cls._struct if can_id is None else msg_cls._can_struct).size
+    if payload_size >= 65536:
+        raise limmy.protocol.packet.codec.InvalidPayload("Invalid payload size. Payload must be less than 65536 bytes.")
+    layout = [('start', 'u1'), ('length', 'u1' if payload_size < 256 else '>u2')]
+    payload_index = 2 if payload_size < 256 else 3
+    if can_id is not None:
+        layout += [('forward', 'u1'), ('can_id', 'u1')]
+    layout.append(('id', 'u1'))
+    layout += [('f%u' % idx, _numpy_dtypes[field[1]]) for idx, field in enumerate(fields)]
+    layout += [('crc', '>u2'), ('terminator', 'u1')]
+    packets = numpy.empty(count, dtype=numpy.dtype(layout))
+    packets['start'] = payload_index
+    packets['length'] = payload_size
+    if can_id is not None:
+        packets['forward'] = base._comm_forward_can
+        packets['can_id'] = can_id
+    packets['id'] = msg_cls.id
+    for idx, (field, scale) in enumerate(zip(fields, msg_cls._scale_vector)):
+        column = values[:, idx]
+        dtype = numpy.dtype(_numpy_dtypes[field[1]])
+        if scale is not None:
+            column = column * scale
+            if field[1] in limmy.protocol.base._int_fmt_chars:
+                # same truncation as packing a single message
+                column = numpy.trunc(column)
+        if dtype.kind in 'iu' and len(column):
+            info = numpy.iinfo(dtype)
+            if column.min() < info.min or column.max() > info.max:
+                raise struct.error("Field %s out of range for format '%s'" % (field[0], field[1]))
+        packets['f%u' % idx] = column
+    packets['terminator'] = Footer.TERMINATOR
+    # checksum every payload in one batch, straight out of the array's memory
+    size = packets.itemsize
+    view = memoryview(packets).cast('B')
+    packets['crc'] = CrcXmodem.calc_many([view[offset:offset + payload_size] for offset in
+                                          range(payload_index, count * size, size)])
+    view.release()
+    return packets.tobytes()
+
+
+def iter_decode(buffer, stats=None):
+    """
+    Decodes every valid VESC message in a buffer in a single pass. Unlike
+    calling decode in a loop, the buffer is never sliced or copied, so the cost
+    is linear in the size of the buffer. Corrupt bytes between packets are
+    skipped.
+
+    :param buffer: The buffer to parse, i.e. a captured serial stream.
+    :type buffer: bytes, bytearray, memoryview or mmap
+
+    :param stats: Optional dict which receives 'skipped', the number of corrupt
+                  bytes skipped, and 'unknown', the number of valid packets
+                  holding messages limmy can't decode. Updated when the
+                  iteration finishes or is abandoned.
+    :type stats: dict
+
+    :return: Iterator of (offset of the packet in the buffer, limmy message).
+    :rtype: iterator of `tuple`: (int, limmy message)
+    """
+    if isinstance(buffer, memoryview):
+        # memoryview has no find, the start byte search needs the underlying bytes
+        buffer = buffer.tobytes()
+    length = len(buffer)
+    skipped = 0
+    unknown = 0
+    pos = 0
+    next_short = buffer.find(b'\x02')
+    next_long = buffer.find(b'\x03')
+    view = memoryview(buffer)
+    try:
+        while True:
+            # find the next possible start byte, each search result is reused until it has been passed
+            if 0 <= next_short < pos:
+                next_short = buffer.find(b'\x02', pos)
+            if 0 <= next_long < pos:
+                next_long = buffer.find(b'\x03', pos)
+            if next_short < 0 and next_long < 0:
+                skipped += length - pos
+                break
+            start = next_long if next_short < 0 or 0 <= next_long < next_short else next_short
+            skipped += start - pos
+            pos = start
+
+            header_length = 2 if buffer[pos] == 0x2 else 3
+            if pos + header_length > length:
+                skipped += length - pos
+                break
+            if header_length == 2:
+                payload_length = buffer[pos + 1]
+            else:
+                payload_length = (buffer[pos + 1] << 8) | buffer[pos + 2]
+            payload_start = pos + header_length
+            end = payload_start + payload_length + 3
+            if payload_length == 0 or end > length or buffer[end - 1] != Footer.TERMINATOR or \
+                    CrcXmodem.calc(view[payload_start:end - 3]) != (buffer[end - 3] << 8) | buffer[end - 2]:
+                # not a packet, resync from the next byte
+                skipped += 1
+                pos += 1
+                continue
+            try:
+                msg = limmy.protocol.base.VESCMessage.unpack(view[payload_start:end - 3])
+            except (KeyError, struct.error, UnicodeDecodeError):
+                unknown += 1
+                pos = end
+                continue
+            yield start, msg
+            pos = end
+    finally:
+        view.release()
+        if stats is not None:
+            stats['skipped'] = skipped
+            stats['unknown'] = unknown
+
+
+def decode_all(buffer):
+    """
+    Decodes every valid VESC message in a buffer. See iter_decode.
+
+    :param buffer: The buffer to parse, i.e. a captured serial stream.
+    :type buffer: bytes, bytearray, memoryview or mmap
+
+    :return: list of (offset, limmy message), number of corrupt bytes skipped.
+    :rtype: `tuple`: (list, int)
+    """
+    stats = {}
+    messages = list(iter_decode(buffer, stats))
+    return messages, stats['skipped']
+
+
+def decode_file(path):
+    """
+    Decodes every valid VESC message in a capture file. The file is memory
+    mapped rather than read, so captures larger than memory can be parsed.
+
+    :param path: Path of the capture file.
+    :type path: str
+
+    :return: list of (offset, limmy message), number of corrupt bytes skipped.
+    :rtype: `tuple`: (list, int)
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return [], 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return decode_all(mapped)
@@ -1,64 +1,84 @@
 from .exceptions import *
 from .structure import *
-from crccheck.crc import CrcXmodem
+from .crc import CrcXmodem
 
 crc_checker = CrcXmodem()
 
 
 class UnpackerBase(object):
     """
-    Helper methods for both stateless and stated unpacking.
+    Helper methods for both stateless and stated unpacking. Every helper works on an offset into the buffer rather than
+    a slice of it, so no bytes are copied while searching for or parsing a packet.
     """
     @staticmethod
-    def _unpack_header(buffer):
+    def _unpack_header(buffer, offset=0, end=None, max_length=Header.MAX_PAYLOAD_LENGTH):
         """
-        Attempt to unpack a header from the buffer.
+        Attempt to unpack a header from the buffer. CorruptPacket is raised if the payload length is 0 or above
+        max_length.
         :param buffer: buffer object.
+        :param offset: index of the first byte of the header.
+        :param end: index one past the last valid byte of the buffer, defaults to its length.
+        :param max_length: longest payload accepted.
         :return: Header object if successful, None otherwise.
         """
-        if len(buffer) == 0:
+        end = len(buffer) if end is None else end
+        if offset >= end:
             return None
-        fmt = Header.fmt(buffer[0])
-        if len(buffer) >= struct.calcsize(fmt):
+        fmt = Header.fmt(buffer[offset])
+        if end - offset >= struct.calcsize(fmt):
             try:
-                header = Header.parse(buffer)
-                return header
+                header = Header.parse(buffer, offset)
             except struct.error:
-                raise CorruptPacket("Unable to parse header: %s" % buffer)
+                raise CorruptPacket("Unable to parse header: %s" % bytes(buffer[offset:end]))
+            if not 0 < header.payload_length <= max_length:
+                raise CorruptPacket("Invalid payload length: %u" % header.payload_length)
+            return header
         else:
             return None
 
     @staticmethod
-    def _unpack_footer(buffer, header):
+    def _unpack_footer(buffer, header, offset=0):
         """
         Unpack the footer. Parse must be valid.
         :param buffer: buffer object.
         :param header: Header object for current packet.
+        :param offset: index of the start byte of the packet.
         :return: Footer object.
         """
         try:
-            footer = Footer.parse(buffer, header)
+            footer = Footer.parse(buffer, header, offset)
             return footer
         except struct.error:
-            raise CorruptPacket("Unable to parse footer: %s" % buffer)
+            raise CorruptPacket("Unable to parse footer: %s" % bytes(buffer[offset:]))
 
     @staticmethod
-    def _next_possible_packet_index(buffer):
+    def _find(buffer, sub, start, end):
+        """
+        buffer.find that also works on memoryviews, which have no find method.
+        """
+        try:
+            return buffer.find(sub, start, end)
+        except AttributeError:
+            index = bytes(buffer[start:end]).find(sub)
+            return -1 if index < 0 else index + start
+
+    @staticmethod
+    def _next_possible_packet_index(buffer, offset=0, end=None):
         """
         Tries to find the next possible start byte of a packet in a buffer. Typically called after a corruption has been
         detected.
         :param buffer: buffer object.
+        :param offset: index of the current (corrupt) packet, the search starts after it.
+        :param end: index one past the last valid byte of the buffer, defaults to its length.
         :return: Index of next valid start byte. Returns -1 if no valid start bytes are found.
         """
-        if len(buffer) < 2: # too short to find next
+        end = len(buffer) if end is None else end
+        if end - offset < 2: # too short to find next
             return -1
-        next_short_sb = buffer[1:].find(b'\x02')
-        next_long_sb= buffer[1:].find(b'\x03')
-        possible_index = []
-        if next_short_sb >= 0: # exclude index zero's as we know the current first packet is corrupt
-            possible_index.append(next_short_sb + 1) # +1 because we want found from second byte
-        if next_long_sb >= 0:
-            possible_index.append(next_long_sb + 1)
+        # exclude the current index as we know the current first packet is corrupt
+        next_short_sb = UnpackerBase._find(buffer, b'\x02', offset + 1, end)
+        next_long_sb = UnpackerBase._find(buffer, b'\x03', offset + 1, end)
+        possible_index = [index for index in (next_short_sb, next_long_sb) if index >= 0]
         if possible_index == []:
             return -1
         else:
@@ -79,75 +99,79 @@ class UnpackerBase(object):
 
     @staticmethod
     def _packet_size(header):
-        return struct.calcsize(Header.fmt(header.payload_index)) + header.payload_length + struct.calcsize(Footer.fmt())
+        return header.payload_index + header.payload_length + Footer.SIZE
 
     @staticmethod
-    def _packet_parsable(buffer, header):
+    def _packet_parsable(buffer, header, offset=0, end=None):
         """
         Checks if an entire packet is parsable.
         :param buffer: buffer object
         :param header: Header object
+        :param offset: index of the start byte of the packet.
+        :param end: index one past the last valid byte of the buffer, defaults to its length.
         :return: True if the current packet is parsable, False otherwise.
         """
+        end = len(buffer) if end is None else end
         frame_size = UnpackerBase._packet_size(header)
-        return len(buffer) >= frame_size
+        return end - offset >= frame_size
 
     @staticmethod
-    def _unpack_payload(buffer, header):
+    def _unpack_payload(buffer, header, offset=0):
         """
         Unpacks the payload of the packet.
         :param buffer: buffer object
         :param header: Header object
-        :return: byte string of the payload
+        :param offset: index of the start byte of the packet.
+        :return: memoryview of the payload, sharing memory with buffer
         """
-        footer_index = header.payload_index + header.payload_length
-        return bytes(buffer[header.payload_index:footer_index])
+        payload_index = offset + header.payload_index
+        return memoryview(buffer)[payload_index:payload_index + header.payload_length]
 
     @staticmethod
     def _validate_payload(payload, footer):
         """
         Validates the payload using the footer. CorruptPacket is raised if the payload is corrupt or the terminator is
         not correct.
-        :param payload: byte string
+        :param payload: bytes-like object
         :param footer: Footer object
         :return: void
         """
-        crc_checker.calc(payload)
         if crc_checker.calc(payload) != footer.crc:
-            raise CorruptPacket("Invalid checksum value.")
-        if footer.terminator is not Footer.TERMINATOR:
+            raise InvalidChecksum("Invalid checksum value.")
+        if footer.terminator != Footer.TERMINATOR:
             raise CorruptPacket("Invalid terminator: %u" % footer.terminator)
         return
 
     @staticmethod
-    def _unpack(buffer, header, errors, recovery_mode=False):
+    def _unpack(buffer, header, errors, recovery_mode=False, offset=0):
         """
         Attempt to parse a packet from the buffer.
         :param buffer: buffer object
         :param errors: specifies error handling scheme. see codec error handling schemes
-        :return: (1) Packet if parse was successful, None otherwise, (2) Length consumed of buffer
+        :param offset: index in the buffer to parse from
+        :return: (1) Packet if parse was successful, None otherwise, (2) Length consumed of buffer from offset
         """
         while True:
             try:
                 # if we were not given a header then try to parse one
                 if header is None:
-                    header = UnpackerBase._unpack_header(buffer)
+                    header = UnpackerBase._unpack_header(buffer, offset)
                 if header is None:
                     # buffer is too short to parse a header
                     if recovery_mode:
-                        return Stateless._recovery_recurse(buffer, header, errors, False)
+                        return Stateless._recovery_recurse(buffer, header, errors, False, offset)
                     else:
                         return None, 0
                 # check if a packet is parsable
-                if UnpackerBase._packet_parsable(buffer, header) is False:
+                if UnpackerBase._packet_parsable(buffer, header, offset) is False:
                     # buffer is too short to parse the rest of the packet
                     if recovery_mode:
-                        return Stateless._recovery_recurse(buffer, header, errors, False)
+                        return Stateless._recovery_recurse(buffer, header, errors, False, offset)
                     else:
                         return None, 0
                 # parse the packet
-                payload = UnpackerBase._unpack_payload(buffer, header)
-                footer = UnpackerBase._unpack_footer(buffer, header)
+                payload = UnpackerBase._unpack_payload(buffer, header, offset)
+                footer = UnpackerBase._unpack_footer(buffer, header, offset)
                 # validate the payload
                 UnpackerBase._validate_payload(payload, footer)
                 # clean header as we wont need it again
@@ -157,30 +181,34 @@ class UnpackerBase(object):
             except CorruptPacket as corrupt_packet:
                 if errors == 'ignore':
                     # find the next possible start byte in the buffer
-                    return Stateless._recovery_recurse(buffer, header, errors, True)
+                    return Stateless._recovery_recurse(buffer, header, errors, True, offset)
                 elif errors == 'strict':
                     raise corrupt_packet
 
     @staticmethod
-    def _recovery_recurse(buffer, header, errors, consume_on_not_recovered):
+    def _recovery_recurse(buffer, header, errors, consume_on_not_recovered, offset=0):
+        # Stateless keeps no state to count skipped bytes in, they are part of the consumed count returned to the
+        # caller. The link counters (corrupt, dropped) are kept by Stateful, which is what the VESC reader uses
         header = None  # clean header
-        next_sb = UnpackerBase._next_possible_packet_index(buffer)
+        next_sb = UnpackerBase._next_possible_packet_index(buffer, offset)
         if next_sb == -1:  # no valid start byte in buffer. consume entire buffer
             if consume_on_not_recovered:
-                return None, len(buffer)
+                return None, len(buffer) - offset
             else:
                 return None, 0
         else:
-            payload, consumed = UnpackerBase._unpack(buffer[next_sb:], header, errors, True)
+            # skipped bytes between offset and the next start byte
+            skipped = next_sb - offset
+            payload, consumed = UnpackerBase._unpack(buffer, header, errors, True, next_sb)
             if payload is None:
                 # failed to recover
                 if consume_on_not_recovered:
-                    return payload, consumed + next_sb
+                    return payload, consumed + skipped
                 else:
                     return payload, consumed
             else:
                 # recovery was successful
-                return payload, consumed + next_sb
+                return payload, consumed + skipped
 
 
 
@@ -216,9 +244,12 @@ class Stateless(UnpackerBase, PackerBase):
         Attempt to parse a packet from the buffer.
         :param buffer: buffer object
         :param errors: specifies error handling scheme. see codec error handling schemes
-        :return: (1) Packet if parse was successful, None otherwise, (2) Length consumed of buffer
+        :return: (1) Payload bytes if parse was successful, None otherwise, (2) Length consumed of buffer
         """
-        return Stateless._unpack(buffer, None, errors)
+        payload, consumed = Stateless._unpack(buffer, None, errors)
+        # a copy rather than a view, so the caller may resize the buffer afterwards (i.e. del buffer[:consumed]).
+        # Stateful hands out views of its own receive buffer instead
+        return (None if payload is None else bytes(payload)), consumed
 
     @staticmethod
     def pack(payload):
@@ -227,6 +258,215 @@ class Stateless(UnpackerBase, PackerBase):
         """
         return Stateless._pack(payload)
 
+class Stateful(UnpackerBase, PackerBase):
+    """
+    Incrementally unpack VESC packets from a stream. Bytes may be fed in chunks of any size, partial packets are kept in
+    a preallocated receive buffer (along with their already parsed header) until the rest of the packet arrives.
+
+    Payloads are returned as memoryviews of the receive buffer. Received bytes are never moved or overwritten: when the
+    buffer runs out of room the unconsumed tail is copied to a fresh buffer, so a payload view stays valid for as long
+    as it is referenced, even from another thread.
+    """
+    # room for the largest possible packet (Header.MAX_PAYLOAD_LENGTH plus a long header and the footer)
+    MIN_CAPACITY = Header.MAX_PAYLOAD_LENGTH + 3 + Footer.SIZE
+
+    def __init__(self, errors='ignore', capacity=1 << 17, max_payload_length=Header.MAX_PAYLOAD_LENGTH,
+                 likely_payload_length=Header.FIRMWARE_MAX_PAYLOAD_LENGTH):
+        """
+        :param errors: specifies error handling scheme. see codec error handling schemes
+        :param capacity: size of the receive buffer in bytes, at least MIN_CAPACITY
+        :param max_payload_length: longer payloads are treated as corrupt, at most 65535
+        :param likely_payload_length: a partial packet claiming a longer payload is given up for a later packet that
+                                      is already complete and validates, see _find_valid_packet. Longer packets are
+                                      still unpacked when nothing valid follows them.
+        """
+        self._capacity = max(capacity, Stateful.MIN_CAPACITY)
+        self._errors = errors
+        self.max_payload_length = max_payload_length
+        self.likely_payload_length = likely_payload_length
+        # valid and corrupt packets seen, corrupt ones with a bad checksum, bytes skipped while resyncing
+        self.packets = 0
+        self.corrupt = 0
+        self.crc_errors = 0
+        self.dropped = 0
+        self.reset()
+
+    def __len__(self):
+        """
+        :return: Number of buffered bytes which have not been consumed yet.
+        """
+        return self._end - self._start
+
+    def reset(self):
+        """
+        Drops all buffered bytes and any partially parsed packet.
+        """
+        self._buffer = bytearray(self._capacity)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        self._header = None
+        self._frame = None
+        # set after a corrupt packet until the next valid one, see _find_valid_packet
+        self._resyncing = False
+
+    @property
+    def last_frame(self):
+        """
+        :return: memoryview of the whole packet (start byte to terminator) of the last payload unpacked, None if nothing
+                 was unpacked yet
+        """
+        if self._frame is None:
+            return None
+        view, start, size = self._frame
+        return view[start:start + size]
+
+    def _reserve(self, size):
+        """
+        Makes room for size more bytes at the end of the receive buffer.
+        """
+        if len(self._buffer) - self._end >= size:
+            return
+        # start a fresh buffer rather than moving bytes in place, views handed out earlier keep the old one alive
+        remaining = self._end - self._start
+        buffer = bytearray(max(self._capacity, remaining + size))
+        buffer[:remaining] = self._view[self._start:self._end]
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+        self._start = 0
+        self._end = remaining
+
+    def extend(self, data):
+        """
+        Appends data to the internal buffer without unpacking anything. Use unpack to take packets out one at a time.
+        :param data: bytes-like object of received data.
+        """
+        size = len(data)
+        self._reserve(size)
+        self._buffer[self._end:self._end + size] = data
+        self._end += size
+
+    def readinto(self, stream, size=4096):
+        """
+        Reads from a stream straight into the receive buffer, without an intermediate bytes object.
+        :param stream: object with a readinto method, i.e. serial.Serial or a raw file.
+        :param size: maximum number of bytes to read.
+        :return: number of bytes read.
+        """
+        self._reserve(size)
+        count = stream.readinto(self._view[self._end:self._end + size]) or 0
+        self._end += count
+        return count
+
+    def feed(self, data):
+        """
+        Appends data to the internal buffer and unpacks every packet that is now complete.
+        :param data: bytes-like object of received data.
+        :return: list of payload memoryviews, in the order they were received.
+        """
+        self.extend(data)
+        return self.unpack_all()
+
+    def _find_valid_packet(self, start, end):
+        """
+        Looks for a complete packet that validates at a start byte after start. While resyncing, or when its length is
+        longer than the firmware sends, the packet waited on may begin at a corrupt start byte or one inside a payload,
+        so a later packet that is already complete is preferred.
+        :return: (index of the packet, its Header), (-1, None) if there is none
+        """
+        buffer = self._buffer
+        index = start
+        while True:
+            index = UnpackerBase._next_possible_packet_index(buffer, index, end)
+            if index == -1:
+                return -1, None
+            try:
+                header = UnpackerBase._unpack_header(buffer, index, end, self.max_payload_length)
+                if header is not None and end - index >= UnpackerBase._packet_size(header):
+                    payload_start = index + header.payload_index
+                    UnpackerBase._validate_payload(self._view[payload_start:payload_start + header.payload_length],
+                                                   UnpackerBase._unpack_footer(buffer, header, index))
+                    return index, header
+            except CorruptPacket:
+                pass
+
+    def unpack_all(self):
+        """
+        Unpacks every complete packet in the internal buffer.
+        :return: list of payload memoryviews, in the order they were received.
+        """
+        payloads = []
+        payload = self.unpack()
+        while payload is not None:
+            payloads.append(payload)
+            payload = self.unpack()
+        return payloads
+
+    def unpack(self):
+        """
+        Attempt to unpack the next packet from the internal buffer. Consumed bytes (including corrupt bytes skipped
+        while resyncing) are dropped from the buffer.
+        :return: Payload memoryview if a complete packet was buffered, None otherwise.
+        """
+        buffer = self._buffer
+        end = self._end
+        while True:
+            start = self._start
+            if start >= end:
+                return None
+            try:
+                if self._header is None:
+                    self._header = UnpackerBase._unpack_header(buffer, start, end, self.max_payload_length)
+                header = self._header
+                if header is None or end - start < UnpackerBase._packet_size(header):
+                    if self._resyncing or (header is not None and
+                                           header.payload_length > self.likely_payload_length):
+                        index, header = self._find_valid_packet(start, end)
+                        if index != -1:
+                            # skip the candidate, it is part of a corrupt packet
+                            if not self._resyncing:
+                                self.corrupt += 1
+                            self.dropped += index - start
+                            self._start = index
+                            self._header = header
+                            continue
+                    # keep the header and wait for the rest of the packet
+                    return None
+                packet_size = UnpackerBase._packet_size(header)
+                payload_start = start + header.payload_index
+                payload = self._view[payload_start:payload_start + header.payload_length]
+                footer = UnpackerBase._unpack_footer(buffer, header, start)
+                UnpackerBase._validate_payload(payload, footer)
+                self._header = None
+                self._resyncing = False
+                self._start = start + packet_size
+                self.packets += 1
+                self._frame = (self._view, start, packet_size)
+                return payload
+            except CorruptPacket as corrupt_packet:
+                self._header = None
+                self.corrupt += 1
+                if isinstance(corrupt_packet, InvalidChecksum):
+                    self.crc_errors += 1
+                if self._errors == 'strict':
+                    # skip the offending start byte so the caller can keep feeding after handling the error
+                    self._start = start + 1
+                    self.dropped += 1
+                    raise corrupt_packet
+                # resync on the next possible start byte
+                self._resyncing = True
+                next_sb = UnpackerBase._next_possible_packet_index(buffer, start, end)
+                self._start = end if next_sb == -1 else next_sb
+                self.dropped += self._start - start
+
+    @staticmethod
+    def pack(payload):
+        """
+        See PackerBase.pack
+        """
+        return Stateful._pack(payload)
+
+
 def frame(bytestring):
     return Stateless.pack(bytestring)
 
@@ -0,0 +1,69 @@
+"""
+CRC16-XMODEM (poly 0x1021, init 0x0000) used by the VESC packet footer.
+
+The heavy lifting is done by binascii.crc_hqx, which is the table-driven CCITT CRC implemented in C that ships with
+every CPython. It accepts a running value, so the same engine can be fed a packet in several chunks.
+"""
+from binascii import crc_hqx
+from itertools import repeat
+
+
+class CrcXmodem(object):
+    """
+    Incremental CRC16-XMODEM calculator. Drop-in replacement for crccheck.crc.CrcXmodem as used by limmy.
+    """
+    INITIAL_VALUE = 0x0000
+
+    def __init__(self):
+        self._value = CrcXmodem.INITIAL_VALUE
+
+    def reset(self):
+        """
+        Resets the running value so a new checksum can be calculated.
+        """
+        self._value = CrcXmodem.INITIAL_VALUE
+
+    def process(self, data):
+        """
+        Adds a chunk of data to the running checksum.
+        :param data: bytes-like object.
+        :return: self, so calls can be chained.
+        """
+        self._value = crc_hqx(data, self._value)
+        return self
+
+    def final(self):
+        """
+        :return: Checksum of all the data processed since the last reset.
+        """
+        return self._value
+
+    @staticmethod
+    def calc(data, crc=INITIAL_VALUE):
+        """
+        Calculates the checksum of data in one call.
+        :param data: bytes-like object.
+        :param crc: running value to continue from, used to checksum data split across several buffers.
+        :return: Checksum of data.
+        """
+        return crc_hqx(data, crc)
+
+    @staticmethod
+    def calc_many(payloads):
+        """
+        Calculates the checksum of every payload in one batch call.
+        :param payloads: iterable of bytes-like objects.
+        :return: list of checksums, in the same order as payloads.
+        """
+        return list(map(crc_hqx, payloads, repeat(CrcXmodem.INITIAL_VALUE)))
+
+    @staticmethod
+    def check_many(payloads, crcs):
+        """
+        Checks a batch of payloads against their expected checksums.
+        :param payloads: iterable of bytes-like objects.
+        :param crcs: iterable of expected checksums, one per payload.
+        :return: list of booleans, True where the payload matches its checksum.
+        """
+        return [crc == expected for crc, expected in
+                zip(map(crc_hqx, payloads, repeat(CrcXmodem.INITIAL_VALUE)), crcs)]
@@ -2,5 +2,9 @@ class CorruptPacket(ValueError):
     pass
 
 
+class InvalidChecksum(CorruptPacket):
+    pass
+
+
 class InvalidPayload(ValueError):
     pass
\ No newline at end of file
@@ -1,7 +1,7 @@
 import collections
 import struct
 from limmy.protocol.packet.exceptions import *
-from crccheck.crc import CrcXmodem
+from limmy.protocol.packet.crc import CrcXmodem
 
 crc_checker = CrcXmodem()
 
@@ -10,6 +10,12 @@ class Header(collections.namedtuple('Header', ['payload_index', 'payload_length'
     """
     Tuple to help with packing and unpacking the header of a VESC packet.
     """
+    # longest payload a header can describe (16 bit length)
+    MAX_PAYLOAD_LENGTH = 0xFFFF
+    # PACKET_MAX_PL_LEN of the VESC firmware, it never sends a longer payload. While resyncing after corruption, a
+    # header claiming more is most likely a corrupt length or a start byte that is really part of a payload
+    FIRMWARE_MAX_PAYLOAD_LENGTH = 512
+
     @staticmethod
     def generate(payload):
         """
@@ -27,13 +33,14 @@ class Header(collections.namedtuple('Header', ['payload_index', 'payload_length'
         return Header(payload_index, payload_length)
 
     @staticmethod
-    def parse(buffer):
+    def parse(buffer, offset=0):
         """
         Creates a Header by parsing the given buffer.
         :param buffer: buffer object.
+        :param offset: index of the start byte in the buffer.
         :return: Header object.
         """
-        return Header._make(struct.unpack_from(Header.fmt(buffer[0]), buffer, 0))
+        return Header._make(struct.unpack_from(Header.fmt(buffer[offset]), buffer, offset))
 
     @staticmethod
     def fmt(start_byte):
@@ -42,9 +49,9 @@ class Header(collections.namedtuple('Header', ['payload_index', 'payload_length'
         :param start_byte: The first byte in the buffer.
         :return: The character format of the packet header.
         """
-        if start_byte is 0x2:
+        if start_byte == 0x2:
             return '>BB'
-        elif start_byte is 0x3:
+        elif start_byte == 0x3:
             return '>BH'
         else:
             raise CorruptPacket("Invalid start byte: %u" % start_byte)
@@ -55,10 +62,19 @@ class Footer(collections.namedtuple('Footer', ['crc', 'terminator'])):
     Footer of a VESC packet.
     """
     TERMINATOR = 0x3 # Terminator character
+    SIZE = 3 # Size of the footer in bytes (crc and terminator)
 
     @staticmethod
-    def parse(buffer, header):
-        return Footer._make(struct.unpack_from(Footer.fmt(), buffer, header.payload_index + header.payload_length))
+    def parse(buffer, header, offset=0):
+        """
+        Creates a Footer by parsing the given buffer.
+        :param buffer: buffer object.
+        :param header: Header object of the packet.
+        :param offset: index of the start byte of the packet in the buffer.
+        :return: Footer object.
+        """
+        return Footer._make(struct.unpack_from(Footer.fmt(), buffer,
+                                               offset + header.payload_index + header.payload_length))
 
     @staticmethod
     def generate(payload):
@@ -0,0 +1,311 @@
+'''
+Records every frame a VESC sends and receives to a binary log, and reads
+logs back for post-run analysis:
+
+    motor.start_recording('run.limmylog')
+    ...
+    motor.stop_recording()
+
+    with RecordReader('run.limmylog') as log:
+        for timestamp, direction, msg in log.messages(start=log.start_time + 60):
+            ...
+
+The log starts with a header holding the wall clock and time.monotonic()
+of the start of the recording, followed by one entry per frame: the
+time.monotonic() timestamp (float64), the direction (uint8, TX or RX), the
+length (uint32) and the raw packet, start byte to terminator, all little
+endian. Entries are in timestamp order.
+
+A sidecar index (the log path plus '.idx') holds the timestamp and file
+offset of the first entry of every batch written, so a reader can seek to any
+moment of a long run without parsing the log from the start.
+'''
+from limmy.protocol.base import VESCMessage
+from limmy.protocol.packet.codec import Stateful
+from array import array
+import bisect
+import collections
+import mmap
+import struct
+import threading
+import time
+
+# directions of an entry
+TX = 0
+RX = 1
+
+_file_header = struct.Struct('<8sHxxdd')
+_entry_header = struct.Struct('<dBI')
+_index_entry = struct.Struct('<dQ')
+MAGIC = b'LIMMYLOG'
+VERSION = 1
+
+Entry = collections.namedtuple('Entry', ['timestamp', 'direction', 'data'])
+
+
+class Recorder(object):
+    """
+    Appends frames to a log. record only copies the frame into a memory buffer, a background thread writes the
+    buffer to disk in batches, so recording adds no system calls to the reader and writer threads.
+    """
+    # directions, so the reader and writer threads can record without importing this module
+    TX = TX
+    RX = RX
+
+    def __init__(self, path, flush_interval=0.1, max_batch=1 << 20):
+        """
+        :param path: path of the log, overwritten if it exists
+        :param flush_interval: longest time in seconds a frame waits in memory before it is written
+        :param max_batch: number of buffered bytes that triggers a write before flush_interval
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._file = open(path, 'wb')
+        self._index = open(path + '.idx', 'wb')
+        self._file.write(_file_header.pack(MAGIC, VERSION, time.time(), time.monotonic()))
+        self._file.flush()
+        self._offset = _file_header.size
+        self._buffer = bytearray()
+        self._batch_time = None
+        self._cond = threading.Condition()
+        # serializes writes to the files, taken before _cond
+        self._io_lock = threading.Lock()
+        self._stop = False
+        # entries recorded, bytes and batches written
+        self.entries = 0
+        self.bytes = 0
+        self.writes = 0
+        self._thread = threading.Thread(target=self._write_loop, name='limmy-recorder', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, direction, data):
+        """
+        Adds one frame to the log, stamped with the current time.monotonic().
+        :param direction: TX or RX
+        :param data: bytes-like object of the raw packet
+        """
+        with self._cond:
+            # stamped under the lock so entries are in timestamp order whichever thread records them
+            timestamp = time.monotonic()
+            if not self._buffer:
+                self._batch_time = timestamp
+            self._buffer += _entry_header.pack(timestamp, direction, len(data))
+            self._buffer += data
+            self.entries += 1
+            if len(self._buffer) >= self.max_batch:
+                self._cond.notify()
+
+    def record_many(self, direction, frames):
+        """
+        Adds several frames with the same timestamp, i.e. a batch written at once.
+        :param direction: TX or RX
+        :param frames: iterable of bytes-like objects
+        """
+        with self._cond:
+            timestamp = time.monotonic()
+            if not self._buffer:
+                self._batch_time = timestamp
+            for data in frames:
+                self._buffer += _entry_header.pack(timestamp, direction, len(data))
+                self._buffer += data
+                self.entries += 1
+            if len(self._buffer) >= self.max_batch:
+                self._cond.notify()
+
+    def flush(self):
+        """
+        Writes everything recorded so far to disk.
+        """
+        with self._io_lock:
+            self._write()
+
+    def close(self):
+        """
+        Writes what is still buffered and closes the log.
+        """
+        with self._cond:
+            if self._stop:
+                return
+            self._stop = True
+            self._cond.notify()
+        self._thread.join()
+        self._file.close()
+        self._index.close()
+
+    def _write(self):
+        """
+        Swaps out the buffered entries and writes them with their index entry. Must hold the io lock; recording
+        threads only wait for the swap, not for the disk.
+        """
+        with self._cond:
+            if not self._buffer:
+                return
+            data = self._buffer
+            batch_time = self._batch_time
+            self._buffer = bytearray()
+        self._file.write(data)
+        self._file.flush()
+        # only index data that is on disk, so the index never points past the end of the log
+        self._index.write(_index_entry.pack(batch_time, self._offset))
+        self._index.flush()
+        self._offset += len(data)
+        self.bytes += len(data)
+        self.writes += 1
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                if not self._stop:
+                    self._cond.wait(self.flush_interval)
+                stop = self._stop
+            with self._io_lock:
+                self._write()
+            if stop:
+                return
+
+
+class RecordReader(object):
+    """
+    Reads a log written by Recorder. The log is memory-mapped, so entries are read without copying and only the part
+    of the log that is looked at is paged in. Timestamps are time.monotonic() of the recording process, wall_time
+    converts them.
+    """
+    def __init__(self, path):
+        """
+        :param path: path of the log
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        magic, version, self.start_wall_time, self.start_time = _file_header.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a limmy log" % path)
+        if version != VERSION:
+            raise ValueError("%s has log version %u, this version of limmy reads version %u" % (path, version, VERSION))
+        # end of the last complete entry, a log cut short by a crash may end in a partial one
+        self._end = len(self._map)
+        self._times, self._offsets = self._load_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        try:
+            self._view.release()
+            self._map.close()
+        except BufferError:
+            # entry data is still referenced, the mapping goes away with the last reference
+            pass
+        self._file.close()
+
+    def _load_index(self):
+        """
+        Loads the sidecar index and indexes the part of the log it does not cover (all of it if there is no index).
+        :return: (timestamps, offsets) of the indexed entries
+        """
+        times = array('d')
+        offsets = array('Q')
+        try:
+            with open(self.path + '.idx', 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = b''
+        for timestamp, offset in _index_entry.iter_unpack(data[:len(data) - len(data) % _index_entry.size]):
+            if offset >= self._end:
+                break
+            times.append(timestamp)
+            offsets.append(offset)
+        # walk the entries after the last indexed batch, one index entry per 1024 log entries
+        offset = offsets[-1] if offsets else _file_header.size
+        count = 0
+        while offset + _entry_header.size <= self._end:
+            timestamp, _, length = _entry_header.unpack_from(self._map, offset)
+            if offset + _entry_header.size + length > self._end:
+                # partial entry at the end of a log that was not closed
+                self._end = offset
+                break
+            if count % 1024 == 0 and (not offsets or offset > offsets[-1]):
+                times.append(timestamp)
+                offsets.append(offset)
+            count += 1
+            offset += _entry_header.size + length
+        return times, offsets
+
+    @property
+    def end_time(self):
+        """
+        :return: timestamp of the last entry, None if the log is empty
+        """
+        last = None
+        for entry in self.entries(start=self._times[-1] if self._times else None):
+            last = entry.timestamp
+        return last
+
+    def wall_time(self, timestamp):
+        """
+        :param timestamp: timestamp of an entry
+        :return: the time.time() at which the entry was recorded
+        """
+        return self.start_wall_time + timestamp - self.start_time
+
+    def seek(self, timestamp):
+        """
+        :param timestamp: time.monotonic() timestamp
+        :return: file offset of the first entry at or after timestamp
+        """
+        # start at the last indexed batch that begins before timestamp and walk from there
+        idx = bisect.bisect_left(self._times, timestamp) - 1
+        offset = self._offsets[idx] if idx >= 0 else _file_header.size
+        while offset + _entry_header.size <= self._end:
+            entry_time, _, length = _entry_header.unpack_from(self._map, offset)
+            if entry_time >= timestamp:
+                break
+            offset += _entry_header.size + length
+        return offset
+
+    def entries(self, start=None, end=None, direction=None):
+        """
+        Yields the entries between two timestamps. data is a memoryview of the mapped log, valid until close.
+        :param start: timestamp of the first entry, defaults to the start of the log
+        :param end: entries at or after this timestamp are not yielded, defaults to the end of the log
+        :param direction: only yield entries of this direction (TX or RX), both if None
+        :return: generator of Entry(timestamp, direction, data)
+        """
+        offset = _file_header.size if start is None else self.seek(start)
+        view = self._view
+        while offset + _entry_header.size <= self._end:
+            timestamp, entry_direction, length = _entry_header.unpack_from(view, offset)
+            if end is not None and timestamp >= end:
+                return
+            data_start = offset + _entry_header.size
+            offset = data_start + length
+            if direction is None or entry_direction == direction:
+                yield Entry(timestamp, entry_direction, view[data_start:offset])
+
+    def messages(self, start=None, end=None, direction=None):
+        """
+        Like entries, with each frame decoded into a message. Frames that do not decode are skipped, which includes
+        requests sent without their response fields (i.e. a GetValues request), use entries to see those.
+        :return: generator of (timestamp, direction, message)
+        """
+        unpacker = Stateful()
+        for timestamp, entry_direction, data in self.entries(start, end, direction):
+            for payload in unpacker.feed(data):
+                if payload[0] == VESCMessage._comm_forward_can:
+                    # forwarded command, decode the message inside
+                    payload = payload[2:]
+                try:
+                    yield timestamp, entry_direction, VESCMessage.unpack(payload)
+                except (KeyError, struct.error, UnicodeDecodeError):
+                    continue
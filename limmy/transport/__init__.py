@@ -0,0 +1,48 @@
+'''
+Links limmy can talk to a VESC over. Every transport carries the same VESC
+packet stream, so VESC, VESCGroup and the rest work over any of them:
+
+    * SerialTransport: USB-CDC or UART, the default.
+    * TCPTransport: the TCP bridge of VESC Tool or a VESC Express.
+    * SocketCANTransport: a VESC on a Linux CAN interface.
+    * LoopbackTransport: an in-memory pair, for emulators and benchmarks.
+
+open_transport builds one from a string, which is what VESC(serial_port=...)
+accepts.
+'''
+from .base import Transport
+from .serial_port import SerialTransport
+from .tcp import TCPTransport
+from .socketcan import SocketCANTransport
+from .loopback import LoopbackTransport
+
+
+def open_transport(port, baudrate=115200, timeout=0.05):
+    """
+    Opens a transport from a port string:
+
+        "/dev/ttyACM0" or "COM3"        serial port
+        "tcp://192.168.4.1:65102"       TCP bridge, the port defaults to 65102
+        "socketcan://can0/12"           VESC with controller id 12 on can0
+
+    :param port: port string, or a Transport which is returned as is
+    :param baudrate: baudrate of serial ports
+    :param timeout: see Transport
+    :return: the open Transport
+    """
+    if not isinstance(port, str):
+        return port
+    scheme, separator, address = port.partition('://')
+    if not separator:
+        return SerialTransport(port, baudrate, timeout)
+    if scheme == 'tcp':
+        host, _, tcp_port = address.rpartition(':')
+        if not host:
+            return TCPTransport(tcp_port, timeout=timeout)
+        return TCPTransport(host, int(tcp_port), timeout=timeout)
+    if scheme == 'socketcan':
+        channel, _, can_id = address.partition('/')
+        if not can_id:
+            raise ValueError("socketcan port needs a controller id, i.e. socketcan://can0/12")
+        return SocketCANTransport(channel, int(can_id), timeout=timeout)
+    raise ValueError("Unknown transport %r" % scheme)
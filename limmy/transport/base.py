@@ -0,0 +1,58 @@
+class Transport(object):
+    """
+    A byte stream link to a VESC. limmy reads and writes VESC packets through a Transport, so every feature works
+    the same over any link. Subclasses implement write, readinto and close; the names follow serial.Serial, but
+    readinto returns as soon as any data is there instead of waiting for the whole buffer.
+    """
+    def __init__(self, timeout=0.05):
+        """
+        :param timeout: seconds readinto waits for data, also how quickly the reader thread notices it is stopped
+        """
+        self.timeout = timeout
+        self.is_open = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def in_waiting(self):
+        """
+        :return: number of bytes that can be read without waiting, 0 if unknown
+        """
+        return 0
+
+    def write(self, data):
+        """
+        Writes every byte of data.
+        :param data: bytes-like object
+        """
+        raise NotImplementedError
+
+    def readinto(self, buffer):
+        """
+        Waits up to timeout for data and reads what is available, at most len(buffer) bytes. Does not wait for the
+        buffer to fill up.
+        :param buffer: writable bytes-like object
+        :return: number of bytes read, 0 if the timeout expired
+        """
+        raise NotImplementedError
+
+    def read(self, size=1):
+        """
+        Like readinto, returning the bytes read.
+        """
+        buffer = bytearray(size)
+        count = self.readinto(buffer)
+        return bytes(buffer[:count])
+
+    def flush(self):
+        """
+        Waits until everything written has been handed to the link.
+        """
+        pass
+
+    def close(self):
+        self.is_open = False
@@ -0,0 +1,69 @@
+from limmy.transport.base import Transport
+import threading
+
+
+class _Pipe(object):
+    """
+    One direction of a loopback link.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.cond = threading.Condition()
+        self.closed = False
+
+
+class LoopbackTransport(Transport):
+    """
+    In-memory link: whatever one end writes, the other end reads. Lets the whole stack run against an emulated VESC
+    (see limmy.emulator) or be benchmarked without hardware or system calls.
+
+        host, device = LoopbackTransport.pair()
+    """
+    def __init__(self, rx, tx, timeout=0.05):
+        """
+        Use pair() rather than constructing ends yourself.
+        """
+        super(LoopbackTransport, self).__init__(timeout)
+        self._rx = rx
+        self._tx = tx
+
+    @staticmethod
+    def pair(timeout=0.05):
+        """
+        :param timeout: see Transport, for both ends
+        :return: two connected ends
+        """
+        a_to_b = _Pipe()
+        b_to_a = _Pipe()
+        return LoopbackTransport(b_to_a, a_to_b, timeout), LoopbackTransport(a_to_b, b_to_a, timeout)
+
+    @property
+    def in_waiting(self):
+        return len(self._rx.buffer)
+
+    def write(self, data):
+        with self._tx.cond:
+            if self._tx.closed:
+                raise ConnectionError("Loopback closed.")
+            self._tx.buffer += data
+            self._tx.cond.notify_all()
+
+    def readinto(self, buffer):
+        rx = self._rx
+        with rx.cond:
+            if not rx.buffer:
+                rx.cond.wait_for(lambda: rx.buffer or rx.closed, self.timeout)
+            if not rx.buffer and rx.closed:
+                raise ConnectionError("Loopback closed.")
+            count = min(len(buffer), len(rx.buffer))
+            buffer[:count] = rx.buffer[:count]
+            del rx.buffer[:count]
+            return count
+
+    def close(self):
+        self.is_open = False
+        # closing either end closes the link in both directions
+        for pipe in (self._rx, self._tx):
+            with pipe.cond:
+                pipe.closed = True
+                pipe.cond.notify_all()
@@ -0,0 +1,56 @@
+from limmy.transport.base import Transport
+
+# because people may want to use this library for their own messaging, do not make this a required package
+try:
+    import serial
+except ImportError:
+    serial = None
+
+
+class SerialTransport(Transport):
+    """
+    USB-CDC or UART link, the way VESCs are usually connected.
+    """
+    def __init__(self, port, baudrate=115200, timeout=0.05):
+        """
+        :param port: Serial device to use for communication (i.e. "COM3" or "/dev/ttyACM0")
+        :param baudrate: baudrate for the serial communication. Shouldn't need to change this.
+        :param timeout: see Transport
+        """
+        if serial is None:
+            raise ImportError("Need to install pyserial in order to use a serial port.")
+        super(SerialTransport, self).__init__(timeout)
+        self.port = serial.Serial(port=port, baudrate=baudrate, timeout=timeout)
+
+    @property
+    def is_open(self):
+        return self.port.is_open
+
+    @is_open.setter
+    def is_open(self, value):
+        # set by Transport.__init__, the state lives in the serial port
+        pass
+
+    @property
+    def in_waiting(self):
+        return self.port.in_waiting
+
+    def fileno(self):
+        return self.port.fileno()
+
+    def write(self, data):
+        self.port.write(data)
+
+    def readinto(self, buffer):
+        # a serial read blocks until the requested size arrives, so only ask for what is already there
+        size = min(len(buffer), max(1, self.port.in_waiting))
+        with memoryview(buffer) as view:
+            return self.port.readinto(view[:size]) or 0
+
+    def flush(self):
+        self.port.flush()
+
+    def close(self):
+        if self.port.is_open:
+            self.port.flush()
+            self.port.close()
@@ -0,0 +1,139 @@
+from limmy.transport.base import Transport
+from limmy.protocol.packet.codec import Stateful, frame
+from limmy.protocol.packet.crc import CrcXmodem
+import socket
+import struct
+import threading
+
+# CAN packet types of the VESC firmware used to carry command buffers (comm_can_send_buffer)
+CAN_PACKET_FILL_RX_BUFFER = 5
+CAN_PACKET_FILL_RX_BUFFER_LONG = 6
+CAN_PACKET_PROCESS_RX_BUFFER = 7
+CAN_PACKET_PROCESS_SHORT_BUFFER = 8
+
+# tells the receiving VESC to process the buffer and reply over CAN (replies come back flagged 1)
+_SEND_PROCESS = 0
+
+# struct can_frame from linux/can.h
+_can_frame = struct.Struct('=IB3x8s')
+_CAN_EFF_FLAG = 0x80000000
+_CAN_EFF_MASK = 0x1FFFFFFF
+
+
+class SocketCANTransport(Transport):
+    """
+    Linux SocketCAN link straight to a VESC on the CAN bus, i.e. through a CAN hat on a Raspberry Pi. Packets are
+    carried the way VESCs forward them to each other: short payloads in one PROCESS_SHORT_BUFFER frame, longer ones as
+    FILL_RX_BUFFER(_LONG) frames followed by PROCESS_RX_BUFFER with the length and CRC. The transport converts between
+    that and the usual packet stream, so the rest of limmy is unaware of CAN.
+
+    Try it without hardware on a virtual bus:
+
+        sudo ip link add dev vcan0 type vcan && sudo ip link set up vcan0
+    """
+    def __init__(self, channel, can_id, host_id=254, timeout=0.05, sock=None):
+        """
+        :param channel: CAN interface, i.e. "can0" or "vcan0"
+        :param can_id: controller id of the VESC to talk to
+        :param host_id: controller id this end uses on the bus, must not be used by a VESC
+        :param timeout: see Transport
+        :param sock: already bound CAN_RAW socket, opened from channel if None
+        """
+        super(SocketCANTransport, self).__init__(timeout)
+        self.channel = channel
+        self.can_id = can_id
+        self.host_id = host_id
+        if sock is None:
+            sock = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+            # only extended frames addressed to this end
+            sock.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FILTER,
+                            struct.pack('=II', host_id | _CAN_EFF_FLAG, 0xFF | _CAN_EFF_FLAG))
+            sock.bind((channel,))
+        sock.settimeout(timeout)
+        self.sock = sock
+        self._unpacker = Stateful()
+        self._write_lock = threading.Lock()
+        # reassembly of a buffer sent in several frames
+        self._rx_buffer = bytearray(65536)
+        # framed packets received but not read yet
+        self._pending = bytearray()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    @property
+    def in_waiting(self):
+        return len(self._pending)
+
+    @staticmethod
+    def split(payload, can_id, host_id):
+        """
+        Splits a payload into the CAN frames that carry it.
+        :return: list of (29 bit frame id, data)
+        """
+        def frame_id(packet_type):
+            return can_id | (packet_type << 8)
+        if len(payload) <= 6:
+            return [(frame_id(CAN_PACKET_PROCESS_SHORT_BUFFER), bytes((host_id, _SEND_PROCESS)) + payload)]
+        frames = []
+        index = 0
+        while index < len(payload) and index <= 255:
+            frames.append((frame_id(CAN_PACKET_FILL_RX_BUFFER), bytes((index,)) + payload[index:index + 7]))
+            index += 7
+        while index < len(payload):
+            frames.append((frame_id(CAN_PACKET_FILL_RX_BUFFER_LONG),
+                           struct.pack('>H', index) + payload[index:index + 6]))
+            index += 6
+        frames.append((frame_id(CAN_PACKET_PROCESS_RX_BUFFER),
+                       struct.pack('>BBHH', host_id, _SEND_PROCESS, len(payload), CrcXmodem.calc(payload))))
+        return frames
+
+    def write(self, data):
+        payloads = [bytes(payload) for payload in self._unpacker.feed(data)]
+        with self._write_lock:
+            for payload in payloads:
+                for frame_id, frame_data in SocketCANTransport.split(payload, self.can_id, self.host_id):
+                    self.sock.send(_can_frame.pack(frame_id | _CAN_EFF_FLAG, len(frame_data), frame_data))
+
+    def _receive(self, frame_id, data):
+        """
+        Handles one received CAN frame.
+        :return: the payload if the frame completed one, None otherwise
+        """
+        if frame_id & 0xFF != self.host_id:
+            return None
+        packet_type = (frame_id >> 8) & 0xFF
+        if packet_type == CAN_PACKET_FILL_RX_BUFFER:
+            self._rx_buffer[data[0]:data[0] + len(data) - 1] = data[1:]
+        elif packet_type == CAN_PACKET_FILL_RX_BUFFER_LONG:
+            index = (data[0] << 8) | data[1]
+            self._rx_buffer[index:index + len(data) - 2] = data[2:]
+        elif packet_type == CAN_PACKET_PROCESS_RX_BUFFER:
+            _, _, length, crc = struct.unpack_from('>BBHH', data)
+            payload = bytes(self._rx_buffer[:length])
+            if CrcXmodem.calc(payload) == crc:
+                return payload
+        elif packet_type == CAN_PACKET_PROCESS_SHORT_BUFFER:
+            return bytes(data[2:])
+        return None
+
+    def readinto(self, buffer):
+        while not self._pending:
+            try:
+                raw = self.sock.recv(_can_frame.size)
+            except socket.timeout:
+                return 0
+            can_id, length, data = _can_frame.unpack(raw)
+            if not can_id & _CAN_EFF_FLAG:
+                continue
+            payload = self._receive(can_id & _CAN_EFF_MASK, data[:length])
+            if payload:
+                self._pending += frame(payload)
+        count = min(len(buffer), len(self._pending))
+        buffer[:count] = self._pending[:count]
+        del self._pending[:count]
+        return count
+
+    def close(self):
+        self.is_open = False
+        self.sock.close()
@@ -0,0 +1,50 @@
+from limmy.transport.base import Transport
+import socket
+
+
+class TCPTransport(Transport):
+    """
+    TCP link, i.e. to the TCP bridge of VESC Tool or a VESC Express. VESC packets are sent over the socket exactly as
+    over serial.
+    """
+    # port of the VESC Tool TCP server
+    DEFAULT_PORT = 65102
+
+    def __init__(self, host, port=DEFAULT_PORT, timeout=0.05, connect_timeout=5.0):
+        """
+        :param host: host name or address of the bridge
+        :param port: TCP port of the bridge
+        :param timeout: see Transport
+        :param connect_timeout: seconds to wait for the connection
+        """
+        super(TCPTransport, self).__init__(timeout)
+        self.address = (host, port)
+        self.sock = socket.create_connection(self.address, connect_timeout)
+        # packets are small and latency matters more than segment count
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(timeout)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def readinto(self, buffer):
+        try:
+            count = self.sock.recv_into(buffer)
+        except socket.timeout:
+            return 0
+        if count == 0 and len(buffer):
+            self.is_open = False
+            raise ConnectionError("Connection to %s:%u closed by the peer." % self.address)
+        return count
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.sock.close()
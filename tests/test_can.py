@@ -0,0 +1,32 @@
+import time
+import pytest
+from concurrent.futures import TimeoutError
+from limmy.emulator import VESCEmulator
+from limmy.VESC import VESC
+from limmy.VESC.messages import GetValues, VedderCmd
+
+
+def test_can_nodes_are_reached_through_the_port():
+    with VESCEmulator.loopback(can_ids=(3, 7)) as emulator:
+        with VESC(emulator.port, start_heartbeat=False) as motor:
+            assert sorted(motor.ping_can(timeout=0.5)) == [3, 7]
+            for can_id in (3, 7):
+                node = motor.can(can_id)
+                node.set_rpm(1000 * can_id)
+                assert node.get_firmware_version() == motor.get_firmware_version()
+                assert isinstance(node.get_measurements(), GetValues)
+    assert emulator.requests[VedderCmd.COMM_SET_RPM] == 2
+
+
+def test_lost_response_does_not_block_the_port():
+    with VESCEmulator.loopback(can_ids=(3,)) as emulator:
+        with VESC(emulator.port, start_heartbeat=False, response_timeout=0.2) as motor:
+            # nobody on the bus answers id 9, and the caller makes another request before waiting on the first
+            lost = motor.can(9).request(motor.can(9)._get_values_msg, GetValues.id)
+            start = time.monotonic()
+            answered = motor.can(3).request(motor.can(3)._get_values_msg, GetValues.id)
+            assert time.monotonic() - start < 1.0
+            assert isinstance(motor.wait(answered), GetValues)
+            with pytest.raises(TimeoutError):
+                motor.wait(lost)
+            assert motor.stats()['received']['timeouts'] == 1
@@ -0,0 +1,62 @@
+import pytest
+from limmy.protocol.base import VESCMessage
+from limmy.protocol.packet.codec import Stateful, Stateless, frame, unframe
+from limmy.VESC.messages import GetValues
+
+NUM_PACKETS = 100
+CORRUPT_PACKET = 50
+
+_payload = VESCMessage.pack(GetValues(*([1] * 15 + [b'\x00', 1, b'\x00', 1])))
+_packet = frame(_payload)
+
+
+def _corrupt_stream(offset, mask):
+    stream = bytearray(_packet * NUM_PACKETS)
+    stream[CORRUPT_PACKET * len(_packet) + offset] ^= mask
+    return bytes(stream)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+@pytest.mark.parametrize('mask', [0x01, 0x80, 0xFF])
+def test_single_byte_corruption_loses_one_packet(chunk_size, mask):
+    for offset in range(len(_packet)):
+        stream = _corrupt_stream(offset, mask)
+        unpacker = Stateful()
+        payloads = []
+        for idx in range(0, len(stream), chunk_size):
+            payloads += [bytes(payload) for payload in unpacker.feed(stream[idx:idx + chunk_size])]
+        assert payloads == [_payload] * (NUM_PACKETS - 1), "byte %u flipped with %#x" % (offset, mask)
+        assert len(unpacker) == 0
+
+
+def test_long_header_inside_payload_is_not_waited_on():
+    # a payload byte of 0x03 followed by a huge length used to stall the unpacker until that many bytes arrived
+    stream = bytearray(_packet * 3)
+    stream[len(_packet):len(_packet) + 3] = b'\x00\x03\xe8'
+    payloads = Stateful().feed(bytes(stream))
+    assert [bytes(payload) for payload in payloads] == [_payload, _payload]
+
+
+def test_unframe_returns_bytes_so_the_buffer_can_be_consumed():
+    buffer = bytearray(_packet * 2)
+    payload, consumed = unframe(buffer)
+    del buffer[:consumed]
+    assert payload == _payload and isinstance(payload, bytes)
+    assert unframe(buffer) == (_payload, len(_packet))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_payload_longer_than_the_firmware_sends_round_trips(chunk_size):
+    # the firmware never sends more than 512 bytes, but the framing allows up to 65535 and encode produces them
+    long_payload = b'\x30' + bytes(range(256)) * 3
+    long_packet = Stateless.pack(long_payload)
+    assert Stateless.unpack(long_packet) == (long_payload, len(long_packet))
+    assert unframe(long_packet) == (long_payload, len(long_packet))
+    # also after a corrupt packet, while the unpacker is resyncing
+    stream = _packet + long_packet + b'\x02\x05\xff' + long_packet + _packet
+    unpacker = Stateful()
+    payloads = []
+    for idx in range(0, len(stream), chunk_size):
+        payloads += [bytes(payload) for payload in unpacker.feed(stream[idx:idx + chunk_size])]
+    assert payloads == [_payload, long_payload, long_payload, _payload]
+    assert len(unpacker) == 0
@@ -0,0 +1,64 @@
+import os
+import random
+import pytest
+from limmy.protocol.interface import decode_all, decode_file, encode
+from limmy.VESC.messages import GetValues, SetRPM
+
+
+def _values(idx):
+    return GetValues(25.0, 30.0, 1.5, 0.5, 0.0, 1.5, 0.25, 1000 + idx, 48.0, 0.0, 0.0, 0.0, 0.0, idx, idx,
+                     b'\x00', 90.0, b'\x03', idx)
+
+
+def _capture(count, seed=0):
+    # GetValues responses with line noise and another message in between
+    rng = random.Random(seed)
+    chunks = []
+    for idx in range(count):
+        chunks.append(bytes(rng.randrange(4, 256) for _ in range(rng.randrange(4))))
+        chunks.append(encode(_values(idx)))
+        if idx % 10 == 0:
+            chunks.append(encode(SetRPM(idx)))
+    return b''.join(chunks)
+
+
+def _summary(result):
+    # messages have no equality, compare what was found where
+    messages, skipped = result
+    return [(offset, type(msg).__name__, msg.rpm) for offset, msg in messages], skipped
+
+
+def test_decode_all_skips_noise():
+    capture = _capture(100)
+    messages, skipped = decode_all(capture)
+    values = [msg for _, msg in messages if isinstance(msg, GetValues)]
+    assert [msg.rpm for msg in values] == [1000 + idx for idx in range(100)]
+    assert [msg.rpm for _, msg in messages if isinstance(msg, SetRPM)] == list(range(0, 100, 10))
+    assert skipped > 0
+    assert _summary(decode_all(memoryview(capture))) == _summary((messages, skipped))
+
+
+def test_decode_file_matches_decode_all(tmpdir):
+    path = os.path.join(str(tmpdir), 'capture.bin')
+    with open(path, 'wb') as f:
+        f.write(_capture(50))
+    assert _summary(decode_file(path)) == _summary(decode_all(_capture(50)))
+
+
+def test_bulk_decode_matches_decode_all(tmpdir):
+    numpy = pytest.importorskip('numpy')
+    from limmy.protocol import bulk
+    capture = bytearray(_capture(200))
+    # a frame with a bad checksum is dropped, like decode_all does
+    offset = bytes(capture).find(encode(_values(7)))
+    capture[offset + 10] ^= 0xFF
+    expected = [msg for _, msg in decode_all(bytes(capture))[0] if isinstance(msg, GetValues)]
+    samples = bulk.decode_bulk(bytes(capture), GetValues)
+    assert len(samples) == 199
+    assert list(samples['rpm']) == [msg.rpm for msg in expected]
+    assert numpy.allclose(samples['v_in'], 48.0) and numpy.allclose(samples['duty_cycle_now'], 0.25)
+    path = os.path.join(str(tmpdir), 'capture.bin')
+    with open(path, 'wb') as f:
+        f.write(capture)
+    # chunks much smaller than the file, so frames cross chunk boundaries
+    assert (bulk.decode_file(path, GetValues, chunk_size=1000) == samples).all()
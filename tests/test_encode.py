@@ -0,0 +1,18 @@
+import pytest
+from limmy.protocol.interface import encode, encode_cached, encode_many
+from limmy.VESC.messages import SendTerminalCMD, SetCurrent, SetRPM, encode_engage
+
+
+@pytest.mark.parametrize('values', [(30, 30.0), (30.0, 30), (1, True), (True, 1)])
+def test_equal_values_of_other_types_get_their_own_packet(values):
+    encode_cached.cache_clear()
+    encode_engage.cache_clear()
+    for value in values:
+        assert encode_cached(SetCurrent, value) == encode(SetCurrent(value))
+        assert encode_cached(SetCurrent, value, can_id=3) == encode(SetCurrent(value, can_id=3))
+        assert encode_engage(value, 30) == encode(SendTerminalCMD('foc_openloop %s 1800' % value))
+
+
+def test_encode_many_matches_encode():
+    messages = [SetCurrent(5), SetRPM(1000), SetCurrent(-2.5, can_id=7)]
+    assert encode_many(messages) == b''.join(encode(msg) for msg in messages)
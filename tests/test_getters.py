@@ -0,0 +1,23 @@
+import asyncio
+from limmy.emulator import VESCEmulator
+from limmy.VESC import VESC, AsyncVESC
+
+
+def test_getters_of_vesc():
+    with VESCEmulator.loopback(v_in=36.0) as emulator:
+        with VESC(emulator.port, start_heartbeat=False) as motor:
+            motor.set_duty_cycle(0.25)
+            assert motor.get_duty_cycle() == 0.25
+            assert motor.get_v_in() == 36.0
+            assert motor.get_values('v_in', 'duty_cycle_now') == (36.0, 0.25)
+            assert motor.get_values_selective('v_in').v_in == 36.0
+
+
+def test_getters_of_async_vesc_agree():
+    async def read(port):
+        async with AsyncVESC(port, start_heartbeat=False) as motor:
+            await motor.set_duty_cycle(0.25)
+            return await motor.get_duty_cycle(), await motor.get_v_in()
+
+    with VESCEmulator.loopback(v_in=36.0) as emulator:
+        assert asyncio.run(read(emulator.port)) == (0.25, 36.0)
@@ -0,0 +1,44 @@
+import pytest
+from limmy.emulator import VESCEmulator
+from limmy.VESC import VESC
+from limmy.VESC.messages import VedderCmd
+
+
+@pytest.mark.parametrize('max_payload', [512, 2048])
+def test_stream_reaches_the_emulated_buffer(max_payload):
+    with VESCEmulator.loopback(gpd_buffer_size=4096) as emulator:
+        with VESC(emulator.port, start_heartbeat=False) as motor:
+            streamer = motor.stream_gpd([0.5] * 3000, max_payload=max_payload)
+            # a request round trip, so every frame written before it has been handled
+            motor.get_firmware_version()
+    assert streamer.sent == 3000
+    assert streamer.frames == emulator.requests[VedderCmd.COMM_GPD_FILL_BUFFER]
+    assert emulator.errors == 0 and emulator._unpacker.corrupt == 0
+
+
+def test_max_payload_must_hold_a_sample():
+    with VESCEmulator.loopback() as emulator:
+        with VESC(emulator.port, start_heartbeat=False) as motor:
+            with pytest.raises(ValueError):
+                motor.stream_gpd([0.5], max_payload=0x10000)
+            with pytest.raises(ValueError):
+                motor.stream_gpd([0.5], max_payload=4)
+
+
+def test_credit_keeps_the_buffer_from_overflowing_or_running_dry():
+    with VESCEmulator.loopback(gpd_buffer_size=4096) as emulator:
+        motor_model = emulator._motors[None]
+        levels = []
+        fill_gpd = motor_model.fill_gpd
+
+        def checked_fill_gpd(samples):
+            levels.append(motor_model.gpd_level + samples)
+            fill_gpd(samples)
+        motor_model.fill_gpd = checked_fill_gpd
+        with VESC(emulator.port, start_heartbeat=False) as motor:
+            # 0.8 seconds of samples at the default 20 kHz, the buffer holds 0.2 seconds
+            streamer = motor.stream_gpd([100] * 16000, sample_format='int16')
+            underruns = emulator.gpd_underruns
+    assert streamer.sent == 16000 and streamer.capacity == 4096
+    assert max(levels) <= 4096
+    assert underruns == 0 and streamer.underruns == 0
@@ -0,0 +1,12 @@
+from limmy.emulator import VESCEmulator
+from limmy.VESC import VESC, VESCGroup
+
+
+def test_measurements_of_can_handles_sharing_a_port():
+    with VESCEmulator.loopback(can_ids=(3, 7)) as first, VESCEmulator.loopback() as second:
+        motor = VESC(first.port, start_heartbeat=False, response_timeout=0.5)
+        with VESCGroup([motor, motor.can(3), second.port, motor.can(7)], start_heartbeat=False) as group:
+            for _ in range(3):
+                sample = group.get_measurements()
+                assert [msg.app_controller_id for msg in sample.measurements] == [b'\x00', b'\x03', b'\x00', b'\x07']
+            assert sum(member.stats()['received']['timeouts'] for member in group) == 0
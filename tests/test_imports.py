@@ -0,0 +1,20 @@
+import subprocess
+import sys
+import types
+
+
+def test_import_loads_only_vesc_and_the_protocol():
+    code = ("import sys, limmy; print(' '.join(sorted(name for name in sys.modules if name.split('.')[0] in "
+            "('limmy', 'serial', 'numpy', 'asyncio'))))")
+    loaded = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True).split()
+    assert 'limmy.VESC.VESC' in loaded and 'limmy.protocol' in loaded
+    for name in ('limmy.recorder', 'limmy.transport', 'limmy.emulator', 'limmy.VESC.AsyncVESC', 'serial', 'numpy',
+                 'asyncio'):
+        assert name not in loaded
+
+
+def test_star_import_exports_no_modules():
+    namespace = {}
+    exec('from limmy import *', namespace)
+    assert 'VESC' in namespace and 'VESCGroup' in namespace and 'encode' in namespace
+    assert not [name for name, value in namespace.items() if isinstance(value, types.ModuleType)]
@@ -0,0 +1,58 @@
+import os
+import time
+from limmy.emulator import VESCEmulator
+from limmy.VESC import VESC, DeviceProfile, ProfileCache
+from limmy.VESC.messages import GetValues, GetValuesPreV3_33
+from limmy.VESC.profile import schema_for
+
+
+def test_schema_of_firmware_versions():
+    assert schema_for('2.18.0') == 'pre_v3.33'
+    assert schema_for('3.40.0') == schema_for('6.0.1') == 'v3.33'
+    assert DeviceProfile('/dev/ttyACM0', '2.18.0').values_class is GetValuesPreV3_33
+
+
+def test_cache_round_trips_through_its_file(tmpdir):
+    path = os.path.join(str(tmpdir), 'limmy', 'profiles.json')
+    ProfileCache(path).put(DeviceProfile('/dev/ttyACM0', '6.0.1', {'can_ids': [3]}))
+    ProfileCache(path).put(DeviceProfile('/dev/ttyACM1', '2.18.0'))
+    cache = ProfileCache(path)
+    assert cache.get('/dev/ttyACM0').capabilities == {'can_ids': [3]}
+    assert cache.get('/dev/ttyACM1').version == '2.18.0'
+    assert cache.get('/dev/ttyACM2') is None
+    cache.remove('/dev/ttyACM0')
+    assert ProfileCache(path).get('/dev/ttyACM0') is None
+
+
+def test_unreadable_cache_is_empty(tmpdir):
+    path = os.path.join(str(tmpdir), 'profiles.json')
+    with open(path, 'w') as f:
+        f.write('{not json')
+    assert ProfileCache(path).get('/dev/ttyACM0') is None
+    with open(path, 'w') as f:
+        f.write('{"/dev/ttyACM0": {"schema": "v3.33"}}')
+    assert ProfileCache(path).get('/dev/ttyACM0') is None
+
+
+def test_cached_profile_skips_the_probe(tmpdir):
+    path = os.path.join(str(tmpdir), 'profiles.json')
+    with VESCEmulator(latency=0.2) as emulator:
+        with VESC(emulator.port, start_heartbeat=False, response_timeout=1.0, profile_cache=path) as motor:
+            # no cached profile yet, the constructor waited for the firmware version
+            assert motor.firmware_version == '6.0.1'
+        start = time.monotonic()
+        with VESC(emulator.port, start_heartbeat=False, response_timeout=1.0, profile_cache=path) as motor:
+            assert time.monotonic() - start < 0.2
+            assert motor.profile_check.result(2).version == '6.0.1'
+            assert motor.values_class is GetValues
+
+
+def test_stale_profile_is_replaced(tmpdir):
+    path = os.path.join(str(tmpdir), 'profiles.json')
+    with VESCEmulator(version='2.18.0') as emulator:
+        ProfileCache(path).put(DeviceProfile(emulator.port, '6.0.1'))
+        with VESC(emulator.port, start_heartbeat=False, profile_cache=path) as motor:
+            assert motor.profile_check.result(2).version == '2.18.0'
+            assert motor.values_class is GetValuesPreV3_33
+            assert motor.get_measurements().v_in == 48.0
+    assert ProfileCache(path).get(emulator.port).version == '2.18.0'
@@ -0,0 +1,52 @@
+import os
+import time
+from limmy.emulator import VESCEmulator
+from limmy.protocol.interface import encode
+from limmy.recorder import Recorder, RecordReader, RX, TX
+from limmy.VESC import VESC
+from limmy.VESC.messages import GetValues, SetRPM
+
+
+def test_recording_a_link_reads_back(tmpdir):
+    path = os.path.join(str(tmpdir), 'run.limmylog')
+    with VESCEmulator.loopback() as emulator:
+        with VESC(emulator.port, start_heartbeat=False) as motor:
+            motor.start_recording(path)
+            motor.set_rpm(1500)
+            measurements = [motor.get_measurements() for _ in range(3)]
+            motor.stop_recording()
+    with RecordReader(path) as log:
+        entries = list(log.entries())
+        sent = [bytes(entry.data) for entry in entries if entry.direction == TX]
+        assert sent[0] == encode(SetRPM(1500)) and len(sent) == 4
+        received = [msg for _, _, msg in log.messages(direction=RX)]
+        assert [msg.rpm for msg in received] == [msg.rpm for msg in measurements]
+        assert all(isinstance(msg, GetValues) for msg in received)
+        timestamps = [entry.timestamp for entry in entries]
+        assert timestamps == sorted(timestamps) and log.end_time == timestamps[-1]
+
+
+def test_index_finds_entries_by_time(tmpdir):
+    path = os.path.join(str(tmpdir), 'index.limmylog')
+    with Recorder(path, flush_interval=0.001, max_batch=256) as recorder:
+        for rpm in range(3000):
+            recorder.record(TX, encode(SetRPM(rpm)))
+            if rpm == 1999:
+                middle = time.monotonic()
+    assert os.path.getsize(path + '.idx') > 0
+    with RecordReader(path) as log:
+        assert [msg.rpm for _, _, msg in log.messages(start=middle)] == list(range(2000, 3000))
+        assert [msg.rpm for _, _, msg in log.messages(end=middle)] == list(range(2000))
+
+
+def test_log_without_index_or_cut_short_still_reads(tmpdir):
+    path = os.path.join(str(tmpdir), 'crash.limmylog')
+    with Recorder(path) as recorder:
+        for rpm in range(10):
+            recorder.record(TX, encode(SetRPM(rpm)))
+    os.remove(path + '.idx')
+    with open(path, 'ab') as f:
+        # half of another entry header, as if the recording process died mid-write
+        f.write(b'\x00' * 7)
+    with RecordReader(path) as log:
+        assert [msg.rpm for _, _, msg in log.messages()] == list(range(10))
@@ -0,0 +1,36 @@
+import os
+import time
+from limmy.emulator import VESCEmulator
+from limmy.VESC import VESC, DeviceProfile, ProfileCache
+from limmy.VESC.messages import GetValues, GetValuesPreV3_33
+
+
+def _columns(values_class):
+    return ['timestamp'] + [field[0] for field in values_class.fields]
+
+
+def test_samples_land_in_the_ring_buffer():
+    with VESCEmulator.loopback(v_in=36.0) as emulator:
+        with VESC(emulator.port, start_heartbeat=False) as motor:
+            stream = motor.start_stream(200, capacity=16)
+            time.sleep(0.3)
+            motor.stop_stream()
+    assert stream.buffer.columns == _columns(GetValues)
+    assert len(stream.buffer) == 16 and stream.buffer.count > 16
+    assert list(stream.column('v_in')) == [36.0] * 16
+    timestamps = list(stream.column('timestamp'))
+    assert timestamps == sorted(timestamps)
+
+
+def test_layout_follows_a_stale_cached_profile(tmpdir):
+    path = os.path.join(str(tmpdir), 'profiles.json')
+    with VESCEmulator(version='2.18.0', latency=0.02) as emulator:
+        ProfileCache(path).put(DeviceProfile(emulator.port, '6.0.1'))
+        with VESC(emulator.port, start_heartbeat=False, profile_cache=path) as motor:
+            # streaming starts with the cached layout, before the firmware probe answers
+            stream = motor.start_stream(100)
+            assert motor.profile_check.result(2).version == '2.18.0'
+            time.sleep(0.2)
+            motor.stop_stream()
+    assert stream.buffer.columns == _columns(GetValuesPreV3_33)
+    assert len(stream.buffer) > 0 and list(stream.column('v_in')) == [48.0] * len(stream.buffer)
@@ -0,0 +1,45 @@
+from limmy.protocol.interface import encode
+from limmy.protocol.packet.codec import Stateful
+from limmy.transport import LoopbackTransport
+from limmy.VESC.messages import SetCurrent, SetRPM
+from limmy.VESC.writer import Writer, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+
+
+def _written(device, writer):
+    assert writer.flush(1.0)
+    unpacker = Stateful()
+    data = device.read(device.in_waiting)
+    return [bytes(payload) for payload in unpacker.feed(data)]
+
+
+def _payloads(*msgs):
+    return [encode(msg)[2:-3] for msg in msgs]
+
+
+def test_lanes_are_written_in_priority_order():
+    host, device = LoopbackTransport.pair()
+    writer = Writer(host)
+    # queued before the thread starts, so they are all waiting in their lanes at once
+    writer.put(encode(SetRPM(1)), PRIORITY_LOW)
+    writer.put(encode(SetRPM(2)), PRIORITY_NORMAL)
+    writer.put(encode(SetRPM(3)), PRIORITY_HIGH)
+    writer.put(encode(SetRPM(4)), PRIORITY_NORMAL)
+    writer.start()
+    assert _written(device, writer) == _payloads(SetRPM(3), SetRPM(2), SetRPM(4), SetRPM(1))
+    # coalesced into one write
+    assert writer.stats()['frames'] == 4 and writer.writes == 1
+    writer.stop()
+
+
+def test_supersede_drops_queued_commands_to_the_same_target():
+    host, device = LoopbackTransport.pair()
+    writer = Writer(host)
+    writer.put(encode(SetRPM(1000)), PRIORITY_NORMAL)
+    writer.put(encode(SetRPM(2000, can_id=3)), PRIORITY_NORMAL, target=3)
+    # queued as a request, which supersede never drops
+    writer.put(encode(SetRPM(3000)), PRIORITY_LOW, is_command=False)
+    writer.put(encode(SetCurrent(0)), PRIORITY_HIGH, supersede=True)
+    writer.start()
+    assert _written(device, writer) == _payloads(SetCurrent(0), SetRPM(2000, can_id=3), SetRPM(3000))
+    assert writer.dropped == 1
+    writer.stop()